@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 from copy import deepcopy
 import csv
 import hashlib
@@ -21,7 +22,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import connection
 from django.db import transaction
-from django.db.models import F
+from django.db.models import F, Q, Count
 from django.forms.models import model_to_dict
 from django.http import Http404
 from django.http.request import HttpRequest
@@ -59,11 +60,13 @@ from db.models import ScreensaverUser, Screen, \
     ScreenKeyword, ResultValue, AssayWell, Publication
 from db.support import lims_utils, screen_result_importer
 from db.support.data_converter import default_converter
+from db.support.well_resolver import WellResolver
 from db.support.screen_result_importer import PARTITION_POSITIVE_MAPPING, \
     CONFIRMED_POSITIVE_MAPPING
 from reports import LIST_DELIMITER_SQL_ARRAY, LIST_DELIMITER_URL_PARAM, \
     HTTP_PARAM_USE_TITLES, HTTP_PARAM_USE_VOCAB, HTTP_PARAM_DATA_INTERCHANGE, \
-    LIST_BRACKETS, HTTP_PARAM_RAW_LISTS, HEADER_APILOG_COMMENT, ValidationError
+    LIST_BRACKETS, HTTP_PARAM_RAW_LISTS, HEADER_APILOG_COMMENT, ValidationError, \
+    HTTP_PARAM_PRETTY_JSON
 from reports import ValidationError, InformationError, _now
 from reports.api import API_MSG_COMMENTS, API_MSG_CREATED, \
     API_MSG_SUBMIT_COUNT, API_MSG_UNCHANGED, API_MSG_UPDATED, \
@@ -80,16 +83,22 @@ from reports.serialize import parse_val, XLSX_MIMETYPE, SDF_MIMETYPE, \
 from reports.serialize.csvutils import string_convert
 from reports.serialize.streaming_serializers import ChunkIterWrapper, \
     json_generator, cursor_generator, sdf_generator, generic_xlsx_response, \
-    csv_generator, get_xls_response, image_generator, closing_iterator_wrapper
+    csv_generator, get_xls_response, image_generator, closing_iterator_wrapper, \
+    compact_json_generator
 from reports.serializers import LimsSerializer, \
     XLSSerializer, ScreenResultSerializer
 from reports.sqlalchemy_resource import SqlAlchemyResource
 from reports.sqlalchemy_resource import _concat
+from reports.utils.pg_copy import copy_rows
+from reports.utils.table_cache import get_cached, set_cached, \
+    get_statement_tables, invalidate_tables
 from decimal import Decimal
 import six
 
 
 PLATE_NUMBER_SQL_FORMAT = 'FM9900000'
+WELL_CREATE_PLATE_BATCH_SIZE = 100
+MAX_WELL_IDS_REPORTED = 20
 PSYCOPG_NULL = '\\N'
 MAX_SPOOLFILE_SIZE = 100*1024
 API_MSG_SCREENING_PLATES_UPDATED = 'Library Plates updated'
@@ -1340,7 +1349,7 @@ class LibraryCopyPlateResource(DbApiResource):
             kwargs['parent_log'] = parent_log
             logs = self.log_patches(request, original_data, new_data,**kwargs)
             patch_count = len(logs)
-            update_count = len([x for x in logs if x.diffs ])
+            update_count = logs.diff_count
             unchanged_count = patch_count - update_count
             meta = { 
                 API_MSG_RESULT: { 
@@ -1417,6 +1426,227 @@ class LibraryCopyPlateResource(DbApiResource):
                 data=location_data,
                 **kwargs)
             return response
+
+    @write_authorization
+    @un_cache
+    @transaction.atomic
+    def patch_list(self, request, **kwargs):
+        '''
+        Patch plates in bulk:
+        - find the plates with one query, keyed on (copy_name, plate_number)
+        - find or create the (distinct) plate locations once
+        - update plates in groups having identical values
+        - create one parent log, with the plate and plate location logs
+        created in bulk
+        '''
+        logger.info('patch list, user: %r, resource: %r', 
+            request.user.username, self._meta.resource_name)
+        
+        if kwargs.get('data', None):
+            # allow for internal data to be passed
+            deserialized = kwargs['data']
+        else:
+            deserialized = self.deserialize(
+                request, format=kwargs.get('format', None), stream=True)
+        if ( isinstance(deserialized, dict) 
+                and self._meta.collection_name in deserialized ):
+            deserialized = deserialized[self._meta.collection_name]
+
+        if len(deserialized) == 0:
+            meta = { 
+                API_MSG_RESULT: {
+                    API_MSG_SUBMIT_COUNT : 0, 
+                    API_MSG_UPDATED: 0, 
+                    API_MSG_CREATED: 0,
+                    API_MSG_UNCHANGED: 0, 
+                    API_MSG_COMMENTS: 'no data patched'
+                }
+            }
+            return self.build_response(
+                request, { 'meta': meta }, response_class=HttpResponse, **kwargs)
+        if len(deserialized) == 1 or isinstance(deserialized, dict):
+            # send to patch detail to bypass parent log creation
+            if not isinstance(deserialized,dict):
+                kwargs['data'] = deserialized[0]
+            else:
+                kwargs['data'] = deserialized
+            return self.patch_detail(request, **kwargs)
+        
+        schema = kwargs['schema']
+        plate_location_fields = ['room', 'freezer', 'shelf', 'bin']
+        plate_fields = set([f.name for f in Plate._meta.fields])
+        required_kwargs_check = ['copy_name', 'plate_number']
+        
+        # Parse and validate the patches
+        kwargs_for_log = kwargs.copy()
+        patches = OrderedDict()
+        for _data in deserialized:
+            id_kwargs = self.get_id(_data, schema=schema)
+            if ( not id_kwargs 
+                    or not set(required_kwargs_check) & set(id_kwargs.keys())):
+                raise ValidationError({
+                    k:'required' for k in required_kwargs_check 
+                        if k not in id_kwargs })
+            for idkey,idval in id_kwargs.items():
+                kwargs_for_log.setdefault('%s__in' % idkey, set()).add(idval)
+            
+            initializer_dict = self.parse(_data, create=False, schema=schema)
+            errors = self.validate(initializer_dict, patch=True, schema=schema)
+            if errors:
+                raise ValidationError(errors)
+            plate_key = (
+                id_kwargs['copy_name'], int(id_kwargs['plate_number']))
+            location_key = tuple([
+                _data.get(k, None) for k in plate_location_fields])
+            if not any(location_key):
+                location_key = None
+            if plate_key in patches:
+                raise ValidationError(
+                    key='plate_number',
+                    msg='plate is submitted more than once: %s/%s' % plate_key)
+            patches[plate_key] = (initializer_dict, location_key)
+        
+        # Find the plates
+        plates = {}
+        plate_query = (
+            Plate.objects.all()
+                .filter(
+                    copy__name__in=set([x[0] for x in patches.keys()]),
+                    plate_number__in=set([x[1] for x in patches.keys()]))
+                .values_list(
+                    'copy__name', 'plate_number', 'plate_id', 
+                    'plate_location_id'))
+        for copy_name, plate_number, plate_id, plate_location_id in plate_query:
+            plate_key = (copy_name, plate_number)
+            if plate_key not in patches:
+                continue
+            if plate_key in plates:
+                raise ValidationError(
+                    key='copy_name', 
+                    msg='plate is not unique: %s/%s' % plate_key)
+            plates[plate_key] = (plate_id, plate_location_id)
+        missing_plates = [
+            '%s/%s' % patch_key for patch_key in patches.keys() 
+                if patch_key not in plates]
+        if missing_plates:
+            raise ValidationError(
+                key='plate_number',
+                msg='plates not found: %s' % ', '.join(missing_plates))
+        
+        # Find or create the plate locations
+        location_keys = set([
+            patch_location_key for _, patch_location_key in patches.values() 
+                if patch_location_key])
+        plate_locations = {}
+        original_location_data = {}
+        if location_keys:
+            location_query = Q()
+            for location_key in location_keys:
+                location_query |= Q(**dict(
+                    zip(plate_location_fields, location_key)))
+            def find_locations():
+                for plate_location in PlateLocation.objects.filter(
+                        location_query):
+                    location_key = tuple([
+                        getattr(plate_location, k) 
+                            for k in plate_location_fields])
+                    plate_locations[location_key] = \
+                        plate_location.plate_location_id
+            find_locations()
+            for location_key in location_keys:
+                if location_key in plate_locations:
+                    original_location_data[location_key] = (
+                        self.get_platelocation_resource()
+                            ._get_detail_response_internal(
+                                **dict(zip(plate_location_fields, location_key))))
+            new_locations = location_keys - set(plate_locations.keys())
+            if new_locations:
+                logger.info('create plate locations: %r', new_locations)
+                PlateLocation.objects.bulk_create([
+                    PlateLocation(**dict(zip(plate_location_fields, location_key)))
+                    for location_key in new_locations])
+                find_locations()
+        
+        # Group the plate updates by identical values
+        now = _now()
+        update_groups = {}
+        for plate_key, (initializer_dict, location_key) in patches.items():
+            plate_id, plate_location_id = plates[plate_key]
+            update = {}
+            for key, val in initializer_dict.items():
+                if key in plate_fields:
+                    update[key] = val
+                if key == 'status':
+                    if val == 'available':
+                        update['date_plated'] = now
+                    elif val in self.retired_statuses:
+                        update['date_retired'] = now
+            if location_key:
+                new_location_id = plate_locations[location_key]
+                if new_location_id != plate_location_id:
+                    update['plate_location_id'] = new_location_id
+            if update:
+                update_key = tuple(sorted(update.items()))
+                update_groups.setdefault(update_key, []).append(plate_id)
+        
+        logger.debug('get original state, for logging...')
+        original_data = self._get_list_response(request,**kwargs_for_log)
+
+        if 'parent_log' not in kwargs:
+            parent_log = self.make_log(request)
+            parent_log.key = self._meta.resource_name
+            parent_log.uri = self._meta.resource_name
+            parent_log.save()
+            kwargs['parent_log'] = parent_log
+        parent_log = kwargs['parent_log']
+        
+        logger.info('update %d plates, in %d groups', 
+            len(plates), len(update_groups))
+        for update_key, plate_ids in update_groups.items():
+            Plate.objects.filter(plate_id__in=plate_ids)\
+                .update(**dict(update_key))
+        
+        logger.info('Get new state, for logging...')
+        new_data = self._get_list_response(request,**kwargs_for_log)
+        logs = self.log_patches(request, original_data,new_data,**kwargs)
+        
+        # Log each plate location once
+        location_logs = []
+        platelocation_resource = self.get_platelocation_resource()
+        for location_key in location_keys:
+            new_location_data = (
+                platelocation_resource._get_detail_response_internal(
+                    **dict(zip(plate_location_fields, location_key))))
+            log = platelocation_resource.log_patch(
+                request, original_location_data.get(location_key, None), 
+                new_location_data, parent_log=parent_log)
+            if log:
+                location_logs.append(log)
+        ApiLog.bulk_create(location_logs)
+        logger.info('plate logs: %r, plate location logs: %d', 
+            logs, len(location_logs))
+        
+        patch_count = len(patches)
+        update_count = logs.diff_count
+        create_count = logs.create_count
+        unchanged_count = patch_count - update_count
+        meta = { 
+            API_MSG_RESULT: {
+                API_MSG_SUBMIT_COUNT : patch_count, 
+                API_MSG_UPDATED: update_count, 
+                API_MSG_CREATED: create_count,
+                API_MSG_UNCHANGED: unchanged_count, 
+                API_MSG_COMMENTS: parent_log.comment
+            }
+        }
+        if not self._meta.always_return_data:
+            return self.build_response(
+                request, { 'meta': meta }, response_class=HttpResponse, 
+                **kwargs)
+        else:
+            response = self.get_list(request, meta=meta, **kwargs_for_log)             
+            response.status_code = 200
+            return response
     
     @write_authorization
     @un_cache
@@ -1517,6 +1747,9 @@ class ScreenResultResource(DbApiResource):
         serializer = ScreenResultSerializer()
         object_class = dict
         max_limit = 10000
+        cache_tables = [
+            'data_column', 'assay_well', 'result_value', 'well_query_index',
+            'well_data_column_positive_index']
         
     def __init__(self, **kwargs):
 
@@ -1594,6 +1827,8 @@ class ScreenResultResource(DbApiResource):
                 ' REFERENCES "data_column" ("data_column_id") '
                 '    DEFERRABLE INITIALLY DEFERRED'
                 ');'
+                'CREATE INDEX well_data_column_positive_index_data_column_id '
+                ' ON well_data_column_positive_index (data_column_id);'
             ));
             logger.info('the well_data_column_positive_index table created')
         except Exception, e:
@@ -1681,14 +1916,8 @@ class ScreenResultResource(DbApiResource):
             logger.exception('on screenresult clear cache')
             raise e  
 
-        # NOTE: for now, clear the wdcpi when a new screen_result is loaded:
-        # (when "all" or "by_uri" is set)
-        # TODO: incrementally clear the wdcpi for each set of ids, or all
-        if all is True or by_uri is not None:
-            logger.info('all: %r, by_uri: %r', all, by_uri)
-            get_engine().execute(delete(self.get_well_data_column_positive_index_table()))
-            logger.info(
-                'cleared all cached well_data_column_positive_indexes')
+        # NOTE: the well_data_column_positive_index is maintained for each 
+        # screen result as it is loaded; see create_dc_positive_index
         
         self.get_screen_resource().clear_cache()
             
@@ -1733,33 +1962,84 @@ class ScreenResultResource(DbApiResource):
         kwargs['visibilities'] = kwargs.get('visibilities', ['l'])
         return self.build_list_response(request, **kwargs)
         
+    @staticmethod
+    def _get_result_value_field(field_information):
+        data_column_type = field_information.get('data_type') 
+        # TODO: column to select: use controlled vocabulary
+        if(data_column_type in ['numeric', 'decimal', 'integer']):  
+            return 'numeric_value'
+        else:
+            return 'value'
+
     def _build_result_value_column(self, field_information):
         '''
         Each result value will be added to the query as a subquery select:
         (SELECT <value_field> 
          FROM result_value
          WHERE result_value.data_column_id=<id> 
-         AND rv.well_id=assay_well.well_id limit 1) as <data_column_value_alias>
+         AND rv.well_id=assay_well.well_id 
+         ORDER BY result_value_id limit 1) as <data_column_value_alias>
         '''
         _rv = self.bridge['result_value']
         field_name = field_information['key']
-        data_column_type = field_information.get('data_type') 
-        # TODO: column to select: use controlled vocabulary
-        column_to_select = None
-        if(data_column_type in ['numeric', 'decimal', 'integer']):  
-            column_to_select = 'numeric_value'
-        else:
-            column_to_select = 'value'
+        column_to_select = self._get_result_value_field(field_information)
         
         rv_select = select([column(column_to_select)]).select_from(_rv)
         rv_select = rv_select.where(
             _rv.c.data_column_id == field_information['data_column_id'])
         rv_select = rv_select.where(_rv.c.well_id == text('assay_well.well_id'))
-        # FIXME: limit to rv's to 1 - due to the duplicated result value issue
+        # limit rv's to 1 - due to the duplicated result value issue; 
+        # use the first loaded, as for _build_result_value_pivot
+        rv_select = rv_select.order_by(_rv.c.result_value_id)
         rv_select = rv_select.limit(1)  
         rv_select = rv_select.label(field_name)
         return rv_select
 
+    def _build_result_value_pivot(self, fields, well_ids_select):
+        '''
+        Retrieve the result values for the well_ids of the well_ids_select 
+        (e.g. the current page) in a single scan of the result_value table,
+        pivoted to one row per well_id, with one column per data column:
+        SELECT well_id,
+          max(CASE WHEN data_column_id=<id> THEN <value_field> END) 
+            AS <data_column_value_alias>, ...
+        FROM (
+          SELECT DISTINCT ON (well_id, data_column_id) 
+            well_id, data_column_id, value, numeric_value
+          FROM result_value JOIN <well_ids_select> USING(well_id)
+          WHERE data_column_id IN (<ids>)
+          ORDER BY well_id, data_column_id, result_value_id ) AS rv
+        GROUP BY well_id
+        
+        Note: duplicated result values (legacy data) are resolved to the
+        first loaded (lowest result_value_id).
+        '''
+        _rv = self.bridge['result_value']
+        rv_select = (
+            select([
+                _rv.c.well_id, _rv.c.data_column_id, 
+                _rv.c.value, _rv.c.numeric_value])
+            .select_from(_rv.join(
+                well_ids_select, _rv.c.well_id == well_ids_select.c.well_id))
+            .where(_rv.c.data_column_id.in_(
+                [fi['data_column_id'] for fi in fields]))
+            .distinct(_rv.c.well_id, _rv.c.data_column_id)
+            .order_by(
+                _rv.c.well_id, _rv.c.data_column_id, _rv.c.result_value_id)
+            ).alias('rv')
+        pivot_columns = [rv_select.c.well_id]
+        for fi in fields:
+            value_column = rv_select.c[self._get_result_value_field(fi)]
+            pivot_columns.append(
+                func.max(case([(
+                    rv_select.c.data_column_id == fi['data_column_id'],
+                    value_column)])).label(fi['key']))
+        return (
+            select(pivot_columns)
+            .select_from(rv_select)
+            .group_by(rv_select.c.well_id)
+            ).alias('rv_pivot')
+
     def _build_result_value_cte(self, field_information):
         '''
         Not used - an alternate method of constructing the result values as 
@@ -2033,11 +2313,16 @@ class ScreenResultResource(DbApiResource):
 
         j = j.join(excluded_cols_select, 
             excluded_cols_select.c.well_id == _aw.c.well_id, isouter=True)
-        # Using nested selects
-        for fi in [
+        # Join the result values for the page of wells, pivoted by well_id
+        datacolumn_fields = [
             fi for fi in field_hash.values() 
-                if fi.get('is_datacolumn', None)]:
-            custom_columns[fi['key']] = self._build_result_value_column(fi)
+                if fi.get('is_datacolumn', None)]
+        if datacolumn_fields:
+            rv_pivot = self._build_result_value_pivot(datacolumn_fields, _wqx)
+            j = j.join(
+                rv_pivot, rv_pivot.c.well_id == _wqx.c.well_id, isouter=True)
+            for fi in datacolumn_fields:
+                custom_columns[fi['key']] = rv_pivot.c[fi['key']]
             
         columns = self.build_sqlalchemy_columns(
             field_hash.values(), base_query_tables=base_query_tables,
@@ -2234,9 +2519,18 @@ class ScreenResultResource(DbApiResource):
                 # Note: is_excluded generator not needed for JSON - already
                 # part of the query, and no need to convert to col letters
                 data = image_generator(data, image_keys, request) 
-                response = StreamingHttpResponse(
-                    ChunkIterWrapper(
-                        json_generator(data, meta, is_for_detail=is_for_detail)))
+                if parse_val(
+                        param_hash.get(HTTP_PARAM_PRETTY_JSON, False),
+                        HTTP_PARAM_PRETTY_JSON, 'boolean'):
+                    response = StreamingHttpResponse(
+                        ChunkIterWrapper(
+                            json_generator(
+                                data, meta, is_for_detail=is_for_detail)))
+                else:
+                    response = StreamingHttpResponse(
+                        compact_json_generator(
+                            data, meta, field_hash=field_hash, 
+                            is_for_detail=is_for_detail))
                 response['Content-Type'] = content_type
                 return response
             elif(content_type == XLS_MIMETYPE or
@@ -2277,8 +2571,33 @@ class ScreenResultResource(DbApiResource):
             logger.exception('on get list: %r', e)
             raise e  
 
-    def create_dc_positive_index(self, screen_result_id):
-        # the well_data_column_positive_index has been cleared, recreate
+    def delete_dc_positive_index(self, screen_result_id=None):
+        '''
+        Delete the well_data_column_positive_index rows for the data columns
+        of the screen result, or all rows if screen_result_id is None
+        '''
+        _dc = self.bridge['data_column']
+        _wdcpi = self.get_well_data_column_positive_index_table()
+        stmt = delete(_wdcpi)
+        if screen_result_id is not None:
+            stmt = stmt.where(_wdcpi.c.data_column_id.in_(
+                select([_dc.c.data_column_id])
+                    .where(_dc.c.screen_result_id == screen_result_id)))
+        result = get_engine().execute(stmt)
+        invalidate_tables(['well_data_column_positive_index'])
+        logger.info(
+            'deleted %d well_data_column_positive_index rows for '
+            'screen_result: %r', result.rowcount, screen_result_id or 'all')
+        
+    def create_dc_positive_index(self, screen_result_id=None):
+        '''
+        (Re)create the well_data_column_positive_index rows for the positive
+        indicator data columns of the screen result; 
+        - rows for other screen results are not affected
+        - if screen_result_id is None, the index is rebuilt for all 
+        screen results
+        '''
+        self.delete_dc_positive_index(screen_result_id)
         _aw = self.bridge['assay_well']
         _sr = self.bridge['screen_result']
         _dc = self.bridge['data_column']
@@ -2289,6 +2608,9 @@ class ScreenResultResource(DbApiResource):
                 literal_column('data_column_id')
             ]).select_from(base_stmt)            
         base_stmt = base_stmt.where(_aw.c.is_positive)
+        if screen_result_id is not None:
+            base_stmt = base_stmt.where(
+                _dc.c.screen_result_id == screen_result_id)
         base_stmt = base_stmt.where(
             _dc.c.data_type.in_([
                 'boolean_positive_indicator',
@@ -2304,14 +2626,16 @@ class ScreenResultResource(DbApiResource):
             str(insert_statement.compile(
                 dialect=postgresql.dialect(),
                 compile_kwargs={"literal_binds": True})))
-        get_engine().execute(insert_statement)
-        logger.info('mutual pos insert statement, executed.')
+        result = get_engine().execute(insert_statement)
+        invalidate_tables(['well_data_column_positive_index'])
+        logger.info(
+            'mutual pos insert statement, executed, rows: %d', result.rowcount)
 
     
     def get_mutual_positives_columns(self, screen_result_id):
         
         cache_key = '%s_mutual_positive_columns' % screen_result_id
-        cached_ids = cache.get(cache_key)
+        cached_ids = get_cached(cache_key)
         
         if not cached_ids:
         
@@ -2336,17 +2660,9 @@ class ScreenResultResource(DbApiResource):
             _sr = self.bridge['screen_result']
             _dc = self.bridge['data_column']
             
-            # Recreate the well_data_column_positive_index:
-            # Note: because this is lazy recreated, we are creating the whole 
-            # index each time; could just recreate for the specific screen
-            count_stmt = self.get_well_data_column_positive_index_table()
-            count_stmt = select([func.count()]).select_from(count_stmt)
-            count = 0
-            with get_engine().begin() as conn:
-                count = int(conn.execute(count_stmt).scalar())        
-                logger.info('well_data_column_positive_index count: %r', count)
-            if count == 0:
-                self.create_dc_positive_index(screen_result_id)
+            # Note: the well_data_column_positive_index is maintained as each
+            # screen result is loaded (see create_dc_positive_index); 
+            # use the "rebuild_positive_index" command to rebuild it
             
             # Query to find mutual positive data columns:
             
@@ -2404,7 +2720,7 @@ class ScreenResultResource(DbApiResource):
                 result = conn.execute(stmt)
                 cached_ids =  [x[0] for x in result ]
                 logger.info('done, cols %r', cached_ids)
-                cache.set(cache_key, cached_ids)
+                set_cached(cache_key, cached_ids, get_statement_tables(stmt))
         else:
             logger.info('using cached mutual positive columns')
         return cached_ids
@@ -2446,7 +2762,7 @@ class ScreenResultResource(DbApiResource):
         cache_key = 'screenresult_schema_%s_mutual_pos_%s' \
             % (screen_facility_id, show_mutual_positives)
         logger.info('build screenresult schema: %s', cache_key)
-        data = cache.get(cache_key)
+        data = get_cached(cache_key)
         
         if data is None:
             logger.info('not cached: %s', cache_key)
@@ -2537,7 +2853,9 @@ class ScreenResultResource(DbApiResource):
                     raise e  
                 
             logger.info('build screenresult schema done')
-            cache.set(cache_key, data)
+            set_cached(cache_key, data, [
+                'reports_metahash', 'reports_vocabulary', 'screen', 
+                'screen_result', 'data_column'])
         else:
             logger.info('using cached: %s', cache_key)
             
@@ -2609,6 +2927,7 @@ class ScreenResultResource(DbApiResource):
             screen_result = screen.screenresult
             logger.info('screen result: %r exists, deleting extant data',
                 screen_result)
+            self.delete_dc_positive_index(screen_result.screen_result_id)
             screen_result.datacolumn_set.all().delete()
             screen_result.assaywell_set.all().delete()
             screen_result.screen.assayplate_set\
@@ -2632,7 +2951,8 @@ class ScreenResultResource(DbApiResource):
             raise BadRequest('screen_facility_id is required')
         screen_facility_id = kwargs['screen_facility_id']
         
-        data = self.deserialize(request)
+        # Note: stream the file: result values are parsed as they are written
+        data = self.deserialize(request, stream=True)
         meta = data['meta']
         columns = data['fields']
         result_values = data['objects']
@@ -2673,6 +2993,7 @@ class ScreenResultResource(DbApiResource):
                 screen_result = screen.screenresult
                 logger.info('screen result: %r exists, deleting extant data',
                     screen_result)
+                self.delete_dc_positive_index(screen_result.screen_result_id)
                 screen_result.datacolumn_set.all().delete()
                 screen_result.assaywell_set.all().delete()
                 screen_result.screen.assayplate_set\
@@ -2751,6 +3072,7 @@ class ScreenResultResource(DbApiResource):
             except ValidationError, e:
                 logger.exception('Validation error: %r', e)
                 raise e
+            self.create_dc_positive_index(screen_result.screen_result_id)
             # END of Transaction
             
         self.create_data_loading_statistics(screen_result)
@@ -2922,6 +3244,7 @@ class ScreenResultResource(DbApiResource):
             logger.info('write temp file result values for screen: %r ...',
                 screen_result.screen.facility_id)
             errors = {}
+            well_resolver = WellResolver()
             while True:
                 try: 
                     # iterating will trigger parsing
@@ -2935,7 +3258,10 @@ class ScreenResultResource(DbApiResource):
                         if meta_field in result_row:
                             initializer_dict[meta_field] = result_row[meta_field]
 
-                    well = Well.objects.get(well_id=result_row['well_id']) 
+                    well = well_resolver.get(result_row['well_id'])
+                    if well is None:
+                        # missing wells are reported together, below
+                        continue
                     # FIXME: check for duplicate wells
                     assay_well_initializer.update({
                         'screen_result_id': screen_result.screen_result_id,
@@ -2994,6 +3320,15 @@ class ScreenResultResource(DbApiResource):
                 except StopIteration, e:
                     break
             
+            logger.info('fetched wells for result values in %d queries', 
+                well_resolver.query_count)
+            missing_well_ids = well_resolver.missing_well_ids
+            if missing_well_ids:
+                errors['well_id'] = 'wells not found: %d: %s%s' % (
+                    len(missing_well_ids),
+                    ', '.join(missing_well_ids[:MAX_WELL_IDS_REPORTED]),
+                    ', ...' if len(missing_well_ids) > MAX_WELL_IDS_REPORTED
+                        else '')
             if errors:
                 logger.warn('errors: %r', errors)
                 raise ValidationError( errors={ 'result_values': errors })
@@ -3732,110 +4067,193 @@ class CopyWellResource(DbApiResource):
     @un_cache
     @transaction.atomic
     def patch_obj(self, request, deserialized, **kwargs):
-        # TODO: optimize for list inputs (see well.patch)
         logger.debug('patch_obj %s', deserialized)
-
-        schema = kwargs['schema']
-        fields = schema['fields']
-        initializer_dict = {}
         id_kwargs = self.get_id(deserialized, validate=True, **kwargs)
-        well_id = id_kwargs['well_id']
-
-        try:
-            well = Well.objects.get(well_id=well_id)
-            library = well.library
-        except ObjectDoesNotExist:
-            msg = 'well not found: %r' % well_id
-            logger.info(msg);
-            raise Http404(msg)
-
-        if well.library_well_type != 'experimental':
-            logger.info('CopyWell patch: ignore non experimental well: %r', well_id)
+        _dict = dict(deserialized)
+        _dict.update(id_kwargs)
+        if not any(self.patch_objs(request, [_dict], **kwargs)):
             return None
-        
-        copy_name = id_kwargs['copy_name']
-        try:
-            librarycopy = Copy.objects.get(
-                name=copy_name, library=library)
-        except ObjectDoesNotExist:
-            msg = 'copy_name not found: %r' % copy_name
-            logger.info(msg);
-            raise Http404(msg)
-        
-        try:
-            plate = Plate.objects.get(
-                plate_number=well.plate_number, copy=librarycopy)
-        except ObjectDoesNotExist:
-            msg = 'plate not found: %r:%r' % (library.short_name,copy_name)
-            logger.info(msg);
-            raise Http404(msg)
-
-        # TODO: wrapper for parsing
-        logger.debug('fields: %r, deserialized: %r', fields.keys(), deserialized)
-        for key in fields.keys():
-            if deserialized.get(key, None) is not None:
-                initializer_dict[key] = parse_val(
-                    deserialized.get(key, None), key, fields[key]['data_type']) 
-
-
-        
-        volume = initializer_dict.get('volume', None)        
-        mg_ml_concentration = initializer_dict.get('mg_ml_concentration', None)
-        molar_concentration = initializer_dict.get('molar_concentration', None)
-#         adjustments = initializer_dict.get('adjustments', None)
-        
-        if volume is None and molar_concentration is None and mg_ml_concentration is None:
-            msg = (
-                'Must submit one of [volume, mg_ml_concentration, '
-                'molar_concentration]: well: %r' % well_id)
-            raise ValidationError({
-                'volume': msg,
-                'mg_ml_concentration': msg,
-                'molar_concentration': msg,
-                })
-        
-        
-        try:
-            copywell = CopyWell.objects.get(
-                well=well, copy=librarycopy)
-            
-            # FIXME: only "set" adjustments if sent from the user
-            # if volume is not None:
-            #    copywell.adjustments += 1
-        except ObjectDoesNotExist:
-            # If creating, check that something is updated from the plate values
-            if plate.remaining_well_volume == volume:
-                volume = None
-            if plate.mg_ml_concentration == mg_ml_concentration:
-                mg_ml_concentration = None
-            if plate.molar_concentration == molar_concentration:
-                molar_concentration = None
-            
-            if all(v is None for v in 
-                [volume,mg_ml_concentration,molar_concentration]):
-                logger.info('Nothing to edit for: %r', deserialized)
-                return None
-            
-            copywell = CopyWell.objects.create(
-                well=well, copy=librarycopy, plate=plate)
-            # FIXME: only "set" adjustments if sent from the user
-            # if volume is not None:
-            #    copywell.adjustments += 1
-            copywell.save()
-            logger.info('created cw: %r', copywell)
-
-        if volume is not None:
-            copywell.volume = volume
-        # if adjustments is not None:
-        #     copywell.adjustments = adjustments
-        if mg_ml_concentration is not None:
-            copywell.mg_ml_concentration = mg_ml_concentration
-        if molar_concentration is not None:
-            copywell.molar_concentration = molar_concentration
-        
-        copywell.save()
         logger.info('patch_obj done')
-        return copywell
+        return CopyWell.objects.get(
+            well_id=id_kwargs['well_id'], copy__name=id_kwargs['copy_name'])
+    
+    @transaction.atomic
+    def patch_objs(self, request, deserialized, **kwargs):
+        '''
+        Patch copy wells in bulk:
+        - items for the same copy well are merged
+        - wells, copies and plates are found once for each distinct key
+        - a single copy well is updated or created directly; otherwise, copy
+        wells are "upserted" from a staged (temporary) table, using
+        "UPDATE ... FROM" for the existing copy wells, and "INSERT ... SELECT"
+        for the new copy wells
+        @return (updated, created) counts of copy wells
+        '''
+        schema = kwargs['schema']
+        fields = schema['fields']
+        value_keys = ['volume', 'mg_ml_concentration', 'molar_concentration']
+        
+        # Parse the patches
+        patches = OrderedDict()
+        for _dict in deserialized:
+            id_kwargs = self.get_id(_dict, validate=True, **kwargs)
+            well_id = id_kwargs['well_id']
+            values = {}
+            for key in value_keys:
+                if _dict.get(key, None) is not None:
+                    values[key] = parse_val(
+                        _dict.get(key, None), key, fields[key]['data_type'])
+            if not values:
+                msg = (
+                    'Must submit one of [volume, mg_ml_concentration, '
+                    'molar_concentration]: well: %r' % well_id)
+                raise ValidationError({ key: msg for key in value_keys })
+            patches.setdefault(
+                (well_id, id_kwargs['copy_name']), {}).update(values)
+        if not patches:
+            return (0, 0)
+        
+        # Find the wells, copies, and plates
+        wells = {}
+        for well_id, library_id, plate_number, library_well_type in (
+                Well.objects.filter(
+                    well_id__in=set([x[0] for x in patches.keys()]))
+                .values_list('well_id', 'library_id', 'plate_number',
+                    'library_well_type')):
+            wells[well_id] = (library_id, plate_number, library_well_type)
+        for well_id, copy_name in patches.keys():
+            if well_id not in wells:
+                msg = 'well not found: %r' % well_id
+                logger.info(msg);
+                raise Http404(msg)
+            if wells[well_id][2] != 'experimental':
+                logger.info(
+                    'CopyWell patch: ignore non experimental well: %r', 
+                    well_id)
+                del patches[(well_id, copy_name)]
+        if not patches:
+            return (0, 0)
+        
+        copies = {}
+        for copy_id, library_id, copy_name in (
+                Copy.objects.filter(
+                    library_id__in=set([x[0] for x in wells.values()]),
+                    name__in=set([x[1] for x in patches.keys()]))
+                .values_list('copy_id', 'library_id', 'name')):
+            copies[(library_id, copy_name)] = copy_id
+        plates = {}
+        for plate_id, copy_id, plate_number, volume, mg_ml, molar in (
+                Plate.objects.filter(
+                    copy_id__in=copies.values(),
+                    plate_number__in=set([x[1] for x in wells.values()]))
+                .values_list('plate_id', 'copy_id', 'plate_number',
+                    'remaining_well_volume', 'mg_ml_concentration', 
+                    'molar_concentration')):
+            plates[(copy_id, plate_number)] = (plate_id, volume, mg_ml, molar)
+        
+        existing_copywells = set(
+            CopyWell.objects.filter(
+                copy_id__in=copies.values(),
+                well_id__in=set([x[0] for x in patches.keys()]))
+            .values_list('copy_id', 'well_id'))
+        
+        staged_rows = []
+        for (well_id, copy_name), values in patches.items():
+            (library_id, plate_number, _) = wells[well_id]
+            copy_id = copies.get((library_id, copy_name), None)
+            if copy_id is None:
+                msg = 'copy_name not found: %r' % copy_name
+                logger.info(msg);
+                raise Http404(msg)
+            plate = plates.get((copy_id, plate_number), None)
+            if plate is None:
+                msg = 'plate not found: %r:%r' % (copy_name, plate_number)
+                logger.info(msg);
+                raise Http404(msg)
+            row = [values.get(key, None) for key in value_keys]
+            if (copy_id, well_id) not in existing_copywells:
+                # If creating, check that something is updated from the 
+                # plate values
+                row = [None if val == plate_val else val 
+                    for val, plate_val in zip(row, plate[1:])]
+                if all(val is None for val in row):
+                    logger.info('Nothing to edit for: %r', well_id)
+                    continue
+            staged_rows.append([copy_id, plate[0], well_id] + row)
+        if not staged_rows:
+            return (0, 0)
+        
+        if len(staged_rows) == 1:
+            staged_row = staged_rows[0]
+            (updated, created) = self._patch_copywell(
+                value_keys, staged_row, 
+                (staged_row[0], staged_row[2]) in existing_copywells)
+        else:
+            (updated, created) = self._upsert_copywells(
+                value_keys, staged_rows)
+        logger.info('copy wells updated: %d, created: %d', updated, created)
+        
+        # Note: signals are not sent for raw updates; plate copy well 
+        # statistics are computed from copy_well when queried
+        invalidate_tables(['copy_well'])
+        return (updated, created)
+    
+    def _patch_copywell(self, value_keys, staged_row, exists):
+        '''
+        Update or create one copy well, without staging
+        '''
+        (copy_id, plate_id, well_id) = staged_row[:3]
+        values = { 
+            key: val for key, val in zip(value_keys, staged_row[3:]) 
+                if val is not None }
+        if exists:
+            CopyWell.objects.filter(copy_id=copy_id, well_id=well_id)\
+                .update(**values)
+            return (1, 0)
+        else:
+            CopyWell.objects.create(
+                copy_id=copy_id, plate_id=plate_id, well_id=well_id, **values)
+            return (0, 1)
+    
+    def _upsert_copywells(self, value_keys, staged_rows):
+        '''
+        Stage the copy well rows in a temporary table, then update the 
+        existing and insert the new copy wells
+        '''
+        logger.info('stage %d copy well patches...', len(staged_rows))
+        with connection.cursor() as cursor:
+            cursor.execute('drop table if exists copy_well_patch')
+            cursor.execute(
+                'create temporary table copy_well_patch ('
+                '  copy_id integer, plate_id integer, well_id text, '
+                '  volume numeric, mg_ml_concentration numeric, '
+                '  molar_concentration numeric ) on commit drop')
+            copy_rows(
+                cursor, 'copy_well_patch', 
+                ['copy_id', 'plate_id', 'well_id'] + value_keys, 
+                staged_rows)
+            cursor.execute(
+                'update copy_well cw set '
+                'volume = coalesce(s.volume, cw.volume), '
+                'mg_ml_concentration = coalesce('
+                '  s.mg_ml_concentration, cw.mg_ml_concentration), '
+                'molar_concentration = coalesce('
+                '  s.molar_concentration, cw.molar_concentration) '
+                'from copy_well_patch s '
+                'where cw.copy_id = s.copy_id and cw.well_id = s.well_id ')
+            updated = cursor.rowcount
+            cursor.execute(
+                'insert into copy_well (copy_id, plate_id, well_id, '
+                '  volume, mg_ml_concentration, molar_concentration) '
+                'select s.copy_id, s.plate_id, s.well_id, '
+                '  s.volume, s.mg_ml_concentration, s.molar_concentration '
+                'from copy_well_patch s '
+                'where not exists ( '
+                '  select null from copy_well cw '
+                '  where cw.copy_id = s.copy_id '
+                '  and cw.well_id = s.well_id ) ')
+            created = cursor.rowcount
+        return (updated, created)
 
 
 class CherryPickRequestResource(DbApiResource):        
@@ -4720,6 +5138,8 @@ class LibraryCopyResource(DbApiResource):
             
             library = librarycopy.library
             
+            mg_mls = []
+            molars = []
             if ( initial_plate_molar_concentration is None and 
                  initial_plate_mg_ml_concentration is None ):
                 # use the well concentrations to set the values
@@ -4754,39 +5174,27 @@ class LibraryCopyResource(DbApiResource):
                 initial_plate_molar_concentration)            
             logger.debug('create plates start: %d, end: %d',
                 library.start_plate, library.end_plate)
-            plates_created = 0
-            copywells_created = 0
-            for x in range(library.start_plate, library.end_plate + 1):
-                p = Plate.objects.create(
-                    copy=librarycopy, 
-                    plate_number=x,
-                    screening_count=0,
-                    status='not_specified',
-                    well_volume=initial_plate_well_volume,
-                    remaining_well_volume=initial_plate_well_volume,
-                    mg_ml_concentration=initial_plate_mg_ml_concentration,
-                    molar_concentration=initial_plate_molar_concentration )
-                
-                if initial_plate_status:
-                    p.status = initial_plate_status
-                    if p.status == 'available':
-                        p.date_plated = _now()
-                        # TODO: set retired if retired status
-                p.save()
-                plates_created += 1
-                if len(mg_mls)>1 or len(molars)>1:
-                    # Library contains specific well concentrations, must 
-                    # create copy_wells to reflect these concentrations
-                    logger.info('creating copywells for plate: %r', p)
-                    for well in library.well_set.all().filter(plate_number=p.plate_number):
-                        CopyWell.objects.create(
-                            well=well, copy=librarycopy, plate=p,
-                            mg_ml_concentration=well.mg_ml_concentration,
-                            molar_concentration=well.molar_concentration)
-                        copywells_created += 1
-                logger.debug('saved plate: %r', p.plate_number)
+            plate_values = OrderedDict((
+                ('status', initial_plate_status or 'not_specified'),
+                ('well_volume', initial_plate_well_volume),
+                ('remaining_well_volume', initial_plate_well_volume),
+                ('mg_ml_concentration', initial_plate_mg_ml_concentration),
+                ('molar_concentration', initial_plate_molar_concentration),
+                ('date_plated', None),
+            ))
+            if plate_values['status'] == 'available':
+                plate_values['date_plated'] = _now().date()
+                # TODO: set retired if retired status
+            # Library contains specific well concentrations, must 
+            # create copy_wells to reflect these concentrations
+            create_copywells = len(mg_mls)>1 or len(molars)>1
+            (plates_created, copywells_created) = self._create_plates(
+                librarycopy, plate_values, create_copywells=create_copywells)
             logger.info('created %d plates, %d copywells', 
                 plates_created, copywells_created)
+            self._log_plates_created(
+                request, librarycopy, plate_values, 
+                kwargs.get('log', None) or kwargs.get('parent_log', None))
             
             # TODO: return Result meta for # plates, copies created
             logger.info('patch_obj done for librarycopy: %r', librarycopy)
@@ -4796,6 +5204,92 @@ class LibraryCopyResource(DbApiResource):
             logger.exception('on patch detail')
             raise e  
 
+    def _create_plates(self, librarycopy, plate_values, create_copywells=False):
+        '''
+        Create the plates for the library plate range, using a single 
+        "INSERT ... SELECT" over generate_series
+        @param plate_values initial plate status, volume and concentrations
+        @param create_copywells if True, also create a copy well for each 
+        library well, with the well concentrations
+        @return (plates_created, copywells_created)
+        '''
+        library = librarycopy.library
+        logger.info('create plates for copy: %r, start: %d, end: %d',
+            librarycopy.name, library.start_plate, library.end_plate)
+        columns = plate_values.keys()
+        sql = (
+            'insert into plate (copy_id, plate_number, plate_type, '
+            '  facility_id, screening_count, cplt_screening_count, '
+            '  date_created, ' + ', '.join(columns) + ') '
+            'select %s, plate_number, \'\', \'\', 0, 0, %s, ' 
+            + ', '.join(['%s'] * len(columns)) + ' '
+            'from generate_series(%s, %s) as plate_number ')
+        params = (
+            [librarycopy.copy_id, _now()] + plate_values.values()
+            + [library.start_plate, library.end_plate])
+        copywells_created = 0
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            plates_created = cursor.rowcount
+            if create_copywells:
+                logger.info('creating copywells for copy: %r', librarycopy)
+                cursor.execute(
+                    'insert into copy_well (copy_id, plate_id, well_id, '
+                    '  mg_ml_concentration, molar_concentration) '
+                    'select p.copy_id, p.plate_id, w.well_id, '
+                    '  w.mg_ml_concentration, w.molar_concentration '
+                    'from well w '
+                    'join plate p on w.plate_number = p.plate_number '
+                    'where p.copy_id = %s and w.library_id = %s '
+                    'order by w.well_id ',
+                    [librarycopy.copy_id, library.library_id])
+                copywells_created = cursor.rowcount
+        # Note: signals are not sent for raw inserts
+        invalidate_tables(['plate', 'copy_well'])
+        return (plates_created, copywells_created)
+    
+    def _log_plates_created(self, request, librarycopy, plate_values, 
+            parent_log):
+        '''
+        Create the librarycopyplate logs for the created plates, in bulk; if 
+        more than settings.COPY_PLATE_LOG_SUMMARY_SIZE plates are created, 
+        create one summary log for the copy plates
+        '''
+        library = librarycopy.library
+        plate_resource = self.get_plate_resource()
+        plate_count = library.end_plate - library.start_plate + 1
+        summary_size = getattr(settings, 'COPY_PLATE_LOG_SUMMARY_SIZE', 0)
+        diffs = { key: [None, val] for key,val in plate_values.items()
+            if val is not None }
+        
+        def make_plate_log(key):
+            log = plate_resource.make_log(
+                request, api_action=API_ACTION_CREATE, parent_log=parent_log)
+            log.key = key
+            log.uri = '/'.join([log.ref_resource_name, log.key])
+            log.diffs = diffs
+            return log
+        
+        if summary_size and plate_count > summary_size:
+            log = make_plate_log(
+                '/'.join([library.short_name, librarycopy.name]))
+            log.json_field = json.dumps({
+                API_MSG_CREATED: plate_count,
+                'plate_range': [library.start_plate, library.end_plate]
+                })
+            logs = [log]
+        else:
+            logs = [
+                make_plate_log('/'.join([
+                    library.short_name, librarycopy.name, 
+                    str(plate_number).zfill(5)]))
+                for plate_number in range(
+                    library.start_plate, library.end_plate + 1)]
+        ApiLog.bulk_create(logs)
+        logger.info('created %d plate logs for copy: %r', 
+            len(logs), librarycopy.name)
+        return logs
+
 
 class PublicationResource(DbApiResource):
 
@@ -7047,8 +7541,6 @@ class LibraryScreeningResource(ActivityResource):
         # validate the plate ranges
         logger.info(
             'get the referenced plates for: %r', library_plates_screened)
-        plate_ranges = []
-        plate_keys = set()
         plate_numbers = set()
         plate_search = []
         for _data in library_plates_screened:
@@ -7095,14 +7587,8 @@ class LibraryScreeningResource(ActivityResource):
                             'Library Screening: {start_plate}-{end_plate}'
                             ).format(**_data))
                 plate_numbers.update(plate_range)
-                plate_keys.update([ '%s/%d' % (copy.name, plate_number) 
-                    for plate_number in plate_range])
                 logger.info('find the plate range: %s-%s', 
                     start_plate.plate_number, end_plate.plate_number)
-                plate_ranges.append(Plate.objects.all().filter(
-                    copy=copy,
-                    plate_number__range=(
-                        start_plate.plate_number, end_plate.plate_number)))
 
                 # Also, create a search criteria to poll current plate state
                 plate_search.append({
@@ -7117,23 +7603,33 @@ class LibraryScreeningResource(ActivityResource):
                     ('plate range not found: {start_plate}-{end_plate}'
                         ).format(**_data),
                     'copy_name': _data['copy_name'] })
-        logger.debug('plate keys: %r, plate_numbers: %r', plate_keys, plate_numbers)
+        logger.debug('plate_numbers: %r', plate_numbers)
         logger.debug('plate search 1: %r', plate_search)
         
+        # Find the screened plates: one query for all ranges
+        screened_criteria = Q()
+        for search in plate_search:
+            screened_criteria |= Q(**search)
+        screened_plates = {}
+        for plate_id, plate_number, status, copy_name in (
+                Plate.objects.filter(screened_criteria).values_list(
+                    'plate_id', 'plate_number', 'status', 'copy__name')):
+            screened_plates[plate_id] = (plate_number, status, copy_name)
+        
+        # Find the current assay plates: one query
+        current_assay_plates = library_screening.assayplate_set.all()\
+            .values_list('assay_plate_id', 'plate_number', 'plate_id', 
+                'plate__copy_id', 'plate__plate_number')
+        current_assay_plates = list(current_assay_plates)
+
         # Create a search criteria to poll the current plate state
         # TODO: cache and log the copy state as well
         existing_ranges = {}
-        if library_screening.assayplate_set.exists():
-            for ap in library_screening.assayplate_set.all():
-                # also, add to the criteria for search
-                plate_range = existing_ranges.get(ap.plate.copy_id, [])
-                if not plate_range:
-                    plate_range = [ap.plate.plate_number, ap.plate.plate_number]
-                elif plate_range[0] > ap.plate.plate_number:
-                    plate_range[0]=ap.plate.plate_number
-                elif plate_range[1] < ap.plate.plate_number:
-                    plate_range[1] = ap.plate.plate_number
-                existing_ranges[ap.plate.copy_id] = plate_range
+        for _, _, _, copy_id, plate_number in current_assay_plates:
+            plate_range = existing_ranges.setdefault(
+                copy_id, [plate_number, plate_number])
+            plate_range[0] = min(plate_range[0], plate_number)
+            plate_range[1] = max(plate_range[1], plate_number)
         # Cache plate data
         logger.debug('plate search 2: %r', plate_search)
         plate_search.extend([{'copy_id': k, 'plate_number__range': v} 
@@ -7145,100 +7641,85 @@ class LibraryScreeningResource(ActivityResource):
         # Find extant plates, find and remove deleted assay plates        
         extant_plates = set()
         deleted_plates = set()
-        if library_screening.assayplate_set.exists():
-            for ap in library_screening.assayplate_set.all():
-                found = False
-                plate_key = '%s/%d' % (ap.plate.copy.name, ap.plate.plate_number)
-                if ap.plate_number in plate_numbers:
-                    if plate_key in plate_keys:
-                        found = True
-                        extant_plates.add(ap.plate)
-                    else:
-                        # if not found, then it is a different copy, same number,
-                        # should be caught by validation
-                        raise Exception(
-                            'programming error: overlapping plate range')
-                if not found:
-                    # 20161020: no longer tracking data_load actions for an assay plate
-                    # so this is removed
-                    # if ap.screen_result_data_loading:
-                    #     raise ValidationError(
-                    #         key='library_plates_screened',
-                    #         msg=(
-                    #             'Assay plate has data and cannot be removed: %d'
-                    #             ) % ap.plate_number)
-                    deleted_plates.add(ap.plate)
-                    ap.delete()       
+        deleted_assay_plates = []
+        for assay_plate_id, plate_number, plate_id, _, _ in current_assay_plates:
+            if plate_id in screened_plates:
+                extant_plates.add(plate_id)
+            elif plate_number in plate_numbers:
+                # if not found, then it is a different copy, same number,
+                # should be caught by validation
+                raise Exception(
+                    'programming error: overlapping plate range')
+            else:
+                # 20161020: no longer tracking data_load actions for an 
+                # assay plate, so deleted assay plates are not checked
+                deleted_plates.add(plate_id)
+                deleted_assay_plates.append(assay_plate_id)
+        if deleted_assay_plates:
+            AssayPlate.objects.filter(
+                assay_plate_id__in=deleted_assay_plates).delete()
         logger.info('deleted plates: %r', deleted_plates)
 
         # Create assay plates
         # TODO: review SS1 policy on screening plates
-        created_plates = set()
-        for plate_range in plate_ranges:
-            for replicate in range(library_screening.number_of_replicates):
-                for plate in plate_range:
-                    if plate not in extant_plates:
-                        if plate.status != 'available':
-                            raise ValidationError(
-                                key='library_plates_screened',
-                                msg=  'plate: "%s/%s"; status is not "available"'\
-                                    % (plate.copy.name,plate.plate_number))
-                        ap = AssayPlate.objects.create(**{  
-                            'plate': plate,
-                            'plate_number': plate.plate_number,
-                            'screen': library_screening.screen,
-                            'library_screening': library_screening,
-                            'replicate_ordinal': replicate
-                            })
-                        ap.save()
-                        created_plates.add(plate)
-                    else:
-                        logger.debug('extant plate: %r', plate)
-        
-        # Update the plate screening related fields:
-        # TODO/Review policy: update the copy_wells if exist
-        for plate in extant_plates:
-            remaining_well_volume = plate.remaining_well_volume or Decimal(0)
-            remaining_well_volume += current_volume_tranferred_per_well
-            remaining_well_volume -= new_volume_transferred_per_well
-            plate.remaining_well_volume = remaining_well_volume
-            plate.save()
-            
-            # NOTE: usually, screening copies should not have copywells
-            # TODO: implement this if screening policy is changed to allow
-            if plate.copywell_set.exclude(volume=F('initial_volume')).exists():
-                raise NotImplementedError(
-                    'Cannot create a library screening if copy wells have been adjusted'
-                    ', plate: %r' % plate)
-                # for cw in p.copywell_set.all():
-                #     remaining_well_volume = cw.volume or Decimal(0)
-                #     remaining_well_volume += current_volume_tranferred_per_well
-                #     remaining_well_volume -= new_volume_transferred_per_well
-                #     cw.volume = remaining_well_volume
+        created_plates = set(screened_plates.keys()) - extant_plates
+        unavailable_plates = sorted([
+            '%s/%s' % (screened_plates[plate_id][2], 
+                screened_plates[plate_id][0])
+            for plate_id in created_plates 
+                if screened_plates[plate_id][1] != 'available'])
+        if unavailable_plates:
+            raise ValidationError(
+                key='library_plates_screened',
+                msg='plate: "%s"; status is not "available"'
+                    % ', '.join(unavailable_plates))
+        created_plates_ordered = sorted(
+            created_plates, key=lambda plate_id: screened_plates[plate_id][0])
+        AssayPlate.objects.bulk_create([
+            AssayPlate(
+                plate_id=plate_id,
+                plate_number=screened_plates[plate_id][0],
+                screen_id=library_screening.screen_id,
+                library_screening=library_screening,
+                replicate_ordinal=replicate)
+            for replicate in range(library_screening.number_of_replicates)
+            for plate_id in created_plates_ordered])
+        
+        # NOTE: usually, screening copies should not have copywells
+        # TODO: implement this if screening policy is changed to allow
+        adjusted_plates = (
+            CopyWell.objects
+                .filter(plate_id__in=(
+                    extant_plates | created_plates | deleted_plates))
+                .exclude(volume=F('initial_volume'))
+                .values('plate_id')
+                .annotate(adjusted_count=Count('plate_id'))
+                .order_by('plate_id'))
+        adjusted_plates = [x['plate_id'] for x in adjusted_plates]
+        if adjusted_plates:
+            raise NotImplementedError(
+                'Cannot create a library screening if copy wells have been '
+                'adjusted, plates: %r' % adjusted_plates)
         
         # Update the Plates affected:
         # - plate.screening_count and plate.remaining_well_volume 
-        for plate in created_plates:
-            plate.screening_count += 1
-            remaining_well_volume = plate.remaining_well_volume or Decimal(0)
-            remaining_well_volume -= new_volume_transferred_per_well
-            plate.remaining_well_volume = remaining_well_volume
-            plate.save()
-            if plate.copywell_set.exclude(volume=F('initial_volume')).exists():
-                raise NotImplementedError(
-                    'Cannot create a library screening if copy wells have been adjusted'
-                    ', plate: %r' % plate)
-                        
-        for plate in deleted_plates:
-            plate.screening_count -= 1
-            remaining_well_volume = plate.remaining_well_volume or Decimal(0)
-            remaining_well_volume += current_volume_tranferred_per_well
-            plate.remaining_well_volume = remaining_well_volume
-            plate.save()
-            if plate.copywell_set.exclude(volume=F('initial_volume')).exists():
-                raise NotImplementedError(
-                    'Cannot create a library screening if copy wells have been adjusted'
-                    ', plate: %r' % plate)
+        # TODO/Review policy: update the copy_wells if exist
+        current_volume_tranferred_per_well = \
+            current_volume_tranferred_per_well or Decimal(0)
+        new_volume_transferred_per_well = \
+            new_volume_transferred_per_well or Decimal(0)
+        plate_updates = []
+        for plate_id in extant_plates:
+            plate_updates.append((plate_id, 0, 
+                current_volume_tranferred_per_well 
+                    - new_volume_transferred_per_well))
+        for plate_id in created_plates:
+            plate_updates.append(
+                (plate_id, 1, -new_volume_transferred_per_well))
+        for plate_id in deleted_plates:
+            plate_updates.append(
+                (plate_id, -1, current_volume_tranferred_per_well))
+        self._update_plate_screening(plate_updates)
 
         # Fetch the new Plate state: log plate volume changes, screening count
         _new_plate_data = self.get_plate_resource()._get_list_response(
@@ -7261,6 +7742,34 @@ class LibraryScreeningResource(ActivityResource):
             API_MSG_SCREENING_DELETED_PLATE_COUNT: len(deleted_plates)
             }
     
+    def _update_plate_screening(self, plate_updates):
+        '''
+        Update plate.screening_count and plate.remaining_well_volume, using a
+        single "UPDATE ... FROM (VALUES ...)" statement
+        @param plate_updates sequence of 
+            (plate_id, screening_count_delta, remaining_well_volume_delta)
+        '''
+        if not plate_updates:
+            return 0
+        values_sql = ', '.join(
+            ['(%s::integer, %s::integer, %s::numeric)'] * len(plate_updates))
+        sql = (
+            'update plate p set '
+            'screening_count = coalesce(p.screening_count, 0) + v.count_delta, '
+            'remaining_well_volume = '
+            'coalesce(p.remaining_well_volume, 0) + v.volume_delta '
+            'from ( values ' + values_sql + ' ) '
+            'as v(plate_id, count_delta, volume_delta) '
+            'where p.plate_id = v.plate_id ')
+        params = [val for plate_update in plate_updates for val in plate_update]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            count = cursor.rowcount
+        # Note: signals are not sent for raw updates, or bulk creates
+        invalidate_tables(['plate', 'assay_plate'])
+        logger.info('updated plates: %d', count)
+        return count
+    
     @write_authorization
     @un_cache        
     @transaction.atomic    
@@ -10719,19 +11228,24 @@ class WellResource(DbApiResource):
         logger.info(
             'patch_list: WellResource: library: %r...', library.short_name)
          
-        deserialized = self.deserialize(request)
-        if self._meta.collection_name in deserialized:
+        # Note: stream the file: the rows are read again for each pass, and
+        # prepared for patching by prepare_wells
+        deserialized = self.deserialize(request, stream=True)
+        if ( isinstance(deserialized, dict) 
+                and self._meta.collection_name in deserialized ):
             deserialized = deserialized[self._meta.collection_name]
  
         schema = kwargs['schema']
         id_attribute = schema['id_attribute']
         kwargs_for_log = kwargs.copy()
-        for id_field in id_attribute:
-            ids = set()
+        id_field_values = { id_field: set() for id_field in id_attribute }
+        for _dict in deserialized:
             # Test for each id key; it's ok on create for ids to be None
             # TODO: this could be optimized to make the query smaller
-            for _dict in [x for x in deserialized if x.get(id_field, None)]:
-                ids.add(_dict.get(id_field))
+            for id_field, ids in id_field_values.items():
+                if _dict.get(id_field, None):
+                    ids.add(_dict.get(id_field))
+        for id_field, ids in id_field_values.items():
             if ids:
                 kwargs_for_log['%s__in' % id_field] = \
                     LIST_DELIMITER_URL_PARAM.join(ids)
@@ -10768,36 +11282,65 @@ class WellResource(DbApiResource):
         if len(well_map) == 0:
             raise BadRequest('Library wells have not been created')
          
-        logger.info('patch wells, count: %d', len(deserialized))
+        def prepare_wells(rows, resolve_duplex_wells=False):
+            '''
+            Set the library_short_name, well_id, and well (and, for the 
+            reagent patch, the duplex wells) of each row; applied on each pass
+            over the (streamed) rows
+            '''
+            for well_data in rows:
+                well_data['library_short_name'] = kwargs['library_short_name']
+                 
+                well_id = well_data.get('well_id', None)
+                if not well_id:
+                    well_name = well_data.get('well_name', None)
+                    plate_number = well_data.get('plate_number', None)
+                    if well_name and plate_number:                
+                        well_id = '%s:%s' % (
+                            str(plate_number).zfill(5), well_name)
+     
+                if not well_id:
+                    raise ValidationError(
+                        key='well_id',
+                        msg='well_id is required')
+                
+                well = well_map.get(well_id, None)
+                if not well:
+                    raise ValidationError(
+                        key='well_id',
+                        msg=('well %r not found for this library %r'
+                            % (well_id, well_data['library_short_name']))
+                    )
+                well_data['well_id'] = well_id
+                well_data['well'] = well
+            
+                duplex_wells = []
+                if resolve_duplex_wells and well_data.get('duplex_wells', None):
+                    if not library.is_pool:
+                        raise ValidationError(
+                            key='duplex_wells',
+                            msg='library is not a pool libary: %r' 
+                                % library.short_name)
+                    
+                    # TODO: batch get/set all of the duplex wells as well
+                    well_ids = well_data['duplex_wells']
+                    for duplex_well_id in well_ids:
+                        try:
+                            duplex_wells.append(
+                                Well.objects.get(well_id=duplex_well_id))
+                        except:
+                            raise ValidationError(
+                                key='duplex_well not found',
+                                msg='well: %r, pool well: %r' 
+                                    % (well.well_id, duplex_well_id))
+                    well_data['duplex_wells'] = duplex_wells
+                yield well_data
+        
+        logger.info('patch wells...')
         # Note: wells can only be created on library creation
         fields = schema['update_fields']
-        for i,well_data in enumerate(deserialized):
-            well_data['library_short_name'] = kwargs['library_short_name']
-             
-            well_id = well_data.get('well_id', None)
-            if not well_id:
-                well_name = well_data.get('well_name', None)
-                plate_number = well_data.get('plate_number', None)
-                if well_name and plate_number:                
-                    well_id = '%s:%s' % (
-                        str(plate_number).zfill(5), well_name)
-                    well_data['well_id'] = well_id
- 
-            if not well_id:
-                raise ValidationError(
-                    key='well_id',
-                    msg='well_id is required')
-            
-            well = well_map.get(well_id, None)
-            if not well:
-                raise ValidationError(
-                    key='well_id',
-                    msg=('well %r not found for this library %r'
-                        % (well_id, well_data['library_short_name']))
-                )
-            well_data['well_id'] = well_id
-            well_data['well'] = well
-
+        for i,well_data in enumerate(prepare_wells(deserialized)):
+            well = well_data['well']
             initializer_dict = self.parse(well_data, fields=fields)
             for key, val in initializer_dict.items():
                 if hasattr(well, key):
@@ -10805,29 +11348,13 @@ class WellResource(DbApiResource):
             
             well.save()
         
-            duplex_wells = []
-            if well_data.get('duplex_wells', None):
-                if not library.is_pool:
-                    raise ValidationError(
-                        key='duplex_wells',
-                        msg='library is not a pool libary: %r' % library.short_name)
-                
-                # TODO: batch get/set all of the duplex wells as well
-                well_ids = well_data['duplex_wells']
-                for well_id in well_ids:
-                    try:
-                        duplex_wells.append(Well.objects.get(well_id=well_id))
-                    except:
-                        raise ValidationError(
-                            key='duplex_well not found',
-                            msg='well: %r, pool well: %r' % (well.well_id, well_id))
-                well_data['duplex_wells'] = duplex_wells
             if i % 999 == 0:
                 logger.info('patched: %d wells', i+1)
         logger.info('patched %d wells', i+1)
 
         self.get_reagent_resource().\
-            get_reagent_resource(library.classification)._patch_wells(deserialized)        
+            get_reagent_resource(library.classification)._patch_wells(
+                prepare_wells(deserialized, resolve_duplex_wells=True))
         
         library.save()
         
@@ -10853,11 +11380,12 @@ class WellResource(DbApiResource):
          
         original_data_patches_only = []
         new_data_patches_only = []
+        new_data_index = { new_item['well_id']:new_item for new_item in new_data }
         for item in original_data:
-            for new_item in new_data:
-                if item['well_id'] == new_item['well_id']:
-                    original_data_patches_only.append(item)
-                    new_data_patches_only.append(new_item)
+            new_item = new_data_index.get(item['well_id'])
+            if new_item is not None:
+                original_data_patches_only.append(item)
+                new_data_patches_only.append(new_item)
          
         logger.debug('new data: %s', new_data_patches_only)
         logger.info('patch list done, original_data: %d, new data: %d' 
@@ -10868,7 +11396,7 @@ class WellResource(DbApiResource):
 
         patch_count = len(deserialized)
         # Update: for wells, only measure what has diffed
-        update_count = len([x for x in logs if x.diffs ])
+        update_count = logs.diff_count
         # Create: measure what is reported created (new_data), subtract updates,
         # because create actions are not included in updates for well patching.
         create_count = 0
@@ -10967,6 +11495,7 @@ class LibraryResource(DbApiResource):
         filtering = {}
         serializer = LimsSerializer()
         always_return_data = True 
+        cache_tables = ['well']
         
     def __init__(self, **kwargs):
         
@@ -11388,29 +11917,8 @@ class LibraryResource(DbApiResource):
 
             # now create the wells
             if create is True:
-                plate_size = int(library.plate_size)
-        
                 try:
-                    i = 0
-                    logger.info('bulk create wells: %s-%s', 
-                        library.start_plate, library.end_plate)
-                    for plate in range(
-                            int(library.start_plate), int(library.end_plate) + 1):
-                        bulk_create_wells = []
-                        for index in range(0, plate_size):
-                            well = Well()
-                            well.well_name = lims_utils.well_name_from_index(
-                                index, plate_size)
-                            well.well_id = lims_utils.well_id(plate, well.well_name)
-                            well.library = library
-                            well.plate_number = plate
-                            # FIXME: use vocabularies for well type
-                            well.library_well_type = 'undefined'
-                            bulk_create_wells.append(well)
-                            i += 1
-                            if i % 1000 == 0:
-                                logger.info('created %d wells', i)
-                        Well.objects.bulk_create(bulk_create_wells)
+                    i = self._create_wells(library)
                     logger.info(
                         'created %d wells for library %r, %r',
                         i, library.short_name, library.library_id)
@@ -11429,6 +11937,44 @@ class LibraryResource(DbApiResource):
             logger.exception('on patch detail')
             raise e  
     
+    def _create_wells(self, library, batch_size=WELL_CREATE_PLATE_BATCH_SIZE):
+        '''
+        Create the (undefined) wells for the library plate range, using
+        "INSERT ... SELECT" over generate_series for the plates, and the well
+        names of the plate size; plates are inserted in batches of batch_size,
+        to report progress.
+        @return the number of wells created
+        '''
+        start_plate = int(library.start_plate)
+        end_plate = int(library.end_plate)
+        well_names = list(lims_utils.well_names(int(library.plate_size)))
+        logger.info('bulk create wells: %s-%s', start_plate, end_plate)
+        
+        # FIXME: use vocabularies for well type
+        sql = (
+            'insert into well (well_id, plate_number, well_name, library_id, '
+            '  library_well_type, is_deprecated) '
+            'select to_char(p.plate_number, %s) || \':\' || n.well_name, '
+            '  p.plate_number, n.well_name, %s, %s, false '
+            'from generate_series(%s, %s) as p(plate_number) '
+            'cross join ( '
+            '  select (%s::text[])[i] as well_name, i as ordinal '
+            '  from generate_subscripts(%s::text[], 1) as i ) as n '
+            'order by p.plate_number, n.ordinal ')
+        count = 0
+        with connection.cursor() as cursor:
+            for batch_start in range(start_plate, end_plate + 1, batch_size):
+                batch_end = min(batch_start + batch_size - 1, end_plate)
+                cursor.execute(sql, [
+                    PLATE_NUMBER_SQL_FORMAT, library.library_id, 'undefined',
+                    batch_start, batch_end, well_names, well_names])
+                count += cursor.rowcount
+                logger.info('created %d wells, plates: %d-%d of %d-%d', 
+                    count, batch_start, batch_end, start_plate, end_plate)
+        # Note: signals are not sent for raw inserts
+        invalidate_tables(['well'])
+        return count
+    
 
 class ResourceResource(reports.api.ResourceResource):
     '''
@@ -11440,7 +11986,7 @@ class ResourceResource(reports.api.ResourceResource):
         
         resources = None
         if self.use_cache:
-            resources = cache.get('dbresources')
+            resources = get_cached('dbresources')
         if not resources:
 
             resources = super(ResourceResource, self)._build_resources(use_cache=False)
@@ -11448,10 +11994,16 @@ class ResourceResource(reports.api.ResourceResource):
             for key,resource in resources.items():
                 self.extend_resource_specific_data(resource)
                 
-            cache.set('dbresources', resources)
+            set_cached(
+                'dbresources', resources, self.get_resources_cache_tables())
     
         return resources
     
+    def get_resources_cache_tables(self):
+        return [
+            'reports_metahash', 'reports_vocabulary', 'library', 'plate', 
+            'screen']
+    
     def extend_resource_specific_data(self, resource_data):
         
         key = resource_data['key']
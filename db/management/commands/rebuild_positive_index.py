@@ -0,0 +1,53 @@
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from db.api import ScreenResultResource
+from db.models import ScreenResult
+
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    '''
+    Rebuild the well_data_column_positive_index (used to find the mutual
+    positive data columns of screen results):
+    - for the screen result of one screen, or for all screen results
+    '''
+    help = '''Rebuild the well_data_column_positive_index
+            for one screen (--screen) or all screens (--all)
+            '''
+    option_list = BaseCommand.option_list + (
+        make_option('-s', '--screen', action='store', dest='screen',
+                    metavar='FACILITY_ID',
+                    help='screen facility id of the screen result to rebuild'),
+        make_option('-a', '--all', action='store_true', dest='all',
+                    default=False,
+                    help='rebuild the index for all screen results'),
+        )
+
+    def handle(self, *args, **options):
+        logger.info('rebuild_positive_index, options: %r', options)
+
+        screen_facility_id = options['screen']
+        if not screen_facility_id and not options['all']:
+            raise CommandError(
+                'Option `--screen=...` or `--all` must be specified.')
+
+        resource = ScreenResultResource()
+        with transaction.atomic():
+            if options['all']:
+                resource.create_dc_positive_index()
+            else:
+                try:
+                    screen_result = ScreenResult.objects.get(
+                        screen__facility_id=screen_facility_id)
+                except ScreenResult.DoesNotExist:
+                    raise CommandError(
+                        'no screen result found for screen: %r'
+                        % screen_facility_id)
+                resource.create_dc_positive_index(
+                    screen_result.screen_result_id)
+        logger.info('rebuild_positive_index: done')
@@ -0,0 +1,204 @@
+from __future__ import unicode_literals
+'''
+On disk cache for rendered structure images:
+- entries are addressed by the hash of the source key (well_id or SMILES
+string) and the render size
+- entries are written once, and served as stored bytes (no image decoding)
+- the cache is bounded by IMAGE_CACHE_MAX_SIZE; least recently used entries
+are evicted first (access times are recorded on cache hits)
+'''
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+from db import WELL_ID_PATTERN
+
+
+logger = logging.getLogger(__name__)
+
+# minimum interval (seconds) between access time updates for a cache entry
+ACCESS_TIME_RESOLUTION = 3600
+# after eviction, the cache is reduced to this fraction of the max size
+EVICTION_TARGET_RATIO = 0.9
+
+
+def get_well_image_path(well_id):
+    '''
+    @return the path to the source structure image for the well_id in the
+    WELL_STRUCTURE_IMAGE_DIR, or None if the well_id is not valid
+    '''
+    match = WELL_ID_PATTERN.match(well_id)
+    if not match:
+        return None
+    _plate = match.group(1)
+    _well_name = match.group(2)
+    _name = '%s%s.png' % (_plate,_well_name)
+    structure_image_dir = os.path.abspath(settings.WELL_STRUCTURE_IMAGE_DIR)
+    return os.path.join(structure_image_dir, _plate, _name)
+
+def get_etag(path, stat=None):
+    if stat is None:
+        stat = os.stat(path)
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+def is_not_modified(request, etag, last_modified):
+    '''
+    Evaluate the conditional GET headers of the request
+    @param last_modified timestamp (seconds since epoch)
+    '''
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = [x.strip() for x in if_none_match.split(',')]
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since:
+        return int(last_modified) <= if_modified_since
+    return False
+
+def set_cache_headers(response, path, stat=None):
+    if stat is None:
+        stat = os.stat(path)
+    response['ETag'] = get_etag(path, stat)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+class ImageCache(object):
+    '''
+    Size bounded, least recently used, on disk image cache
+    '''
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # Note: the size is tracked per process, and recalculated on eviction
+        self.current_size = None
+        self.lock = threading.Lock()
+
+    def get_path(self, key, size=None):
+        digest = hashlib.sha1(
+            ('%s_%s' % (key, size)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], '%s.png' % digest)
+
+    def get(self, key, size=None):
+        '''
+        @return the path to the cached image for the key and size, or None
+        '''
+        path = self.get_path(key, size)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        now = time.time()
+        if now - stat.st_atime > ACCESS_TIME_RESOLUTION:
+            # record the access time for LRU eviction; keep the mtime
+            # for the ETag and Last-Modified headers
+            try:
+                os.utime(path, (now, stat.st_mtime))
+            except OSError, e:
+                logger.warn('could not set access time: %r, %r', path, e)
+        return path
+
+    def put(self, key, image_data, size=None):
+        '''
+        Store the image_data for the key and size.
+        @return the path to the cached image
+        '''
+        path = self.get_path(key, size)
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by another process
+                if not os.path.isdir(dirname):
+                    raise
+        # write to a temp file and rename, so that readers never see a
+        # partially written file
+        (fd, temp_path) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image_data)
+            os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._add_size(len(image_data))
+        return path
+
+    def get_or_render(self, key, render_function, size=None):
+        '''
+        @param render_function function returning the image data (bytes)
+        @return the path to the cached image, rendered if not yet cached
+        '''
+        path = self.get(key, size)
+        if path is None:
+            path = self.put(key, render_function(), size)
+        return path
+
+    def _add_size(self, bytecount):
+        with self.lock:
+            if self.current_size is None:
+                self.current_size = self._calculate_size()
+            else:
+                self.current_size += bytecount
+            if self.current_size > self.max_size:
+                self.evict()
+
+    def _list_entries(self):
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith('.png'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    entries.append((path, os.stat(path)))
+                except OSError:
+                    # removed by another process
+                    pass
+        return entries
+
+    def _calculate_size(self):
+        return sum([stat.st_size for path, stat in self._list_entries()])
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache size is
+        reduced to EVICTION_TARGET_RATIO of the max_size
+        '''
+        entries = self._list_entries()
+        current_size = sum([stat.st_size for path, stat in entries])
+        target_size = self.max_size * EVICTION_TARGET_RATIO
+        removed = 0
+        for path, stat in sorted(entries, key=lambda x: x[1].st_atime):
+            if current_size <= target_size:
+                break
+            try:
+                os.remove(path)
+                current_size -= stat.st_size
+                removed += 1
+            except OSError:
+                pass
+        logger.info('image cache eviction: removed %d entries, size: %d',
+            removed, current_size)
+        self.current_size = current_size
+
+_image_cache = None
+
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = ImageCache(
+            getattr(settings, 'IMAGE_CACHE_DIR',
+                os.path.join(settings.TEMP_FILE_DIR, 'image_cache')),
+            getattr(settings, 'IMAGE_CACHE_MAX_SIZE', 500*1024**2))
+    return _image_cache
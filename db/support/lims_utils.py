@@ -26,4 +26,19 @@ def well_name_from_index(index, platesize):
     cols = get_cols(platesize)
     name = well_name((index%cols)+1, int(index/cols))
 #     logger.info(str((name, index,rows, cols, platesize)))
-    return name
\ No newline at end of file
+    return name
+
+_well_names = {}
+
+def well_names(platesize):
+    '''
+    @return the well names for the platesize, in index order; computed once
+    for each platesize
+    '''
+    names = _well_names.get(platesize, None)
+    if names is None:
+        names = tuple([
+            well_name_from_index(index, platesize) 
+                for index in range(0, platesize)])
+        _well_names[platesize] = names
+    return names
\ No newline at end of file
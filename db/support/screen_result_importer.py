@@ -1,9 +1,10 @@
 from __future__ import unicode_literals
 
 import argparse
+import io
 import xlrd
 import re
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.utils import get_column_letter
 
 import logging
@@ -16,7 +17,7 @@ from xlsxwriter.utility import xl_col_to_name
 logger = logging.getLogger(__name__)
 
 from reports.serialize.xlsutils import sheet_cols, sheet_rows, \
-    workbook_sheets, generic_xls_write_workbook
+    workbook_sheets, generic_xls_write_workbook, read_cell_value, is_xlsx
 
 
 PARTITION_POSITIVE_MAPPING = {
@@ -71,9 +72,69 @@ RESULT_VALUE_FIELD_MAP = OrderedDict((
     ('type', 'assay_well_control_type'),
     ('exclude', 'exclude'),
 ))
+RESULT_VALUE_META_COLUMNS = frozenset(RESULT_VALUE_FIELD_MAP.values())
 WELLNAME_MATCHER = re.compile(r'^[a-pA-P]{1,2}\d{1,2}$')
 
 
+class XlrdSheet(object):
+    '''
+    Sheet adapter for xlrd sheets
+    '''
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.name = sheet.name
+    
+    def rows(self):
+        return sheet_rows(self.sheet)
+    
+    def cols(self):
+        return sheet_cols(self.sheet)
+
+
+class ReadOnlySheet(object):
+    '''
+    Sheet adapter for openpyxl "read_only" worksheets: rows are read as they
+    are iterated
+    '''
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.name = worksheet.title
+    
+    def rows(self):
+        for row in self.worksheet.iter_rows():
+            yield [read_cell_value(cell.value) for cell in row]
+    
+    def cols(self):
+        # Note: reads the sheet into memory; for the (small) "Screen Info" and
+        # "Data Columns" sheets only
+        rows = list(self.rows())
+        width = max([len(row) for row in rows] or [0])
+        for i in range(width):
+            yield [row[i] if i < len(row) else None for row in rows]
+
+
+def get_sheets(wb):
+    '''
+    @return an iterator of the sheet adapters for an xlrd or openpyxl workbook
+    '''
+    if isinstance(wb, xlrd.book.Book):
+        for sheet in workbook_sheets(wb):
+            yield XlrdSheet(sheet)
+    else:
+        for worksheet in wb.worksheets:
+            yield ReadOnlySheet(worksheet)
+
+def open_workbook(content):
+    '''
+    Open the workbook file (or file contents): xlsx files are opened in 
+    openpyxl "read_only" mode, xls files using xlrd
+    '''
+    if not hasattr(content, 'read'):
+        content = io.BytesIO(content)
+    if is_xlsx(content):
+        return load_workbook(content, read_only=True, data_only=True)
+    return xlrd.open_workbook(file_contents=content.read())
+
 def data_column_field_mapper(fields):
     mapped_keys = []
     for key in fields:
@@ -96,7 +157,7 @@ def data_column_field_mapper(fields):
 
 def parse_columns(columns_sheet):
     logger.info('parsing columns sheet: %r', columns_sheet.name)
-    columns = data_column_generator(sheet_cols(columns_sheet))
+    columns = data_column_generator(columns_sheet.cols())
     parsed_cols = OrderedDict()
     errors = {}
     for i,column in enumerate(columns):
@@ -142,7 +203,7 @@ def result_value_field_mapper(header_row, parsed_columns):
     mapped_row = []
     header_row = [x for x in header_row]
     for i,value in enumerate(header_row):
-        if value.lower() in RESULT_VALUE_FIELD_MAP:
+        if value and value.lower() in RESULT_VALUE_FIELD_MAP:
             mapped_row.append(RESULT_VALUE_FIELD_MAP[value.lower()])
         else:
             colname = xlrd.book.colname(i)
@@ -167,7 +228,7 @@ def parse_result_values(parsed_columns, sheets):
     for sheet in sheets:
         logger.info('parse result values sheet: %r...', sheet.name)
     
-        rows = sheet_rows(sheet)
+        rows = sheet.rows()
         try:
             header_row = result_value_field_mapper(rows.next(), parsed_columns)
         except ValidationError, e:
@@ -323,7 +384,6 @@ def parse_result_row(i,parsed_columns,result_row):
     
     logger.debug('parse result row: %r', result_row)
     
-    meta_columns = RESULT_VALUE_FIELD_MAP.values()
     parsed_row = {}
     excluded_cols = []
     
@@ -363,8 +423,8 @@ def parse_result_row(i,parsed_columns,result_row):
             excluded_cols = parsed_columns.keys()
         else:
             excluded_cols = [x.strip().upper() for x in val.split(',')]
-            unknown_excluded_cols = (
-                set(excluded_cols) - set(parsed_columns.keys()))
+            unknown_excluded_cols = set([
+                x for x in excluded_cols if x not in parsed_columns])
             if unknown_excluded_cols:
                 raise ValidationError(
                     key = parsed_row['well_id'],
@@ -372,7 +432,7 @@ def parse_result_row(i,parsed_columns,result_row):
             parsed_row[meta_key] = excluded_cols
             
     for colname, raw_val in result_row.items():
-        if colname in meta_columns:
+        if colname in RESULT_VALUE_META_COLUMNS:
             continue
         if colname not in parsed_columns:
             # NOTE: this is no longer an error, as the result value sheet may
@@ -429,12 +489,18 @@ def data_column_generator(data_columns):
         yield dict(zip(fields,col_def))
 
 def read_workbook(wb):
+    '''
+    Read the screen result workbook
+    @param wb an xlrd workbook, or an openpyxl (read_only) workbook
+    @return the meta, fields, and the result values (a generator: result 
+    value rows are parsed as they are iterated)
+    '''
     try:
         logger.info('read screen result file sheets...')
-        sheets = workbook_sheets(wb)
+        sheets = get_sheets(wb)
         sheet = sheets.next()
         logger.info('read Screen Info sheet: %r', sheet.name)
-        meta_cols = sheet_cols(sheet)
+        meta_cols = sheet.cols()
         meta_raw = dict(zip(meta_cols.next(),meta_cols.next()))
         meta = { META_MAP.get(key, key):val for key,val in meta_raw.items() }
         
@@ -557,6 +623,9 @@ def create_output_data(screen_facility_id, fields, result_values ):
         # TODO: allow column titles to be optional
         header_row.extend([fields[key].get('title', key) for key in data_columns])
         header_row.extend(other_columns)
+        data_column_letters = {
+            key: get_column_letter(len(RESULT_VALUE_FIELD_MAP)+1+i)
+                for i,key in enumerate(data_columns) }
 
         row_count = 0
         for result_value in result_values:
@@ -582,11 +651,9 @@ def create_output_data(screen_facility_id, fields, result_values ):
                 if hasattr(temp, 'split'):
                     temp = temp.split(LIST_DELIMITER_SQL_ARRAY)
                 logger.debug('excluded data_columns: find %r, in %r', temp, data_columns)    
-                for data_column_name in temp:
-                    excluded_cols.append(get_column_letter(
-                        len(RESULT_VALUE_FIELD_MAP)+1
-                            +data_columns.index(data_column_name)))
-                    excluded_cols = sorted(excluded_cols)
+                excluded_cols = sorted([
+                    data_column_letters[data_column_name] 
+                        for data_column_name in temp])
             row.append(','.join(excluded_cols))
             
             for j,key in enumerate(data_columns):
@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+'''
+Plate batched Well lookup, for bulk loading of well keyed input (e.g. screen
+result values):
+- the wells for a range of plates are fetched with one query, the first time
+a plate in the range is requested
+- well_ids that cannot be found are recorded, so that they may be reported
+together
+'''
+from collections import OrderedDict
+import logging
+
+from db import WELL_ID_PATTERN
+from db.models import Well
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLATE_CHUNK_SIZE = 10
+DEFAULT_MAX_CACHED_CHUNKS = 4
+
+
+class WellResolver(object):
+    '''
+    Resolve well_ids to Well instances, fetching the wells for each chunk of
+    plate_chunk_size plates at once; at most max_cached_chunks chunks are
+    retained (input is expected to be ordered by plate).
+    '''
+
+    def __init__(self, plate_chunk_size=DEFAULT_PLATE_CHUNK_SIZE,
+            max_cached_chunks=DEFAULT_MAX_CACHED_CHUNKS,
+            fields=('well_id','plate_number','well_name','library_well_type')):
+        self.plate_chunk_size = plate_chunk_size
+        self.max_cached_chunks = max_cached_chunks
+        self.fields = fields
+        self.chunks = OrderedDict()
+        self.missing_well_ids = []
+        self.query_count = 0
+
+    def _get_chunk(self, plate_number):
+        chunk_start = plate_number - (plate_number % self.plate_chunk_size)
+        chunk = self.chunks.get(chunk_start)
+        if chunk is None:
+            chunk_end = chunk_start + self.plate_chunk_size - 1
+            query = Well.objects.filter(
+                plate_number__range=(chunk_start, chunk_end))
+            if self.fields:
+                query = query.only(*self.fields)
+            chunk = { well.well_id: well for well in query }
+            self.query_count += 1
+            logger.debug('fetched %d wells for plates %d-%d',
+                len(chunk), chunk_start, chunk_end)
+            if len(self.chunks) >= self.max_cached_chunks:
+                self.chunks.popitem(last=False)
+            self.chunks[chunk_start] = chunk
+        return chunk
+
+    def get(self, well_id):
+        '''
+        @return the Well for the well_id, or None if not found; missing
+        well_ids are recorded in missing_well_ids
+        '''
+        well = None
+        match = WELL_ID_PATTERN.match(well_id or '')
+        if match and match.group(1):
+            well = self._get_chunk(int(match.group(1))).get(well_id)
+        if well is None:
+            self.missing_well_ids.append(well_id)
+        return well
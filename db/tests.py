@@ -6,12 +6,15 @@ import json
 import logging
 import os
 import re
+import shutil
 import sys
+import tempfile
 
 from django.contrib.auth.models import User
 from django.core.urlresolvers import resolve
 from django.db import connection
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase
+from django.test.client import RequestFactory
 from django.test.client import MULTIPART_CONTENT
 from django.utils.timezone import now
 from tastypie.test import ResourceTestCase, TestApiClient
@@ -21,7 +24,8 @@ from db.models import Reagent, Substance, Library, ScreensaverUser, \
     UserChecklistItem, AttachedFile, ServiceActivity, Screen, Well, Publication, \
     PlateLocation, LibraryScreening
 import db.models
-from db.support import lims_utils, screen_result_importer
+from db.support import lims_utils, screen_result_importer, image_cache
+from db.support.well_resolver import WellResolver
 from db.test.factories import LibraryFactory, ScreenFactory, \
     ScreensaverUserFactory
 from reports import ValidationError, HEADER_APILOG_COMMENT, _now
@@ -30,10 +34,12 @@ from reports.api import API_MSG_COMMENTS, API_MSG_CREATED, \
     API_MSG_ACTION, API_MSG_RESULT
 from db.api import API_MSG_SCREENING_PLATES_UPDATED, \
     API_MSG_SCREENING_ADDED_PLATE_COUNT, API_MSG_SCREENING_DELETED_PLATE_COUNT,\
-    API_MSG_SCREENING_EXTANT_PLATE_COUNT,API_MSG_SCREENING_TOTAL_PLATE_COUNT
+    API_MSG_SCREENING_EXTANT_PLATE_COUNT,API_MSG_SCREENING_TOTAL_PLATE_COUNT, \
+    CopyWellResource
 from reports.models import ApiLog, UserProfile, UserGroup, API_ACTION_PATCH,\
     API_ACTION_CREATE
 from reports.serialize import XLSX_MIMETYPE, SDF_MIMETYPE, JSON_MIMETYPE
+from reports.serialize.image_resolver import ImageResolver
 from reports.serializers import CSVSerializer, XLSSerializer, LimsSerializer, \
     ScreenResultSerializer
 from reports.tests import IResourceTestCase, equivocal
@@ -625,6 +631,21 @@ class LibraryResource(DBResourceTestCase):
             self.assertTrue(plate_data['mg_ml_concentration'] is None)
             self.assertTrue(plate_data['min_mg_ml_concentration'] is None)
 
+        # 4.a Verify the plate create logs: one for each plate
+        resp = self.api_client.get(
+            BASE_REPORTS_URI + '/apilog', format='json', 
+            authentication=self.get_credentials(), 
+            data={ 
+                'limit': 0, 
+                'ref_resource_name': 'librarycopyplate',
+                'api_action': API_ACTION_CREATE })
+        self.assertTrue(
+            resp.status_code in [200], 
+            (resp.status_code, self.get_content(resp)))
+        new_obj = self.deserialize(resp)
+        self.assertEqual(len(new_obj['objects']), number_of_plates,
+            'plate create logs: %r' % new_obj['objects'])
+
         # 5. Verify CopyWell data can be queried, but that all have single concentration
         logger.info('Verify copy_wells created ()...')
         uri = '/'.join([
@@ -735,6 +756,54 @@ class LibraryResource(DBResourceTestCase):
         self.assertEqual(
             float(copywell_input['volume']), float(new_copywell['volume']))
     
+    def test12a_modify_copy_wells_batch(self):
+
+        logger.info('test12a_modify_copy_wells_batch ...')
+    
+        (library_data, copy_data, plate_data) = self.test10_create_library_copy_specific_wells()
+        copy_name = copy_data['copy_name']
+        copywells = db.models.CopyWell.objects.filter(
+            copy__name=copy_name, 
+            plate__plate_number=int(library_data['start_plate']))
+        (existing_id1, existing_id2, new_id) = [
+            copywell.well_id for copywell in copywells.order_by('well_id')[:3]]
+        copywells.filter(well_id=new_id).delete()
+        copywell_count = copywells.count()
+        
+        resource = CopyWellResource()
+        schema = resource.build_schema()
+        request = RequestFactory().patch(BASE_URI_DB + '/copywell')
+        patches = [
+            { 'copy_name': copy_name, 'well_id': existing_id1, 
+                'volume': '0.000031' },
+            { 'copy_name': copy_name, 'well_id': existing_id2, 
+                'volume': '0.000032' },
+            # merged with the first patch
+            { 'copy_name': copy_name, 'well_id': existing_id1, 
+                'mg_ml_concentration': '1.5' },
+            { 'copy_name': copy_name, 'well_id': new_id, 
+                'volume': '0.000033' },
+        ]
+        self.assertEqual(
+            resource.patch_objs(request, patches, schema=schema), (2, 1))
+        self.assertEqual(copywells.count(), copywell_count+1)
+        copywell1 = copywells.get(well_id=existing_id1)
+        self.assertEqual(copywell1.volume, Decimal('0.000031'))
+        self.assertEqual(copywell1.mg_ml_concentration, Decimal('1.5'))
+        self.assertEqual(
+            copywells.get(well_id=existing_id2).volume, Decimal('0.000032'))
+        self.assertEqual(
+            copywells.get(well_id=new_id).volume, Decimal('0.000033'))
+        
+        # A single copy well is patched without staging
+        self.assertEqual(
+            resource.patch_objs(request, [
+                { 'copy_name': copy_name, 'well_id': existing_id2, 
+                    'volume': '0.000030' }], schema=schema),
+            (1, 0))
+        self.assertEqual(
+            copywells.get(well_id=existing_id2).volume, Decimal('0.000030'))
+    
     def test13_plate_locations(self):
 
         logger.info('test13_plate_locations ...')
@@ -821,7 +890,9 @@ class LibraryResource(DBResourceTestCase):
             authentication=self.get_credentials(), 
             data={ 
                 'limit': 0, 
-                'ref_resource_name': 'librarycopyplate'})
+                'ref_resource_name': 'librarycopyplate',
+                # exclude the plate create logs (library copy creation)
+                'api_action__ne': API_ACTION_CREATE })
         self.assertTrue(
             resp.status_code in [200], 
             (resp.status_code, self.get_content(resp)))
@@ -1124,6 +1195,8 @@ class LibraryResource(DBResourceTestCase):
             data={ 
                 'limit': 0, 
                 'ref_resource_name': 'librarycopyplate',
+                # exclude the plate create logs (library copy creation)
+                'api_action__ne': API_ACTION_CREATE,
                 'includes': ['added_keys']})
         self.assertTrue(
             resp.status_code in [200], 
@@ -1181,6 +1254,15 @@ class LibraryResource(DBResourceTestCase):
         for plate_data in plates_data_input:
             plate_data.update(new_plate_data)
 
+        # 2a. A plate submitted more than once is rejected
+        resp = self.api_client.patch(
+            resource_uri,format='json', 
+            data={'objects': plates_data_input + plates_data_input[:1],}, 
+            authentication=self.get_credentials())
+        self.assertTrue(
+            resp.status_code in [400], 
+            (resp.status_code, self.get_content(resp)))
+
         # 2. Patch the plates
         logger.info('Patch the plates: cred: %r', self.username)
         resp = self.api_client.patch(
@@ -1191,6 +1273,9 @@ class LibraryResource(DBResourceTestCase):
             resp.status_code in [200], 
             (resp.status_code, self.get_content(resp)))
         patch_response = self.deserialize(resp)
+        self.assertEqual(
+            patch_response['meta'][API_MSG_RESULT][API_MSG_CREATED], 0,
+            '%r' % patch_response)
         self.assertTrue('meta' in patch_response, '%r' % patch_response)
         self.assertTrue(API_MSG_RESULT in patch_response['meta'], '%r' % patch_response)
         self.assertTrue(API_MSG_SUBMIT_COUNT in patch_response['meta'][API_MSG_RESULT], '%r' % patch_response)
@@ -1920,6 +2005,74 @@ class ScreenResultSerializerTest(TestCase):
                         % (key, val, val2, msg, result_value, found))
             if i == items_to_test:
                 break
+
+
+class ImageCacheTest(SimpleTestCase):
+    
+    def test_image_cache_eviction(self):
+        
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = image_cache.ImageCache(cache_dir, max_size=250)
+            path1 = cache.put('well1', b'x'*100, size=(100,100))
+            self.assertEqual(cache.get('well1', size=(100,100)), path1)
+            self.assertEqual(cache.get('well1', size=(200,200)), None)
+            
+            # make the first entry the least recently used 
+            os.utime(path1, (1, os.stat(path1).st_mtime))
+            cache.put('well2', b'x'*100)
+            cache.put('well3', b'x'*100)
+            
+            self.assertEqual(cache.get('well1', size=(100,100)), None)
+            self.assertTrue(cache.get('well2') is not None)
+            self.assertTrue(cache.get('well3') is not None)
+            self.assertTrue(cache.current_size <= 250)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_conditional_get(self):
+        
+        request = RequestFactory().get(
+            '/db/well_image/01536:A01', HTTP_IF_NONE_MATCH='"1-2"')
+        self.assertTrue(image_cache.is_not_modified(request, '"1-2"', 1))
+        self.assertFalse(image_cache.is_not_modified(request, '"1-3"', 1))
+        
+        request = RequestFactory().get(
+            '/db/well_image/01536:A01', 
+            HTTP_IF_MODIFIED_SINCE='Sun, 06 Nov 1994 08:49:37 GMT')
+        self.assertTrue(image_cache.is_not_modified(request, '"1-2"', 784111777))
+        self.assertFalse(image_cache.is_not_modified(request, '"1-2"', 784111778))
+
+    def test_image_resolver(self):
+        
+        image_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(image_dir, '01536'))
+            image_path = os.path.join(image_dir, '01536', '01536A01.png')
+            with open(image_path, 'wb') as f:
+                f.write(b'x'*10)
+            with self.settings(WELL_STRUCTURE_IMAGE_DIR=image_dir):
+                request = RequestFactory().get('/db/api/v1/well')
+                resolver = ImageResolver(request, batch_size=2)
+                rows = [
+                    { 'structure_image': '/db/well_image/01536:A01',
+                      'library_well_type': 'experimental' },
+                    { 'structure_image': '/db/well_image/01536:A02',
+                      'library_well_type': 'experimental' },
+                    { 'structure_image': '/db/well_image/01536:A01',
+                      'library_well_type': 'empty' },
+                    ]
+                resolved_rows = list(
+                    resolver.resolve_rows(iter(rows), ['structure_image']))
+                self.assertEqual(resolved_rows, rows)
+                source = resolver.get('/db/well_image/01536:A01')
+                self.assertEqual(source.path, image_path)
+                self.assertEqual(source.read(), b'x'*10)
+                self.assertTrue(
+                    resolver.get('/db/well_image/01536:A02') is None)
+        finally:
+            shutil.rmtree(image_dir)
+
                 
 class ScreenResultResource(DBResourceTestCase):
 
@@ -1989,6 +2142,23 @@ class ScreenResultResource(DBResourceTestCase):
             resp.status_code in [200], 
             (resp.status_code, self.get_content(resp)))
 
+    def test0_well_resolver(self):
+        
+        self.create_library({
+            'start_plate': 1, 
+            'end_plate': 20,
+            'screen_type': 'small_molecule' })
+        
+        well_resolver = WellResolver(plate_chunk_size=10)
+        for well_id in ['00001:A01','00009:B02','00001:A02','00015:A01']:
+            well = well_resolver.get(well_id)
+            self.assertEqual(well.well_id, well_id)
+        self.assertEqual(well_resolver.query_count, 2)
+        
+        self.assertTrue(well_resolver.get('00050:A01') is None)
+        self.assertTrue(well_resolver.get('A01') is None)
+        self.assertEqual(well_resolver.missing_well_ids, ['00050:A01','A01'])
+
     def test1_load_example_file(self):
         
         logger.info('test1_load_example_file...')
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import io
 import json
 import logging
 import os.path
@@ -8,14 +9,17 @@ import types
 from wsgiref.util import FileWrapper
 
 from PIL import Image
-from django.conf import settings
 from django.forms.models import model_to_dict
 from django.http import HttpResponse
-from django.http.response import Http404, HttpResponseServerError
+from django.http.response import Http404, HttpResponseServerError, \
+    HttpResponseNotModified
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
 
 from db import WELL_ID_PATTERN
 from db.models import ScreensaverUser, Reagent, AttachedFile, Publication
+from db.support import image_cache
+from reports.serialize import image_resolver
 from reports.api import UserGroupAuthorization
 from db.api import ScreenAuthorization
 from django.core.exceptions import ObjectDoesNotExist
@@ -23,65 +27,167 @@ from django.core.exceptions import ObjectDoesNotExist
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SMILES_RENDER_SIZE = (300, 300)
+MAX_IMAGE_RENDER_SIZE = 2000
 
 def main(request):
     search = request.GET.get('search', '')
     logger.debug(str(('main search: ', search)))
     return render(request, 'db/index.html', {'search': search})
 
+def _get_render_size(request):
+    '''
+    Parse the "size" request parameter, of the form "300" or "300x200"
+    @return (width, height) or None
+    '''
+    size = request.GET.get('size', None)
+    if not size:
+        return None
+    try:
+        dims = [int(x) for x in size.lower().split('x')]
+        if len(dims) == 1:
+            dims = dims*2
+        if len(dims) != 2 or min(dims) < 1 or max(dims) > MAX_IMAGE_RENDER_SIZE:
+            raise ValueError(size)
+        return tuple(dims)
+    except ValueError:
+        raise Http404('invalid image size: %r' % size)
+
+def _image_file_response(request, path):
+    '''
+    Serve the stored image bytes, with ETag and Last-Modified headers; 
+    respond with "304 Not Modified" for matching conditional requests.
+    '''
+    stat = os.stat(path)
+    if image_cache.is_not_modified(
+            request, image_cache.get_etag(path, stat), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        with open(path, 'rb') as f:
+            response = HttpResponse(f.read(), content_type="image/png")
+    image_cache.set_cache_headers(response, path, stat)
+    patch_cache_control(response, private=True)
+    return response
+
+def _render_png(image):
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
 def well_image(request, well_id):
-    
+    '''
+    Serve the structure image for the well from the WELL_STRUCTURE_IMAGE_DIR:
+    - if a render "size" is requested, the resized image is cached,
+    see db.support.image_cache
+    '''
     if not request.user.is_authenticated():
-        raise ImmediateHttpResponse(response=HttpForbidden(
-            'user %r is not authorized for well_image view' % request.user ))
+        logger.warn('access to restricted: user: %r, well_image: %r',
+            request.user, well_id) 
+        return HttpResponse('Log in required.', status=401)
 
-    match = WELL_ID_PATTERN.match(well_id)
-    if not match:
-        logger.warn('invalid well_id format: %d, pattern: %s' 
-            % (well_id,WELL_ID_PATTERN))
+    structure_image_path = image_cache.get_well_image_path(well_id)
+    if structure_image_path is None:
+        logger.warn('invalid well_id format: %r, pattern: %s' 
+            % (well_id,WELL_ID_PATTERN.pattern))
         raise Http404('invalid well id format: %s' % well_id)
-    else:
-        _plate = match.group(1)
-        _well_name = match.group(2)
-        _name = '%s%s.png' % (_plate,_well_name)
-        structure_image_dir = os.path.abspath(settings.WELL_STRUCTURE_IMAGE_DIR)
-        structure_image_path = os.path.join(
-            structure_image_dir, _plate, _name)
-
-        if os.path.exists(structure_image_path):
-            try:
+    if not os.path.exists(structure_image_path):
+        logger.info('well_image for %s not found at %s', 
+            well_id, structure_image_path)
+        raise Http404
+    size = _get_render_size(request)
+    try:
+        if size is not None:
+            def render():
                 image = Image.open(structure_image_path)
-                response = HttpResponse(content_type="image/png")
-                image.save(response, "PNG")
-                return response
-            except Exception as e:
-                logger.exception('well_image exception for %r, %r' 
-                    % (well_id, e))
-                raise HttpResponseServerError
-        else:
-            logger.info('well_image for %s not found at %s', 
-                well_id, structure_image_path)
-            raise Http404
+                image.thumbnail(size, Image.ANTIALIAS)
+                return _render_png(image)
+            # Note: key includes the source mtime, to detect updated images
+            key = '%s_%d' % (
+                well_id, int(os.path.getmtime(structure_image_path)))
+            structure_image_path = image_cache.get_image_cache().get_or_render(
+                key, render, size=size)
+        return _image_file_response(request, structure_image_path)
+    except Exception as e:
+        logger.exception('well_image exception for %r, %r' 
+            % (well_id, e))
+        return HttpResponseServerError()
 
 
 def smiles_image(request, well_id):
-    # TODO: not tested
+    '''
+    Render the structure image for the reagent SMILES of the well:
+    - rendered images are cached by SMILES and render "size",
+    see db.support.image_cache
+    '''
     if not request.user.is_authenticated():
-        raise ImmediateHttpResponse(response=HttpForbidden(
-            'user: %r not authorized for smiles_image view' % request.user))
-        
+        logger.warn('access to restricted: user: %r, smiles_image: %r',
+            request.user, well_id) 
+        return HttpResponse('Log in required.', status=401)
+    
+    try:
+        reagent = Reagent.objects.get(well_id=well_id)
+        smiles = reagent.smallmoleculereagent.smiles
+    except ObjectDoesNotExist:
+        raise Http404('no small molecule reagent found for: %r' % well_id)
+    if not smiles:
+        raise Http404('no smiles for: %r' % well_id)
+    size = _get_render_size(request) or DEFAULT_SMILES_RENDER_SIZE
+    logger.debug('smiles_image: %r, %r, %r', well_id, smiles, size)
+    path = image_cache.get_image_cache().get_or_render(
+        smiles, lambda: render_smiles_image(smiles, size), size=size)
+    return _image_file_response(request, path)
+
+def render_smiles_image(smiles, size=None):
+    '''
+    Render the SMILES string as a PNG image, using rdkit
+    @return the PNG image data
+    '''
     import rdkit.Chem
     import rdkit.Chem.AllChem
     import rdkit.Chem.Draw
-    reagent = Reagent.objects.get(well_id=well_id)
-    smiles = reagent.smallmoleculereagent.smiles
-    logger.info(str((well_id, str(smiles) )))
+    if size is None:
+        size = DEFAULT_SMILES_RENDER_SIZE
     m = rdkit.Chem.MolFromSmiles(str(smiles))
     rdkit.Chem.AllChem.Compute2DCoords(m)
-    im = rdkit.Chem.Draw.MolToImage(m)
-    response = HttpResponse(mimetype="image/png")
-    im.save(response, "PNG")
-    return response
+    return _render_png(rdkit.Chem.Draw.MolToImage(m, size=size))
+
+def resolve_well_image_paths(kwargs_list):
+    '''
+    Image path resolver for the "well_image" URL; 
+    see reports.serialize.image_resolver
+    '''
+    return [
+        image_cache.get_well_image_path(kwargs['well_id']) 
+            for kwargs in kwargs_list]
+
+def resolve_smiles_image_paths(kwargs_list):
+    '''
+    Image path resolver for the "smiles_image" URL: 
+    - SMILES are fetched for the batch of wells in one query
+    - images are rendered (or found) in the image cache
+    '''
+    well_ids = [kwargs['well_id'] for kwargs in kwargs_list]
+    smiles_map = dict(
+        Reagent.objects.filter(well_id__in=well_ids)
+            .values_list('well_id', 'smallmoleculereagent__smiles'))
+    cache = image_cache.get_image_cache()
+    size = DEFAULT_SMILES_RENDER_SIZE
+    paths = []
+    for well_id in well_ids:
+        smiles = smiles_map.get(well_id)
+        if not smiles:
+            paths.append(None)
+            continue
+        try:
+            paths.append(cache.get_or_render(
+                smiles, lambda: render_smiles_image(smiles, size), size=size))
+        except Exception, e:
+            logger.info('could not render smiles for %r: %r', well_id, e)
+            paths.append(None)
+    return paths
+
+image_resolver.register_path_resolver('well_image', resolve_well_image_paths)
+image_resolver.register_path_resolver('smiles_image', resolve_smiles_image_paths)
 
 
 def publication_attached_file(request, publication_id):
@@ -158,12 +158,38 @@ PROFILE_LOG_BASE='/tmp'
 # if structure image cache directory is available.  see db.api for details.
 WELL_STRUCTURE_IMAGE_DIR=''
 
+# on disk cache for rendered (resized and SMILES) structure images
+# see db.support.image_cache
+IMAGE_CACHE_DIR=os.path.join(TEMP_FILE_DIR, 'image_cache')
+IMAGE_CACHE_MAX_SIZE=500*1024**2
+
 # maximum rows to cache in the database table well_query_index
 # see db/api.ScreenResultResource
 MAX_WELL_INDEXES_TO_CACHE=3e+08
 
 MAX_ROWS_FOR_CACHE_RESULTPROXY=10e+4
 
+# per request API metrics, reported in the "Server-Timing" response header,
+# and (if REQUEST_METRICS_LOG) logged when the response is complete;
+# see reports.utils.request_metrics
+REQUEST_METRICS_ENABLED=True
+REQUEST_METRICS_LOG=False
+
+# connections for streamed (non-JSON) responses: pool size, server side 
+# cursor fetch size (rows), and statement timeout (ms, 0 for no timeout);
+# see reports.utils.streaming_engine
+STREAMING_ENGINE_ENABLED=True
+STREAMING_POOL_SIZE=5
+STREAMING_POOL_MAX_OVERFLOW=5
+STREAMING_POOL_TIMEOUT=30
+STREAMING_FETCH_SIZE=2000
+STREAMING_STATEMENT_TIMEOUT=0
+
+# library copy creation: if more than COPY_PLATE_LOG_SUMMARY_SIZE plates are
+# created, create one summary log for the copy plates, rather than a log for
+# each plate (0 to always log each plate); see db/api.LibraryCopyResource
+COPY_PLATE_LOG_SUMMARY_SIZE=0
+
 # set SQLALCHEMY_POOL_CLASS=sqlalchemy.pool.NullPool for testing
 # environments, so that the test database can be destroyed
 # import sqlalchemy.pool
@@ -17,6 +17,18 @@ HTTP_PARAM_USE_VOCAB = 'use_vocabularies'
 HTTP_PARAM_USE_TITLES = 'use_titles'
 HTTP_PARAM_RAW_LISTS = 'raw_lists'
 HTTP_PARAM_DATA_INTERCHANGE = 'data_interchange'
+HTTP_PARAM_COUNT_MODE = 'count_mode'
+# Request pretty printed (indented, sorted) JSON; default is compact JSON
+HTTP_PARAM_PRETTY_JSON = 'pretty'
+
+# List response count modes: 
+# - "exact": count(*) the rows of the query
+# - "estimate": use the query planner row estimate
+# - "none": do not count, report if more rows are available ("has_more")
+COUNT_MODE_EXACT = 'exact'
+COUNT_MODE_ESTIMATE = 'estimate'
+COUNT_MODE_NONE = 'none'
+COUNT_MODES = (COUNT_MODE_EXACT, COUNT_MODE_ESTIMATE, COUNT_MODE_NONE)
 
 # Header custom comment field
 HEADER_APILOG_COMMENT = 'HTTP_X_APILOG_COMMENT'
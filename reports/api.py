@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 from copy import deepcopy
 from functools import wraps
+import hashlib
 import json
 import logging
 from operator import itemgetter
@@ -23,7 +24,6 @@ from django.db import transaction
 from django.db.models import Q
 from django.db.models.aggregates import Max
 from django.forms.models import model_to_dict
-from django.http.request import HttpRequest
 from django.http.response import HttpResponse, Http404, HttpResponseBase
 from sqlalchemy import select, asc, text
 from sqlalchemy.dialects import postgresql
@@ -50,7 +50,9 @@ from reports.models import MetaHash, Vocabulary, ApiLog, LogDiff, Permission, \
 from reports.serialize import parse_val, parse_json_field, XLSX_MIMETYPE, \
     SDF_MIMETYPE, XLS_MIMETYPE
 from reports.serializers import LimsSerializer
-from reports.sqlalchemy_resource import SqlAlchemyResource, _concat
+from reports.sqlalchemy_resource import SqlAlchemyResource, _concat, \
+    InternalQueryRequest
+from reports.utils.table_cache import get_cached, set_cached
 
 
 logger = logging.getLogger(__name__)
@@ -66,26 +68,111 @@ API_MSG_UNCHANGED = 'Unchanged'
 API_MSG_COMMENTS = 'Comments'
 API_MSG_ACTION = 'Action'
 
+# number of logs to write in each batch, see ApiResource.log_patches
+PATCH_LOG_BATCH_SIZE = 5000
+
 DEBUG_RESOURCES = False or logger.isEnabledFor(logging.DEBUG)
 DEBUG_AUTHORIZATION = False or logger.isEnabledFor(logging.DEBUG)
 
 
+# Tables that the user permissions are computed from; 
+# see UserGroupAuthorization.get_user_permissions
+USER_PERMISSION_TABLES = [
+    'auth_user', 'reports_userprofile', 'reports_permission',
+    'reports_userprofile_permissions', 'reports_usergroup',
+    'reports_usergroup_users', 'reports_usergroup_permissions',
+    'reports_usergroup_super_groups']
+
 class UserGroupAuthorization(Authorization):
     
+    @staticmethod
+    def get_user_permissions(user):
+        '''
+        @return a frozenset of the (scope, key, type) for each of the 
+        permissions of the user: assigned to the user, or to the user's 
+        usergroups (and their supergroups)
+        - cached until a user, usergroup or permission table is written to
+        - also retained on the user instance, for the rest of the request
+        '''
+        permissions = getattr(user, '_user_permissions', None)
+        if permissions is not None:
+            return permissions
+        cache_key = 'user_permissions:%s' % user.id
+        permissions = get_cached(cache_key)
+        if permissions is None:
+            permissions = UserGroupAuthorization._get_user_permissions(user.id)
+            set_cached(cache_key, permissions, USER_PERMISSION_TABLES)
+        user._user_permissions = permissions
+        return permissions
+    
+    @staticmethod
+    def get_user_groups(user):
+        '''
+        @return a frozenset of the names of the user's usergroups, and of their
+        supergroups (see UserProfile.get_all_groups)
+        - cached as for get_user_permissions
+        '''
+        usergroups = getattr(user, '_user_groups', None)
+        if usergroups is not None:
+            return usergroups
+        cache_key = 'user_groups:%s' % user.id
+        usergroups = get_cached(cache_key)
+        if usergroups is None:
+            usergroups = frozenset([
+                x.name for x in user.userprofile.get_all_groups()])
+            set_cached(cache_key, usergroups, USER_PERMISSION_TABLES)
+        user._user_groups = usergroups
+        return usergroups
+    
+    @staticmethod
+    def _get_user_permissions(user_id):
+        '''
+        Query the permissions of the user, using the 
+        UserGroupResource recursive permissions query
+        '''
+        bridge = get_tables()
+        _up = bridge['reports_userprofile']
+        _p = bridge['reports_permission']
+        _upp = bridge['reports_userprofile_permissions']
+        _ugu = bridge['reports_usergroup_users']
+        
+        group_all_supergroups = \
+            UserGroupResource.recursive_supergroup_query(bridge)
+        group_all_permissions = \
+            UserGroupResource.recursive_permissions_query(
+                bridge,group_all_supergroups)
+        
+        user_permissions = (
+            select([_p.c.scope, _p.c.key, _p.c.type])
+            .select_from(
+                _p.join(_upp,_upp.c.permission_id==_p.c.id)
+                    .join(_up,_upp.c.userprofile_id==_up.c.id))
+            .where(_up.c.user_id==user_id))
+        group_permissions = (
+            select([_p.c.scope, _p.c.key, _p.c.type])
+            .select_from(
+                _ugu.join(group_all_permissions,
+                    _ugu.c.usergroup_id==group_all_permissions.c.usergroup_id)
+                    .join(_up,_ugu.c.userprofile_id==_up.c.id))
+            .where(_up.c.user_id==user_id)
+            .where(_p.c.id==text('any(gap.permission_ids)')))
+        stmt = user_permissions.union(group_permissions)
+        with get_engine().connect() as conn:
+            permissions = frozenset([
+                (row[0],row[1],row[2]) for row in conn.execute(stmt)])
+        if DEBUG_AUTHORIZATION:
+            logger.info('user: %r, permissions: %r', user_id, permissions)
+        return permissions
+        
     @staticmethod
     def get_authorized_resources(user, permission_type):
-        userprofile = user.userprofile
         permission_types = [permission_type]
         if permission_type == 'read':
             permission_types.append('write')
-        resources_user = ( userprofile.permissions.all()
-            .filter(scope='resource', type__in=permission_types)
-            .values_list('key', flat=True))
-        resources_group = [ permission.key 
-                for group in userprofile.usergroup_set.all() 
-                for permission in group.get_all_permissions(
-                    scope='resource', type__in=permission_types)]
-        return set(resources_user) | set(resources_group)
+        return set([
+            key for (scope,key,type) 
+                in UserGroupAuthorization.get_user_permissions(user)
+                if scope == 'resource' and type in permission_types])
     
     def _is_resource_authorized(self, resource_name, user, permission_type):
         
@@ -108,46 +195,23 @@ class UserGroupAuthorization(Authorization):
                     % (resource_name,permission_type,user))
             return True
         
-        # FIXME: 20150708 - rewrite this using the UserResource 
-        # interrogating the groups therein (post refactor of TP methods)
-        userprofile = user.userprofile
         permission_types = [permission_type]
         if permission_type == 'read':
             permission_types.append('write')
-        query = userprofile.permissions.all().filter(
-            scope=scope, key=resource_name, type__in=permission_types)
-        if query.exists():
-            if DEBUG_AUTHORIZATION:
-                logger.info(
-                    'user %s, auth query: %s, found matching user permissions %s'
-                    % (user,permission_str,[str(x) for x in query]))
-            logger.info('%s:%s user explicit permission for: %s' 
-                % (resource_name,permission_type,user))
-            return True
-        
-        if DEBUG_AUTHORIZATION:
-            logger.info(
-                'user %s, auth query: %s, not found in user permissions %s'
-                % (user,permission_str,[str(x) for x in query]))
-        
-        permissions_group = [ permission 
-                for group in userprofile.usergroup_set.all() 
-                for permission in group.get_all_permissions(
-                    scope=scope, key=resource_name, type__in=permission_types)]
-        if permissions_group:
-            if DEBUG_AUTHORIZATION:
-                logger.info(
-                    'user: %r, auth query: %r, found usergroup permissions: %r'
-                    ,user, permission_str, permissions_group)
-            logger.info('%s:%s usergroup permission for: %s' 
-                % (resource_name,permission_type,user))
-            return True
+        permissions = UserGroupAuthorization.get_user_permissions(user)
+        for type in permission_types:
+            if (scope, resource_name, type) in permissions:
+                if DEBUG_AUTHORIZATION:
+                    logger.info('user: %r, auth query: %r, found permission: %r',
+                        user, permission_str, type)
+                return True
         
         logger.info(
-            'user: %r, auth query: %r, not found in usergroup permissions: %r'
-            ,user, permission_str, permissions_group)
+            'user: %r, auth query: %r, permission not found', 
+            user, permission_str)
         return False
     
+
 class AllAuthenticatedReadAuthorization(UserGroupAuthorization):
     ''' Allow read for all authenticated users'''
 
@@ -254,6 +318,38 @@ def is_empty_diff(difflog):
             empty = False;
     return empty
 
+
+class PatchLogSummary(object):
+    '''
+    Counts of the logs written by ApiResource.log_patches; the logs 
+    themselves are written in batches and are not retained.
+    '''
+    
+    def __init__(self):
+        self.count = 0
+        # number of logs with diffs (updated or created)
+        self.diff_count = 0
+        self.create_count = 0
+        self.delete_count = 0
+    
+    def add(self, log):
+        self.count += 1
+        if log.diffs:
+            self.diff_count += 1
+        if log.api_action == API_ACTION_CREATE:
+            self.create_count += 1
+        elif log.api_action == API_ACTION_DELETE:
+            self.delete_count += 1
+    
+    def __len__(self):
+        return self.count
+    
+    def __repr__(self):
+        return (
+            '<PatchLogSummary(count: %d, diffs: %d, created: %d, deleted: %d)>'
+            % (self.count, self.diff_count, self.create_count, 
+                self.delete_count))
+
         
 def download_tmp_file(path, filename):
     """                                                                         
@@ -371,6 +467,22 @@ class ApiResource(SqlAlchemyResource):
         
         return schema
     
+    def get_cache_tables(self):
+        '''
+        Extend the cache tables with the tables of the schema fields
+        '''
+        tables = super(ApiResource, self).get_cache_tables()
+        try:
+            schema = self.build_schema()
+            if schema and 'fields' in schema:
+                tables.update([
+                    field['table'] for field in schema['fields'].values()
+                        if field.get('table')])
+        except Exception, e:
+            logger.warn('on get_cache_tables for %r: %r', 
+                self._meta.resource_name, e)
+        return tables
+    
     
     def get_resource_uri(self, deserialized, **kwargs):
         ids = [self._meta.resource_name]
@@ -527,11 +639,28 @@ class ApiResource(SqlAlchemyResource):
             deserialized = kwargs['data']
         else:
             deserialized = self.deserialize(
-                request, format=kwargs.get('format', None))
+                request, format=kwargs.get('format', None), stream=True)
 
-        if self._meta.collection_name in deserialized:
+        if ( isinstance(deserialized, dict) 
+                and self._meta.collection_name in deserialized ):
             deserialized = deserialized[self._meta.collection_name]
 
+        # Limit the potential candidates for logging to found id_kwargs
+        # Note: for streamed input, this is the first pass, which also counts
+        # the rows for len(deserialized)
+        schema = kwargs['schema']
+        kwargs_for_log = kwargs.copy()
+        if not isinstance(deserialized, dict):
+            for _data in deserialized:
+                id_kwargs = self.get_id(_data, schema=schema)
+                logger.debug('found id_kwargs: %r from %r', id_kwargs, _data)
+                if id_kwargs:
+                    for idkey,idval in id_kwargs.items():
+                        id_param = '%s__in' % idkey
+                        id_vals = kwargs_for_log.get(id_param, set())
+                        id_vals.add(idval)
+                        kwargs_for_log[id_param] = id_vals
+
         if len(deserialized) == 0:
             meta = { 
                 API_MSG_RESULT: {
@@ -554,20 +683,6 @@ class ApiResource(SqlAlchemyResource):
                 kwargs['data'] = deserialized
             return self.patch_detail(request, **kwargs)
         
-        # Limit the potential candidates for logging to found id_kwargs
-        schema = kwargs['schema']
-        
-        
-        kwargs_for_log = kwargs.copy()
-        for _data in deserialized:
-            id_kwargs = self.get_id(_data, schema=schema)
-            logger.debug('found id_kwargs: %r from %r', id_kwargs, _data)
-            if id_kwargs:
-                for idkey,idval in id_kwargs.items():
-                    id_param = '%s__in' % idkey
-                    id_vals = kwargs_for_log.get(id_param, set())
-                    id_vals.add(idval)
-                    kwargs_for_log[id_param] = id_vals
         try:
             logger.debug('get original state, for logging...')
             original_data = self._get_list_response(request,**kwargs_for_log)
@@ -585,8 +700,7 @@ class ApiResource(SqlAlchemyResource):
                     parent_log.save()
                     kwargs['parent_log'] = parent_log
                 
-                for _dict in deserialized:
-                    self.patch_obj(request, _dict, **kwargs)
+                self.patch_objs(request, deserialized, **kwargs)
         except ValidationError as e:
             logger.exception('Validation error: %r', e)
             raise e
@@ -597,9 +711,8 @@ class ApiResource(SqlAlchemyResource):
         logs = self.log_patches(request, original_data,new_data,**kwargs)
         logger.info('patch logs created.')
         patch_count = len(deserialized)
-        update_count = len([x for x in logs if x.diffs ])
-        logger.debug('updates: %r', [x for x in logs if x.diffs ])
-        create_count = len([x for x in logs if x.api_action == API_ACTION_CREATE])
+        update_count = logs.diff_count
+        create_count = logs.create_count
         unchanged_count = patch_count - update_count
         meta = { 
             API_MSG_RESULT: {
@@ -621,6 +734,14 @@ class ApiResource(SqlAlchemyResource):
             response.status_code = 200
             return response
  
+    def patch_objs(self, request, deserialized, **kwargs):
+        '''
+        Patch each of the deserialized dicts, for patch_list; override to 
+        patch the list in bulk
+        '''
+        for _dict in deserialized:
+            self.patch_obj(request, _dict, **kwargs)
+        
     @write_authorization
     @un_cache 
     @transaction.atomic       
@@ -638,9 +759,10 @@ class ApiResource(SqlAlchemyResource):
             deserialized = kwargs['data']
         else:
             deserialized = self.deserialize(
-                request, format=kwargs.get('format', None))
+                request, format=kwargs.get('format', None), stream=True)
 
-        if self._meta.collection_name in deserialized:
+        if ( isinstance(deserialized, dict) 
+                and self._meta.collection_name in deserialized ):
             deserialized = deserialized[self._meta.collection_name]
         
         # TODO: put_detail not implemented
@@ -819,8 +941,8 @@ class ApiResource(SqlAlchemyResource):
 
         logs = self.log_patches(request, original_data,new_data,**kwargs)
         patch_count = len(deserialized)
-        update_count = len([x for x in logs if x.diffs ])
-        create_count = len([x for x in logs if x.api_action == API_ACTION_CREATE])
+        update_count = logs.diff_count
+        create_count = logs.create_count
         unchanged_count = patch_count - update_count
         meta = { 
             API_MSG_RESULT: {
@@ -1370,16 +1492,30 @@ class ApiResource(SqlAlchemyResource):
         return log
 
     @transaction.atomic
-    def log_patches(self,request, original_data, new_data, schema=None, **kwargs):
+    def log_patches(self,request, original_data, new_data, schema=None, 
+            batch_size=PATCH_LOG_BATCH_SIZE, **kwargs):
         '''
         log differences between dicts having the same identity in the arrays:
         @param original_data - data from before the API action
         @param new_data - data from after the API action
         - dicts have the same identity if the id_attribute keys have the same
         value.
+        - original and new dicts are sorted by identity and matched in step 
+        (a merge join): only the current original dict is kept for matching;
+        if an identity is repeated in the original data, the first dict is 
+        matched and the others are logged as deleted
+        - logs are written in batches of batch_size
+        @return PatchLogSummary
         '''
         DEBUG_PATCH_LOG = False or logger.isEnabledFor(logging.DEBUG)
         logs = []
+        summary = PatchLogSummary()
+        
+        def write_logs(logs):
+            ApiLog.bulk_create(logs)
+            for log in logs:
+                summary.add(log)
+            return []
         
         log_comment = None
         if HEADER_APILOG_COMMENT in request.META:
@@ -1394,33 +1530,10 @@ class ApiResource(SqlAlchemyResource):
             schema = self.build_schema()
         id_attribute = schema['id_attribute']
         
-        deleted_items = list(original_data)        
-        for new_dict in new_data:
-            if not new_dict:
-                continue
-            prev_dict = None
-            for c_dict in original_data:
-                if c_dict:
-                    prev_dict = c_dict
-                    for key in id_attribute:
-                        if new_dict[key] != c_dict[key]:
-                            prev_dict = None
-                            break
-                    if prev_dict:
-                        break # found
-            if prev_dict:
-                # if found, then it is modified, not deleted
-                if DEBUG_PATCH_LOG:
-                    logger.info('remove from deleted dict %r, %r',
-                        prev_dict, deleted_items)
-                deleted_items.remove(prev_dict)
-                
-            log = self.log_patch(request, prev_dict, new_dict, **kwargs)            
-            if log:
-                logs.append(log)   
-            
-        for deleted_dict in deleted_items:
-            
+        def get_identity(_dict):
+            return tuple([_dict[key] for key in id_attribute])
+        
+        def make_delete_log(deleted_dict):
             log = self.make_log(request)
             log.key = '/'.join([str(deleted_dict[x]) for x in id_attribute])
             log.uri = '/'.join([self._meta.resource_name,log.key])
@@ -1434,12 +1547,50 @@ class ApiResource(SqlAlchemyResource):
 
             log.api_action = API_ACTION_DELETE
             log.diffs = { key:[val,None] for key,val in deleted_dict.items() }
-            logs.append(log)
             if DEBUG_PATCH_LOG:
                 logger.info('delete, api log: %r',log)
-
-        logger.debug('logs: %r', logs)
-        logs = ApiLog.bulk_create(logs)
+            return log
+        
+        # Note: sorted in Python, rather than by the query, so that the
+        # ordering is consistent with the comparisons below
+        original_iter = iter(sorted(
+            (_dict for _dict in original_data if _dict), key=get_identity))
+        prev_dict = next(original_iter, None)
+        matched_dict = None
+        for new_dict in sorted(
+                (_dict for _dict in new_data if _dict), key=get_identity):
+            identity = get_identity(new_dict)
+            if ( matched_dict is not None 
+                    and get_identity(matched_dict) != identity ):
+                matched_dict = None
+            if matched_dict is None:
+                # original dicts ordered before the new dict were deleted
+                while ( prev_dict is not None 
+                        and get_identity(prev_dict) < identity ):
+                    logs.append(make_delete_log(prev_dict))
+                    prev_dict = next(original_iter, None)
+                if ( prev_dict is not None 
+                        and get_identity(prev_dict) == identity ):
+                    # if found, then it is modified, not deleted
+                    matched_dict = prev_dict
+                    prev_dict = next(original_iter, None)
+                
+            log = self.log_patch(
+                request, matched_dict, new_dict, id_attribute=id_attribute, 
+                **kwargs)            
+            if log:
+                logs.append(log)
+            if len(logs) >= batch_size:
+                logs = write_logs(logs)
+        
+        while prev_dict is not None:
+            logs.append(make_delete_log(prev_dict))
+            prev_dict = next(original_iter, None)
+            if len(logs) >= batch_size:
+                logs = write_logs(logs)
+
+        write_logs(logs)
+        logger.info('log patches: %r', summary)
 #         logger.debug('bulk create logs: %r', logs)
 #         with get_engine().connect() as conn:
 #             last_id = int(conn.execute(
@@ -1461,7 +1612,7 @@ class ApiResource(SqlAlchemyResource):
 #                 )
 #         LogDiff.objects.bulk_create(bulk_create_diffs)
             
-        return logs
+        return summary
 
 #     def log_patch(self, request, prev_dict, new_dict, log=None, **kwargs):
 #         DEBUG_PATCH_LOG = False
@@ -1648,7 +1799,8 @@ class ApiLogResource(ApiResource):
 #         return self.build_list_response(request, **kwargs)
         
     def dispatch_clear_cache(self, request, **kwargs):
-        self.clear_cache()
+        # Note: administrative request to clear all caches
+        cache.clear()
         return self.build_response(request, 'ok', **kwargs)
 
     @read_authorization
@@ -2298,46 +2450,68 @@ class ResourceResource(ApiResource):
         
     def _get_resource_schema(self,resource_key, user=None):
         ''' For internal callers
+        - if the user is not a superuser, fields with "view_groups" set are
+        filtered; the filtered schema is cached for each distinct set of 
+        usergroups.
         '''
+        if user is not None and not user.is_superuser:
+            usergroups = UserGroupAuthorization.get_user_groups(user)
+            cache_key = 'resource_schema:%s:%s' % (
+                resource_key, 
+                hashlib.md5('|'.join(sorted(usergroups)).encode('utf-8'))
+                    .hexdigest())
+            schema = None
+            if self.use_cache:
+                schema = get_cached(cache_key)
+            if schema is None:
+                if DEBUG_AUTHORIZATION:
+                    logger.info(
+                        'filter fields for %r, user: %r, groups: %r', 
+                        resource_key, user, usergroups)
+                schema = self._filter_schema(
+                    self._get_resource_schema(resource_key), usergroups)
+                if self.use_cache:
+                    set_cached(
+                        cache_key, schema, self.get_resources_cache_tables())
+            return schema
+        
         resources = self._build_resources()
         
         if resource_key not in resources:
             raise BadRequest('Resource is not initialized: %r', resource_key)
         
-        schema =  resources[resource_key]
-        if user is not None:
-            if not user.is_superuser:
-                # Filter fields with "view_groups" set
-                schema = deepcopy(schema)
-                usergroups = set([x.name for x in user.userprofile.get_all_groups()])
-                if DEBUG_AUTHORIZATION:
-                    logger.info(
-                        'filter fields for %r, user: %r, groups: %r', 
-                        resource_key, user, usergroups)
-                fields = deepcopy(schema['fields'])
-                filtered_fields = {}
-                for key, field in fields.items():
-                    include = True
-                    if key not in schema['id_attribute']:
-                        view_groups = field.get('view_groups',[])
-                        if view_groups:
-                            if not set(view_groups) & usergroups:
-                                include = False
-                                if DEBUG_AUTHORIZATION:
-                                    logger.info(
-                                        'disallowed field: %r with view_groups: %r', 
-                                        key, view_groups)
-                            else:
-                                if DEBUG_AUTHORIZATION:
-                                    logger.info(
-                                        'allowed field: %r with view_groups: %r', 
-                                        key, view_groups)
-                    if include is True:
-                        filtered_fields[key] = field
+        return resources[resource_key]
+    
+    @staticmethod
+    def _filter_schema(schema, usergroups):
+        '''
+        @return a copy of the schema without the fields having "view_groups" 
+        that are not in the usergroups
+        '''
+        filtered_fields = {}
+        for key, field in schema['fields'].items():
+            include = True
+            if key not in schema['id_attribute']:
+                view_groups = field.get('view_groups',[])
+                if view_groups:
+                    if not set(view_groups) & usergroups:
+                        include = False
+                        if DEBUG_AUTHORIZATION:
+                            logger.info(
+                                'disallowed field: %r with view_groups: %r', 
+                                key, view_groups)
                     else:
                         if DEBUG_AUTHORIZATION:
-                            logger.info('filtered field: %r', key)
-                schema['fields'] = filtered_fields
+                            logger.info(
+                                'allowed field: %r with view_groups: %r', 
+                                key, view_groups)
+            if include is True:
+                filtered_fields[key] = field
+            else:
+                if DEBUG_AUTHORIZATION:
+                    logger.info('filtered field: %r', key)
+        schema = dict(schema)
+        schema['fields'] = filtered_fields
         return schema
     
     @read_authorization
@@ -2365,12 +2539,8 @@ class ResourceResource(ApiResource):
         '''
 
         # get the resource fields
-        request = HttpRequest()
-        class User:
-            is_superuser = True
-        request.user = User
-        resource_fields = self.get_field_resource()._get_list_response(
-            request=request, scope='fields.resource')
+        resource_fields = self.get_field_resource()._get_list_response_internal(
+            scope='fields.resource')
         # build a hash out of the fields
         field_hash = {}
         for field in resource_fields:
@@ -2440,7 +2610,7 @@ class ResourceResource(ApiResource):
         
         resources = None
         if use_cache and self.use_cache:
-            resources = cache.get('resources')
+            resources = get_cached('resources')
             logger.debug('using cached resources')
         if not resources:
             if DEBUG_RESOURCES:
@@ -2530,9 +2700,16 @@ class ResourceResource(ApiResource):
                 self.extend_specific_data(resource)
                 
         if use_cache and self.use_cache:
-            cache.set('resources', resources)
+            set_cached(
+                'resources', resources, self.get_resources_cache_tables())
 
         return resources
+    
+    def get_resources_cache_tables(self):
+        '''
+        @return the tables that the cached resources are built from
+        '''
+        return ['reports_metahash','reports_vocabulary']
  
     def extend_specific_data(self, resource):
         key = resource['key']
@@ -2680,10 +2857,10 @@ class VocabularyResource(ApiResource):
         ''' For internal callers '''
         
         # FIXME: check request params for caching
-        vocabularies = cache.get('vocabularies')
+        vocabularies = get_cached('vocabularies')
         if not vocabularies  or not self.use_cache:
             vocabularies =  ApiResource._get_list_response(self, request, **kwargs)
-            cache.set('vocabularies', vocabularies)
+            set_cached('vocabularies', vocabularies, ['reports_vocabulary'])
         
         if key:
             return [vocabularies for vocabularies in vocabularies if vocabularies['key']==key]
@@ -2895,20 +3072,14 @@ class VocabularyResource(ApiResource):
         Retrieve and cache all of the vocabularies in a two level dict
         - keyed by [scope][key]
         '''
-        vocabularies = cache.get('vocabularies');
+        vocabularies = get_cached('vocabularies');
         if not vocabularies:
             vocabularies = {}
             kwargs = {
                 'limit': '0'
             }
-            request=HttpRequest()
+            request = InternalQueryRequest()
             request.session = Session()
-            class User:
-                is_superuser = True
-#                 @staticmethod
-#                 def is_superuser():
-#                     return true
-            request.user = User
             _data = self._get_list_response(request=request,**kwargs)
             for v in _data:
                 _scope = v['scope']
@@ -2926,7 +3097,7 @@ class VocabularyResource(ApiResource):
                 vocabularies['activity.type'].update(
                     deepcopy(vocabularies['activity.class']))
             
-            cache.set('vocabularies', vocabularies);
+            set_cached('vocabularies', vocabularies, ['reports_vocabulary'])
         if scope in vocabularies:
             return deepcopy(vocabularies[scope])
         else:
@@ -3,9 +3,9 @@ from __future__ import unicode_literals
 from functools import wraps
 import logging
 import re
+from tempfile import SpooledTemporaryFile
 
 from django.conf import settings
-from django.core.cache import cache
 import django.core.exceptions
 from django.http.response import HttpResponseBase, HttpResponse,\
     HttpResponseNotFound, Http404
@@ -28,8 +28,14 @@ from tastypie.cache import NoCache
 from django.conf.urls import url, patterns
 from tastypie.utils.urls import trailing_slash
 
+from reports.utils.table_cache import invalidate_tables
+import reports.utils.request_metrics as request_metrics
+
 logger = logging.getLogger(__name__)
 
+# for streamed deserialization, see IccblBaseResource.deserialize
+MAX_SPOOLFILE_SIZE = 1024*1024
+REQUEST_READ_CHUNK_SIZE = 64*1024
 
 def un_cache(_func):
     '''
@@ -42,6 +48,9 @@ def un_cache(_func):
         self.clear_cache()
         self.set_caching(False)
         result = _func(self, *args, **kwargs)
+        # invalidate again, for entries cached by other requests during the 
+        # write
+        invalidate_tables(self.get_cache_tables())
         self.set_caching(True)
         logger.debug('decorator un_cache done: %s, %s', self, _func )
         return result
@@ -74,6 +83,8 @@ class ResourceOptions(object):
     always_return_data = False
     collection_name = 'objects'
     detail_uri_name = 'pk'
+    # additional tables written by the resource, for cache invalidation
+    cache_tables = None
 
     def __new__(cls, meta=None):
         overrides = {}
@@ -265,10 +276,20 @@ class IccblBaseResource(six.with_metaclass(DeclarativeMetaclass)):
     def wrap_view(self, view):
         """
         Override the tastypie implementation to handle our own ValidationErrors.
+        - record request metrics; see reports.utils.request_metrics
         """
 
         @csrf_exempt
         def wrapper(request, *args, **kwargs):
+            metrics = request_metrics.begin(
+                '%s.%s' % (self._meta.resource_name, view))
+            try:
+                response = handle_view(request, *args, **kwargs)
+            finally:
+                request_metrics.end(metrics)
+            return request_metrics.instrument_response(metrics, response)
+
+        def handle_view(request, *args, **kwargs):
             DEBUG_WRAPPER = True
             try:
                 callback = getattr(self, view)
@@ -378,16 +399,55 @@ class IccblBaseResource(six.with_metaclass(DeclarativeMetaclass)):
 
         return wrapper
 
+    def get_cache_tables(self):
+        '''
+        @return the names of the tables that may be written by this resource:
+        - the queryset model table and its many-to-many tables
+        - any tables listed in Meta.cache_tables
+        '''
+        tables = set()
+        if self._meta.queryset is not None:
+            model_meta = self._meta.queryset.model._meta
+            tables.add(model_meta.db_table)
+            for field in model_meta.many_to_many:
+                tables.add(field.m2m_db_table())
+        if self._meta.cache_tables:
+            tables.update(self._meta.cache_tables)
+        return tables
+        
     def clear_cache(self):
-        logger.debug('clearing the cache from resource: %s (all caches cleared)' 
-            % self._meta.resource_name)
-        cache.clear()
+        '''
+        Invalidate the cached entries that depend on the tables written by 
+        this resource; see reports.utils.table_cache
+        '''
+        tables = self.get_cache_tables()
+        logger.debug('clearing the cache from resource: %s, tables: %r', 
+            self._meta.resource_name, tables)
+        invalidate_tables(tables)
 
     def set_caching(self,use_cache):
         self.use_cache = use_cache
 
-    def deserialize(self, request, format=None):
-        
+    def _spool_request_body(self, request):
+        '''
+        Copy the request body to a temporary file (in memory, up to 
+        MAX_SPOOLFILE_SIZE), so that it may be read as a stream
+        '''
+        spooled = SpooledTemporaryFile(max_size=MAX_SPOOLFILE_SIZE)
+        while True:
+            chunk = request.read(REQUEST_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            spooled.write(chunk)
+        spooled.seek(0)
+        return spooled
+
+    def deserialize(self, request, format=None, stream=False):
+        '''
+        @param stream if True, CSV and XLSX input is read from a file as it is 
+        iterated, rather than deserialized into memory; the input objects
+        are returned as a (re-iterable) reports.serialize.csvutils.StreamedRows
+        '''
         content_type = self._meta.serializer.get_content_type(request, format)
         logger.info('content_type: %r', content_type)
         if content_type.startswith('multipart'):
@@ -410,7 +470,8 @@ class IccblBaseResource(six.with_metaclass(DeclarativeMetaclass)):
                 list_keys = [x for x,y in schema['fields'].items() 
                     if y.get('data_type') == 'list']
                 return self._meta.serializer.deserialize(
-                    file.read(), XLS_MIMETYPE, **{ 'list_keys': list_keys})
+                    file if stream else file.read(), XLS_MIMETYPE, 
+                    **{ 'list_keys': list_keys})
             elif 'csv' in request.FILES:
                 file = request.FILES['csv']
 
@@ -419,7 +480,8 @@ class IccblBaseResource(six.with_metaclass(DeclarativeMetaclass)):
                     if y.get('data_type') == 'list']
                 
                 return self._meta.serializer.deserialize(
-                    file.read(), CSV_MIMETYPE, **{ 'list_keys': list_keys})
+                    file if stream else file.read(), CSV_MIMETYPE, 
+                    **{ 'list_keys': list_keys})
             else:
                 raise BadRequest(
                     'Unsupported multipart file key: %r', request.FILES.keys())
@@ -432,15 +494,20 @@ class IccblBaseResource(six.with_metaclass(DeclarativeMetaclass)):
             schema = self.build_schema()
             list_keys = [x for x,y in schema['fields'].items() 
                 if y.get('data_type') == 'list']
+            if stream:
+                content = self._spool_request_body(request)
+            else:
+                content = request.body
             return self._meta.serializer.deserialize(
-                request.body,content_type,
+                content,content_type,
                 **{ 'list_keys': list_keys})
         else:
             return self._meta.serializer.deserialize(request.body,content_type)
             
     def serialize(self, request, data, format=None):
         content_type = self._meta.serializer.get_accept_content_type(request, format)
-        return self._meta.serializer.serialize(data, content_type)
+        with request_metrics.serialization_timer():
+            return self._meta.serializer.serialize(data, content_type)
 
     def _get_filename(self, schema, kwargs, filename=''):
         filekeys = [filename]
@@ -6,12 +6,15 @@ import logging
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
 from django.db import models
 from django.db import transaction
 from tastypie.utils.dict import dict_strip_unicode_keys
-from aldjemy.core import get_engine
+
+from reports.utils.pg_copy import reserve_ids, copy_rows
+from reports.utils.table_cache import get_cached, set_cached, \
+    invalidate_tables, get_table_versions
 
 
 logger = logging.getLogger(__name__)
@@ -48,14 +51,18 @@ class MetaManager(models.Manager):
         '''
         metahash = {}
         if not clear:
-            metahash = cache.get('metahash:'+scope)
-        else:
-            cache.delete('metahash:'+scope)
+            metahash = get_cached('metahash:'+scope)
             
         if not metahash:
+            # Note: the cached entry is replaced, not deleted, so that it is
+            # published atomically; the table versions are read first, so 
+            # that concurrent writes will invalidate the entry
+            tables = ['reports_metahash','reports_vocabulary']
+            table_versions = get_table_versions(tables)
             metahash = self._get_and_parse(
                 scope=scope, field_definition_scope=field_definition_scope)
-            cache.set('metahash:'+scope, metahash);
+            set_cached('metahash:'+scope, metahash, tables,
+                table_versions=table_versions)
             logger.debug(
                 'get_and_parse done, for %r, hash found: %r', 
                 scope, metahash.keys())
@@ -78,37 +85,56 @@ class MetaManager(models.Manager):
             'get_and_parse table field definitions for scope: %r, fds: %r',
             scope, field_definition_scope)
         # try to make clear that the field definitions, though stored in the 
-        # metahash as well, could be in a separate table
-        field_definition_table = MetaHash.objects.all().filter(
-            scope=field_definition_scope)
-        if not field_definition_table:
+        # metahash as well, could be in a separate table;
+        # the objects themselves are stored in the metahash table as well
+        field_definition_keys = []
+        unparsed_objects = []
+        for metahash in (MetaHash.objects.all()
+                .filter(scope__in=[scope, field_definition_scope])
+                .order_by('ordinal')):
+            if metahash.scope == field_definition_scope:
+                field_definition_keys.append(metahash.key)
+            if metahash.scope == scope:
+                unparsed_objects.append(metahash)
+        if not field_definition_keys:
             logger.warn('field definitions not found for: %r',
                 field_definition_scope)
             return {}
-        logger.debug('field_definition_table: %r', field_definition_table)
-        # the objects themselves are stored in the metahash table as well
-        unparsed_objects = \
-            MetaHash.objects.all().filter(scope=scope).order_by('ordinal')
+        logger.debug('field_definition_keys: %r', field_definition_keys)
         logger.debug('unparsed_objects: %r', unparsed_objects)
+        
+        model_field_names = set(MetaHash._meta.get_all_field_names())
         parsed_objects = OrderedDict()
         for unparsed_object in unparsed_objects:
+            field_hash = unparsed_object.get_field_hash()
             parsed_object = {}
             # only need the key from the field definition table
-            for field_key in [ x.key for x in field_definition_table]:  
-                parsed_object.update(
-                    { field_key : unparsed_object.get_field(field_key) })
-            
-            # NOTE: choices for the "vocabulary_scope_ref" are being stored 
-            # here for convenience
-            
-            if parsed_object.get(u'vocabulary_scope_ref'):
-                vocab_ref = parsed_object['vocabulary_scope_ref']
-                parsed_object['choices'] = [
-                    x.key for x in Vocabulary.objects.all().filter(
-                        scope=vocab_ref)]
-            
-            parsed_objects[unparsed_object.key] = \
-                dict_strip_unicode_keys(parsed_object)
+            for field_key in field_definition_keys:
+                if field_key in model_field_names:
+                    parsed_object[field_key] = \
+                        getattr(unparsed_object, field_key)
+                else:
+                    parsed_object[field_key] = field_hash.get(field_key)
+            parsed_objects[unparsed_object.key] = parsed_object
+        
+        # NOTE: choices for the "vocabulary_scope_ref" are being stored 
+        # here for convenience
+        vocab_refs = set([
+            x.get(u'vocabulary_scope_ref') for x in parsed_objects.values()
+                if x.get(u'vocabulary_scope_ref')])
+        vocab_choices = {}
+        if vocab_refs:
+            for vocab_scope, vocab_key in (Vocabulary.objects.all()
+                    .filter(scope__in=vocab_refs)
+                    .order_by('id')
+                    .values_list('scope','key')):
+                vocab_choices.setdefault(vocab_scope, []).append(vocab_key)
+        
+        for key, parsed_object in parsed_objects.items():
+            vocab_ref = parsed_object.get(u'vocabulary_scope_ref')
+            if vocab_ref:
+                parsed_object['choices'] = vocab_choices.get(vocab_ref, [])
+            parsed_objects[key] = dict_strip_unicode_keys(parsed_object)
 
         return parsed_objects
 
@@ -218,56 +244,77 @@ class ApiLog(models.Model):
             LogDiff.objects.bulk_create(bulk_create_diffs)
         else:
             # Note: this option should not be used for bulk creation
+            extant_diffs = { 
+                logdiff.field_key: logdiff 
+                    for logdiff in self.logdiff_set.all() }
+            bulk_create_diffs = []
             for key,diffs in self.diffs.items():
                 assert isinstance(diffs, (list,tuple))
                 assert len(diffs) == 2
-                found = False
-                for logdiff in self.logdiff_set.all():
-                    if logdiff.field_key == key:
-                        logdiff.before = diffs[0]
-                        logdiff.after = diffs[1]
-                        logdiff.save()
-                        found = True
-                if not found:
-                    LogDiff.objects.create(
+                logdiff = extant_diffs.get(key)
+                if logdiff is not None:
+                    logdiff.before = diffs[0]
+                    logdiff.after = diffs[1]
+                    logdiff.save()
+                else:
+                    bulk_create_diffs.append(LogDiff(
                         log=self,
                         field_key = key,
                         field_scope = 'fields.%s' % self.ref_resource_name,
                         before=diffs[0],
-                        after=diffs[1])
+                        after=diffs[1]))
+            LogDiff.objects.bulk_create(bulk_create_diffs)
                         
-    @staticmethod
+    @staticmethod   
     def bulk_create(logs):
         '''
-        Utility method - bulk create/save ApiLog instances
+        Utility method - bulk create/save ApiLog instances:
+        - ids are reserved from the apilog sequence, so that concurrent 
+        writers do not collide
+        - ApiLog and LogDiff rows are written using "COPY FROM"
         '''
-
-        logger.debug('bulk create logs: %r', logs)
+        logger.debug('bulk create logs: %d', len(logs))
+        if not logs:
+            return logs
+        
+        apilog_fields = [
+            f for f in ApiLog._meta.concrete_fields if f.column != 'id']
+        logdiff_fields = [
+            LogDiff._meta.get_field(name) for name in 
+                ('log','field_key','field_scope','before','after')]
+        
+        def apilog_rows():
+            for log in logs:
+                yield [log.id] + [
+                    f.get_db_prep_save(getattr(log, f.attname), connection)
+                        for f in apilog_fields ]
+        
+        def logdiff_rows():
+            for log in logs:
+                field_scope = 'fields.%s' % log.ref_resource_name
+                for key, logdiffs in log.diffs.items():
+                    values = (log.id, key, field_scope, logdiffs[0], logdiffs[1])
+                    yield [
+                        f.get_db_prep_save(val, connection) 
+                            for f,val in zip(logdiff_fields, values) ]
+        
         with transaction.atomic():
-            with get_engine().connect() as conn:
-                last_id = int(
-                    conn.execute(
-                        'select last_value from reports_apilog_id_seq;')
-                        .scalar() or 0)
-                ApiLog.objects.bulk_create(logs)
-                #NOTE: Before postgresql & django 1.10 only: 
-                # ids must be manually created on bulk create
-                for i,log in enumerate(logs):
-                    log.id = last_id+i+1
-            
-                bulk_create_diffs = []
-                for i,log in enumerate(logs):
-                    for key, logdiffs in log.diffs.items():
-                        bulk_create_diffs.append(
-                            LogDiff(
-                                log=log,
-                                field_key = key,
-                                field_scope = 'fields.%s' % log.ref_resource_name,
-                                before=logdiffs[0],
-                                after=logdiffs[1])
-                        )
-                LogDiff.objects.bulk_create(bulk_create_diffs)
+            with connection.cursor() as cursor:
+                ids = reserve_ids(cursor, ApiLog._meta.db_table, len(logs))
+                for log,log_id in zip(logs, ids):
+                    log.id = log_id
+                copy_rows(
+                    cursor, ApiLog._meta.db_table, 
+                    ['id'] + [f.column for f in apilog_fields], 
+                    apilog_rows())
+                diff_count = copy_rows(
+                    cursor, LogDiff._meta.db_table, 
+                    [f.column for f in logdiff_fields], logdiff_rows())
+            logger.debug('created %d logs, %d diffs', len(logs), diff_count)
             
+            # Note: bulk create does not send the post_save signal
+            invalidate_tables([
+                ApiLog._meta.db_table, LogDiff._meta.db_table])
             return logs
     
 class MetaHash(models.Model):
@@ -21,11 +21,93 @@ def from_csv(csvfile, list_delimiter=LIST_DELIMITER_CSV, list_keys=None):
     NOTES: 
     - nested lists are denoted by brackets, i.e. '[]',
     - to escape use '\[...' (i.e. when embedding a regex expression)
-    TODO: version 2 - read from a stream
+    - see from_csv_stream to read from a stream
     '''
     reader = csv.reader(csvfile)
     return from_csv_iterate(reader, list_delimiter=list_delimiter, list_keys=list_keys)
+
+def from_csv_stream(
+        csvfile, list_delimiter=LIST_DELIMITER_CSV, list_keys=None):
+    '''
+    Returns a StreamedRows for the (seekable, utf-8 encoded) input file; 
+    rows are read from the file as they are iterated. 
+    see from_csv
+    '''
+    def read_rows():
+        csvfile.seek(0)
+        for row in csv.reader(csvfile):
+            yield [force_text(x) for x in row]
+    return StreamedRows(
+        read_rows, list_delimiter=list_delimiter, list_keys=list_keys)
+
+
+class StreamedRows(object):
+    '''
+    A sequence of dicts, parsed (see csv_generator) from the rows of a
+    re-readable input, for deserializing input without holding it in memory:
+    - each iteration reads the input again
+    - the row count, and the first and last rows, are kept from the first 
+    complete iteration; len() reads the input if it has not been iterated
+    - only the first row ([0]), and after a complete iteration the last row
+    ([-1]), may be indexed; other indexes raise an IndexError, rather than
+    reading the input for each access
+    @param read_rows a function that returns an iterator of the input rows;
+    the first row is the header row
+    '''
     
+    def __init__(self, read_rows, list_delimiter=LIST_DELIMITER_CSV, 
+            list_keys=None):
+        self.read_rows = read_rows
+        self.list_delimiter = list_delimiter
+        self.list_keys = list_keys
+        self._count = None
+        self._first = None
+        self._last = None
+    
+    def __iter__(self):
+        count = 0
+        item = None
+        for item in csv_generator(
+                self.read_rows(), list_delimiter=self.list_delimiter, 
+                list_keys=self.list_keys):
+            if count == 0:
+                self._first = item
+            count += 1
+            yield item
+        self._last = item
+        self._count = count
+    
+    def __len__(self):
+        if self._count is None:
+            for row in self:
+                pass
+        return self._count
+    
+    def __getitem__(self, index):
+        if self._count is not None:
+            if index < 0:
+                index += self._count
+            if index < 0 or index >= self._count:
+                raise IndexError(
+                    'StreamedRows index out of range: %r' % index)
+            if index == self._count-1:
+                return self._last
+        if index == 0:
+            if self._first is None:
+                # read the first row only
+                for row in self:
+                    break
+            if self._first is None:
+                raise IndexError('StreamedRows index out of range: 0')
+            return self._first
+        raise IndexError(
+            'StreamedRows are read sequentially; only the first and last '
+            'rows may be indexed: %r' % index)
+    
+    def __repr__(self):
+        return '<StreamedRows(count=%r)>' % self._count
+    
+
 def csv_generator(iterable, list_delimiter=LIST_DELIMITER_CSV, list_keys=None):
     list_keys = list_keys or []
     list_keys = list(list_keys)
@@ -47,7 +129,8 @@ def csv_generator(iterable, list_delimiter=LIST_DELIMITER_CSV, list_keys=None):
                         list_keys.append(key)
                         item[key] = [
                             x.strip() 
-                            for x in val.strip('"[]').split(list_delimiter)]
+                            for x in val.strip('"[]').split(list_delimiter)
+                            if x.strip() ]
             yield item
         i += 1
     logger.debug('read in data, count: %d', i )   
@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+'''
+Resolve the image URIs of image fields (see the field "value_template")
+without dispatching the image view for each row:
+- URIs are matched against the URL conf, and the URL name is mapped to a
+"path resolver" function, registered by the app serving the images, that
+returns the filesystem path of the image (see db.views).
+- existence is tested with a stat call; images are not decoded.
+- URIs are resolved in batches, so that path resolvers may fetch the data
+they need (e.g. reagent SMILES) with one query per batch.
+- URIs without a registered path resolver fall back to dispatching the view.
+'''
+import logging
+import os
+import urlparse
+
+from django.core.urlresolvers import resolve, Resolver404
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+_path_resolvers = {}
+
+def register_path_resolver(url_name, path_resolver):
+    '''
+    @param url_name name of the image URL pattern in the URL conf
+    @param path_resolver function taking a list of the URL keyword argument
+    dicts, and returning the list of image file paths (or None) in the same
+    order
+    '''
+    _path_resolvers[url_name] = path_resolver
+
+def get_image_uris(row, image_keys):
+    '''
+    @return the image URI values of the row
+    '''
+    uris = []
+    for key in image_keys:
+        val = row.get(key)
+        if not val:
+            continue
+        # hack to speed things up:
+        if ( key == 'structure_image' and
+                row.get('library_well_type') and
+                row['library_well_type'].lower() == 'empty' ):
+            continue
+        uris.append(val)
+    return uris
+
+
+class ImageSource(object):
+    '''
+    A resolved image: either a file path, or image data returned by the view
+    '''
+
+    def __init__(self, path=None, data=None):
+        self.path = path
+        self.data = data
+
+    def read(self):
+        if self.data is None:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        return self.data
+
+
+class ImageResolver(object):
+    '''
+    Resolve image URIs to ImageSources, for the duration of a request
+    '''
+
+    def __init__(self, request, batch_size=DEFAULT_BATCH_SIZE):
+        self.request = request
+        self.batch_size = batch_size
+        self.sources = {}
+
+    def resolve(self, uris):
+        '''
+        Resolve the batch of uris; see get
+        '''
+        batches = {}
+        for uri in set(uris):
+            if uri in self.sources:
+                continue
+            self.sources[uri] = None
+            parsed = urlparse.urlparse(uri)
+            try:
+                match = resolve(parsed.path)
+            except Resolver404:
+                logger.info('no image view for: %r', uri)
+                continue
+            if match.url_name in _path_resolvers and not parsed.query:
+                batches.setdefault(match.url_name, []).append(
+                    (uri, match.kwargs))
+            else:
+                self.sources[uri] = self._resolve_by_view(uri, match)
+        for url_name, batch in batches.items():
+            path_resolver = _path_resolvers[url_name]
+            paths = path_resolver([kwargs for uri,kwargs in batch])
+            for (uri,kwargs),path in zip(batch, paths):
+                if path and os.path.isfile(path):
+                    self.sources[uri] = ImageSource(path=path)
+                else:
+                    logger.info('no image at: %r, %r', uri, path)
+
+    def _resolve_by_view(self, uri, match):
+        logger.debug('dispatch image view for %r', uri)
+        kwargs = dict(match.kwargs)
+        kwargs['request'] = self.request
+        try:
+            response = match.func(*match.args, **kwargs)
+            if response.status_code == 200:
+                return ImageSource(data=response.content)
+            logger.info('no image at: %r, status: %r',
+                uri, response.status_code)
+        except Exception, e:
+            logger.info('no image at: %r, %r', uri, e)
+        return None
+
+    def get(self, uri):
+        '''
+        @return the ImageSource for the uri, or None if the image does not
+        exist
+        '''
+        if uri not in self.sources:
+            self.resolve([uri])
+        return self.sources[uri]
+
+    def resolve_rows(self, rows, image_keys):
+        '''
+        Resolve the image URIs of the rows, in batches of batch_size rows;
+        rows are yielded as they are resolved, and sources are retained only
+        for the current batch.
+        @param rows an iterator that returns a dict for each row
+        '''
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                for resolved_row in self._resolve_batch(batch, image_keys):
+                    yield resolved_row
+                batch = []
+        for resolved_row in self._resolve_batch(batch, image_keys):
+            yield resolved_row
+
+    def _resolve_batch(self, rows, image_keys):
+        self.sources = {}
+        uris = []
+        for row in rows:
+            uris.extend(get_image_uris(row, image_keys))
+        self.resolve(uris)
+        return rows
@@ -8,8 +8,12 @@ from __future__ import unicode_literals
 import cStringIO
 from collections import OrderedDict
 import csv
+import datetime
+from decimal import Decimal
 import json
+from json.encoder import encode_basestring_ascii
 import logging
+import math
 import os.path
 import re
 import shutil
@@ -28,9 +32,9 @@ from db.support.data_converter import default_converter
 from reports import LIST_DELIMITER_SQL_ARRAY, \
     MAX_IMAGE_ROWS_PER_XLS_FILE, MAX_ROWS_PER_XLS_FILE, \
     CSV_DELIMITER
-from reports.serialize import XLSX_MIMETYPE, LimsJSONEncoder
-import reports.serialize
+from reports.serialize import XLSX_MIMETYPE, LimsJSONEncoder, json_encoder
 import reports.serialize.csvutils as csvutils
+from reports.serialize.image_resolver import ImageResolver, get_image_uris
 import reports.serialize.sdfutils as sdfutils
 from reports.serialize.xlsutils import generic_xls_write_workbook, \
     xls_write_workbook, write_xls_image, LIST_DELIMITER_XLS
@@ -134,30 +138,22 @@ def image_generator(rows, image_keys, request):
     '''
     Check that any image values in the rows can be fetched:
     - replace the raw value given with the absolute URI
+    - image URIs are resolved in batches, see ImageResolver
     @param rows an iterator that returns a dict for each row
     
     '''
-    for row in rows:
-        for key,val in row.items():
+    image_resolver = ImageResolver(request)
+    for row in image_resolver.resolve_rows(rows, image_keys):
+        image_uris = set(get_image_uris(row, image_keys))
+        for key in image_keys:
+            val = row.get(key)
             if not val:
                 continue
-            if key in image_keys:
-                # hack to speed things up:
-                if ( key == 'structure_image' and
-                        'library_well_type' in row and
-                        row['library_well_type'].lower() == 'empty' ):
-                    row[key] = None
-                else:
-                    try:
-                        # Test whether image exists
-                        image = reports.serialize.resolve_image(request, val)
-                        # If it exists, write the fullpath to the file
-                        fullpath = request.build_absolute_uri(val)
-                        logger.debug('image exists: %r, abs_uri: %r', val, fullpath)
-                        row[key] = fullpath
-                    except Exception, e:
-                        logger.info('no image at: %r, %r', val,e)
-                        row[key] = None
+            if val in image_uris and image_resolver.get(val) is not None:
+                # If it exists, write the fullpath to the file
+                row[key] = request.build_absolute_uri(val)
+            else:
+                row[key] = None
         yield row
 
 
@@ -200,6 +196,135 @@ def json_generator(data, meta, is_for_detail=False):
         raise e                      
 
 
+def _encode_json_default(val):
+    # NOTE, using "ensure_ascii" = True, see json_generator
+    return json.dumps(val, cls=LimsJSONEncoder, ensure_ascii=True, 
+        encoding="utf-8")
+
+def _encode_json_string(val):
+    if isinstance(val, basestring):
+        return encode_basestring_ascii(val)
+    return _encode_json_default(val)
+
+def _encode_json_integer(val):
+    if isinstance(val, (int, long)) and not isinstance(val, bool):
+        return str(val)
+    return _encode_json_default(val)
+
+def _encode_json_decimal(val):
+    # Note: Decimals are serialized as strings, as with the DjangoJSONEncoder
+    if isinstance(val, Decimal):
+        return '"%s"' % str(val)
+    elif isinstance(val, float) and not (math.isnan(val) or math.isinf(val)):
+        return repr(val)
+    # Note: non-finite floats are serialized as "NaN", "Infinity", as with
+    # json.dumps
+    return _encode_json_default(val)
+
+def _encode_json_boolean(val):
+    if val is True:
+        return 'true'
+    elif val is False:
+        return 'false'
+    return _encode_json_default(val)
+
+def _encode_json_date(val):
+    if isinstance(val, (datetime.date, datetime.datetime)):
+        return encode_basestring_ascii(json_encoder.default(val))
+    return _encode_json_default(val)
+    
+def _encode_json_list(val):
+    if isinstance(val, (list, tuple)):
+        return '[%s]' % ','.join([
+            encode_basestring_ascii(x) if isinstance(x, basestring) 
+                else _encode_json_default(x) for x in val])
+    return _encode_json_default(val)
+
+JSON_DATA_TYPE_ENCODERS = {
+    'string': _encode_json_string,
+    'integer': _encode_json_integer,
+    'decimal': _encode_json_decimal,
+    'float': _encode_json_decimal,
+    'boolean': _encode_json_boolean,
+    'date': _encode_json_date,
+    'datetime': _encode_json_date,
+    'list': _encode_json_list,
+}
+
+def get_json_field_encoder(field):
+    '''
+    @return a function to encode values for the field as JSON, 
+    chosen by the field "data_type"
+    '''
+    if field is None:
+        return _encode_json_default
+    if ( field.get('json_field_type',None) == 'fields.ListField' 
+            or field.get('linked_field_type',None) == 'fields.ListField'):
+        return _encode_json_list
+    return JSON_DATA_TYPE_ENCODERS.get(
+        field.get('data_type', None), _encode_json_default)
+
+def compact_json_generator(
+        data, meta, field_hash=None, is_for_detail=False, 
+        chunk_size=1024**2):
+    '''
+    Compact JSON serialization of the rows, yielding chunks of chunk_size:
+    - no indentation, fields are in the row order
+    - row values are encoded using a field encoder chosen by the data_type
+    (see get_json_field_encoder), rows are written directly into the chunk
+    @param field_hash field definitions for the row keys
+    '''
+    if DEBUG_STREAMING: logger.info('meta: %r', meta )
+    if field_hash is None:
+        field_hash = {}
+    
+    field_encoders = {}
+    def get_field_encoder(key):
+        if key not in field_encoders:
+            field_encoders[key] = ( 
+                '%s:' % encode_basestring_ascii(key),
+                get_json_field_encoder(field_hash.get(key, None)))
+        return field_encoders[key]
+    
+    chunk = cStringIO.StringIO()
+    try:
+        if not is_for_detail:
+            chunk.write('{"meta":%s,"objects":[' % _encode_json_default(meta))
+        for rownum, row in enumerate(data):
+            try:
+                if rownum > 0:
+                    chunk.write(',')
+                chunk.write('{')
+                for i, (key, val) in enumerate(row.iteritems()):
+                    (encoded_key, encoder) = get_field_encoder(key)
+                    if i > 0:
+                        chunk.write(',')
+                    chunk.write(encoded_key)
+                    if val is None:
+                        chunk.write('null')
+                    else:
+                        chunk.write(encoder(val))
+                chunk.write('}')
+            except Exception, e:
+                logger.exception('dict: %r', row)
+                raise e
+            if chunk.tell() >= chunk_size:
+                yield chunk.getvalue()
+                chunk.close()
+                chunk = cStringIO.StringIO()
+        logger.debug('streaming finished')
+        
+        if not is_for_detail:
+            chunk.write(']}')
+        if chunk.tell() > 0:
+            yield chunk.getvalue()
+    except Exception, e:
+        logger.exception('json streaming')
+        raise e                      
+    finally:
+        chunk.close()
+
+
 class Echo(object):
     """An object that implements just the write method of the file-like
     interface.
@@ -361,6 +486,14 @@ def get_xls_response(
                 sheet = workbook.add_worksheet(sheet_name)
                 filerow = 0
                 sheets = 1
+                image_resolver = None
+                if image_keys:
+                    if not request:
+                        raise Exception(
+                            'must specify the request parameter for image export')
+                    image_resolver = ImageResolver(request)
+                    sheet_rows = image_resolver.resolve_rows(
+                        sheet_rows, image_keys)
                 for row,values in enumerate(sheet_rows):
                     if filerow == 0:
                         for i,(key,val) in enumerate(values.items()):
@@ -379,15 +512,13 @@ def get_xls_response(
                                     row,key,len(val) )
                             if image_keys and key in image_keys:
                                 max_rows_per_sheet = MAX_IMAGE_ROWS_PER_XLS_FILE
-                                if not request:
-                                    raise Exception(
-                                        'must specify the request parameter for image export')
                                 # hack to speed things up:
                                 if ( key == 'structure_image' and
                                         'library_well_type' in values and
                                         values['library_well_type'].lower() == 'empty' ):
                                     continue
-                                write_xls_image(sheet, filerow, i, val, request)
+                                write_xls_image(sheet, filerow, i, val, request,
+                                    image_resolver=image_resolver)
                             else:
                                 sheet.write_string(filerow,i,val)
                     filerow += 1
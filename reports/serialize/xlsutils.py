@@ -5,6 +5,8 @@ from collections import OrderedDict
 import io
 import logging
 
+from PIL import Image
+from openpyxl import load_workbook
 from tastypie.exceptions import BadRequest
 import xlrd
 import xlsxwriter
@@ -12,10 +14,9 @@ import xlsxwriter
 from db.support.data_converter import default_converter
 from reports import MAX_IMAGE_ROWS_PER_XLS_FILE
 from reports.serialize import csvutils
-import reports.serialize
+from reports.serialize.image_resolver import ImageResolver
 
 
-# from PIL import Image
 logger = logging.getLogger(__name__)
 
 
@@ -70,6 +71,10 @@ def write_rows_to_sheet(wb, sheet_rows, sheet_basename,
     sheet = wb.add_worksheet(sheet_name)
     filerow = 0
     sheets = 1
+    image_resolver = None
+    if image_keys:
+        image_resolver = ImageResolver(request)
+        sheet_rows = image_resolver.resolve_rows(sheet_rows, image_keys)
     for row,values in enumerate(sheet_rows):
         if filerow >= max_rows_per_sheet:
             sheet_name = '%s_%d' % (sheet_basename,sheets)
@@ -99,7 +104,8 @@ def write_rows_to_sheet(wb, sheet_rows, sheet_basename,
                             'library_well_type' in values and
                             values['library_well_type'].lower() == 'empty' ):
                         continue
-                    write_xls_image(sheet, filerow, i, val, request)
+                    write_xls_image(sheet, filerow, i, val, request,
+                        image_resolver=image_resolver)
                 else:
                     sheet.write_string(filerow,i,val)
         filerow += 1
@@ -145,26 +151,29 @@ def generic_write_rows_to_sheet(rows, sheet):
                         row,key,len(val) )
                 sheet.write_string(row,i,val)
 
-def write_xls_image(worksheet, filerow, col, val, request):
+def write_xls_image(worksheet, filerow, col, val, request, image_resolver=None):
     '''
     Retrieve and write an image to the worksheet row, col
+    - the stored image bytes are written as is; only the image header is read
+    to size the cell
+    @param image_resolver ImageResolver, to resolve images in batches
     '''
     logger.debug('write image %r to row: %d col %d', val, filerow, col)
+    if image_resolver is None:
+        image_resolver = ImageResolver(request)
     try:
-        image = reports.serialize.resolve_image(request, val)
+        image_source = image_resolver.get(val)
+        if image_source is None:
+            return
+        image_data = image_source.read()
         fullpath = request.build_absolute_uri(val)
-        # view, args, kwargs = resolve(val)
-        # kwargs['request'] = request
-        # response = view(*args, **kwargs)
-        # image = Image.open(io.BytesIO(response.content))
-        height = image.size[1]
-        width = image.size[0]
+        # Note: Image.open reads the header only; the image is not decoded
+        (width, height) = Image.open(io.BytesIO(image_data)).size
         worksheet.set_row(filerow, height)
         scaling = 0.130 # trial and error width in default excel font
         worksheet.set_column(col,col, width*scaling)
-        bytes = io.BytesIO()
-        image.save(bytes, image.format)
-        worksheet.insert_image(filerow, col, fullpath, {'image_data': bytes })
+        worksheet.insert_image(
+            filerow, col, fullpath, {'image_data': io.BytesIO(image_data) })
     except Exception, e:
         logger.info('no image at: %r, %r', val,e)
 
@@ -190,6 +199,64 @@ def sheet_rows(workbook_sheet):
     for row in range(workbook_sheet.nrows):
         yield read_row(row)
 
+def is_xlsx(file):
+    '''
+    @return True if the (seekable) file is an xlsx (zip) file
+    '''
+    file.seek(0)
+    signature = file.read(4)
+    file.seek(0)
+    return signature == b'PK\x03\x04'
+
+def read_cell_value(value):
+    '''
+    Convert an openpyxl cell value, as for read_string
+    '''
+    if value is None:
+        return None
+    elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        ival = int(value)
+        if value == ival:
+            value = ival
+        return unicode(value)
+    else:
+        value = unicode(value).strip()
+        if not value:
+            return None
+        return value
+
+def read_only_sheet_rows(file):
+    '''
+    Read the rows of the first sheet of the xlsx file, using the openpyxl 
+    "read_only" mode: rows are read as they are iterated.
+    '''
+    file.seek(0)
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        if len(wb.worksheets) > 1:
+            logger.warn('only first page of workbooks supported')
+        for row in wb.worksheets[0].iter_rows():
+            yield [read_cell_value(cell.value) for cell in row]
+    finally:
+        _close_read_only(wb)
+
+def read_only_sheet_name(file):
+    '''
+    @return the name of the first sheet of the xlsx file; the rows are not read
+    '''
+    file.seek(0)
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        return wb.worksheets[0].title
+    finally:
+        _close_read_only(wb)
+
+def _close_read_only(wb):
+    # Note: openpyxl < 2.4 does not close the archive
+    archive = getattr(wb, '_archive', None)
+    if archive is not None:
+        archive.close()
+
 def sheet_rows_dicts(sheet):
     colnames = [xlrd.book.colname(i) for i in range(sheet.ncols)]
     rows = sheet_rows(sheet)
@@ -322,6 +322,24 @@ class XLSSerializer(BaseSerializer):
         return self.from_xls(content, root=root, **kwargs)
 
     def from_xls(self, content, root='objects',**kwargs):
+        '''
+        @param content the workbook contents, or a (seekable) file; xlsx
+        files are read as they are iterated (see csvutils.StreamedRows)
+        '''
+        if hasattr(content, 'read'):
+            if xlsutils.is_xlsx(content):
+                sheet_name = xlsutils.read_only_sheet_name(content)
+                if sheet_name.lower() in ['error', 'errors']:
+                    return xlsutils.read_only_sheet_rows(content)
+                data = csvutils.StreamedRows(
+                    lambda: xlsutils.read_only_sheet_rows(content),
+                    list_delimiter=LIST_DELIMITER_XLS, 
+                    list_keys=kwargs.get('list_keys', None))
+                if root:
+                    return { root: data }
+                else:
+                    return data
+            content = content.read()
         
         if isinstance(content, six.string_types):
             wb = xlrd.open_workbook(file_contents=content)
@@ -400,10 +418,22 @@ class CSVSerializer(BaseSerializer):
 
     def from_csv(self, content, root='objects', **kwargs):
         '''
+        @param content the csv contents, or a (seekable) file; files are read
+            as they are iterated (see csvutils.StreamedRows)
         @param root - property to nest the return object iterable in for the 
             response (None if no nesting, and return object will be an iterable)
 
         '''
+        if hasattr(content, 'read'):
+            objects = csvutils.from_csv_stream(
+                content,
+                list_delimiter=LIST_DELIMITER_CSV,
+                list_keys=kwargs.get('list_keys', None))
+            if root:
+                return { root: objects }
+            else:
+                return objects
+        
         if isinstance(content, six.binary_type):
             content = force_text(content)
          
@@ -440,10 +470,12 @@ class ScreenResultSerializer(XLSSerializer,SDFSerializer,CSVSerializer):
         return self.from_xls(content, **kwargs)
 
     def from_xls(self, content, **kwargs):
-        if isinstance(content, six.string_types):
-            wb = xlrd.open_workbook(file_contents=content)
-        else:
-            wb = xlrd.open_workbook(cStringIO.StringIO(content))
+        '''
+        @param content file, or file contents; xlsx files are read in openpyxl
+        "read_only" mode, so that result value rows are parsed as they are 
+        iterated 
+        '''
+        wb = screen_result_importer.open_workbook(content)
         return screen_result_importer.read_workbook(wb)
 
     def to_json(self, data, options=None):
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
 import hashlib
 import logging
@@ -10,7 +11,7 @@ import sys
 
 from aldjemy.core import get_engine, get_tables
 from django.conf import settings
-from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser
 import django.core.signals 
 import django.db.models.constants
 import django.db.models.sql.constants
@@ -34,15 +35,20 @@ from tastypie.utils.mime import build_content_type
 from reports import LIST_DELIMITER_SQL_ARRAY, LIST_DELIMITER_URL_PARAM, \
     LIST_BRACKETS, MAX_IMAGE_ROWS_PER_XLS_FILE, MAX_ROWS_PER_XLS_FILE, \
     HTTP_PARAM_RAW_LISTS,HTTP_PARAM_DATA_INTERCHANGE, HTTP_PARAM_USE_TITLES,\
-    HTTP_PARAM_USE_VOCAB
+    HTTP_PARAM_USE_VOCAB, HTTP_PARAM_COUNT_MODE, HTTP_PARAM_PRETTY_JSON, \
+    COUNT_MODES, COUNT_MODE_EXACT, COUNT_MODE_ESTIMATE, COUNT_MODE_NONE
 from reports.api_base import IccblBaseResource, un_cache
 from reports.serialize import XLSX_MIMETYPE, SDF_MIMETYPE, XLS_MIMETYPE,\
-    JSON_MIMETYPE, CSV_MIMETYPE, parse_val
+    JSON_MIMETYPE, CSV_MIMETYPE, parse_val, to_simple
 from reports.serialize.csvutils import LIST_DELIMITER_CSV, csv_convert
 from reports.serialize.streaming_serializers import sdf_generator, \
     json_generator, get_xls_response, csv_generator, ChunkIterWrapper, \
-    cursor_generator, image_generator, closing_iterator_wrapper
+    cursor_generator, image_generator, closing_iterator_wrapper, \
+    compact_json_generator
 from reports.serializers import LimsSerializer
+import reports.utils.streaming_engine as streaming_engine
+from reports.utils.table_cache import get_cached, set_cached, \
+    get_statement_tables
 import json
 import pytz
 import urllib
@@ -53,6 +59,46 @@ logger = logging.getLogger(__name__)
 
 DEBUG_FILTERS = False or logger.isEnabledFor(logging.DEBUG)
 
+# request parameters that do not change the statement built for a request
+SHAPE_KEY_EXCLUDED_PARAMS = set([
+    'schema', 'limit', 'offset', 'format', HTTP_PARAM_COUNT_MODE,
+    HTTP_PARAM_PRETTY_JSON])
+
+class SystemUser(AnonymousUser):
+    '''
+    The user for internal queries that are not made on behalf of a request
+    user; see InternalQueryRequest
+    '''
+    username = '__system__'
+    is_superuser = True
+    is_staff = True
+
+    def __repr__(self):
+        return '<SystemUser>'
+
+SYSTEM_USER = SystemUser()
+
+class InternalQueryRequest(HttpRequest):
+    '''
+    Request for in process queries, not made on behalf of a request user; 
+    see SqlAlchemyResource._get_list_response_internal
+    '''
+    is_internal_query = True
+    
+    def __init__(self, user=None):
+        super(InternalQueryRequest, self).__init__()
+        self.user = user or SYSTEM_USER
+
+class InternalQueryResult(object):
+    '''
+    Returned by SqlAlchemyResource.stream_response_from_statement for 
+    internal queries, in place of the serialized response
+    @param rows iterator of row dicts
+    '''
+    def __init__(self, rows, is_for_detail=False):
+        self.rows = rows
+        self.is_for_detail = is_for_detail
+
 def _concat(*args):
     '''
     Use as a replacement for sqlalchemy.sql.functions.concat
@@ -99,6 +145,66 @@ class SqlAlchemyResource(IccblBaseResource):
         count_stmt = select([func.count()]).select_from(stmt.alias())
         return (stmt,count_stmt)
     
+    @staticmethod
+    def get_count_mode(param_hash):
+        '''
+        @return the count mode for list responses, 
+        see reports.COUNT_MODES
+        '''
+        count_mode = param_hash.get(HTTP_PARAM_COUNT_MODE, COUNT_MODE_EXACT)
+        if isinstance(count_mode, (list,tuple)):
+            count_mode = count_mode[0]
+        if not count_mode:
+            count_mode = COUNT_MODE_EXACT
+        count_mode = count_mode.lower()
+        if count_mode not in COUNT_MODES:
+            raise BadRequest(
+                "Invalid %s '%s' provided. Please provide one of %r" 
+                % (HTTP_PARAM_COUNT_MODE, count_mode, COUNT_MODES))
+        return count_mode
+    
+    @staticmethod
+    def estimate_count(conn, stmt):
+        '''
+        Estimate the number of rows returned by the stmt, without executing it:
+        - for an unfiltered select from a single table, use the 
+        pg_class.reltuples statistic
+        - otherwise, use the query planner row estimate (EXPLAIN)
+        '''
+        stmt = stmt.limit(None).offset(None)
+        froms = stmt.froms
+        if ( stmt._whereclause is None and len(froms) == 1 
+                and isinstance(froms[0], sqlalchemy.Table)):
+            count = conn.execute(
+                text('select reltuples::bigint from pg_class '
+                     'where relname = :relname'), 
+                relname=froms[0].name).scalar()
+            # Note: reltuples is 0 or -1 if the table has not been analyzed
+            if count is not None and count > 0:
+                return int(count)
+        compiled = stmt.compile(dialect=conn.dialect)
+        plan = conn.execute(
+            'EXPLAIN %s' % unicode(compiled), compiled.params).fetchone()
+        match = re.search(r'rows=(\d+)', plan[0]) if plan else None
+        if not match:
+            logger.warn('no row estimate found in query plan: %r', plan)
+            return None
+        return int(match.group(1))
+
+    def get_count(self, conn, stmt, count_stmt, count_mode):
+        '''
+        @return the count for the stmt using the count_mode;
+        None for COUNT_MODE_NONE
+        '''
+        if count_mode == COUNT_MODE_NONE:
+            return None
+        elif count_mode == COUNT_MODE_ESTIMATE:
+            count = self.estimate_count(conn, stmt)
+            if count is not None:
+                return count
+            logger.info('no count estimate available, use exact count')
+        return conn.execute(count_stmt).scalar()
+    
     def _convert_request_to_dict(self, request):
         '''
         Transfer all values from GET, then POST to a dict
@@ -678,9 +784,48 @@ class SqlAlchemyResource(IccblBaseResource):
             logger.exception('on build_sqlalchemy_filter_hash')
             raise e   
 
+    @staticmethod
+    @contextmanager
+    def _internal_query(request):
+        '''
+        Mark the request as an internal query for the duration of the block:
+        stream_response_from_statement will return an InternalQueryResult
+        '''
+        previous = request.__dict__.get('is_internal_query', None)
+        request.is_internal_query = True
+        try:
+            yield request
+        finally:
+            if previous is None:
+                del request.is_internal_query
+            else:
+                request.is_internal_query = previous
+    
+    @staticmethod
+    def get_internal_rows(result, field_hash):
+        '''
+        Generate row dicts from the result cursor, with values converted as 
+        for JSON serialization (dates as ISO strings, list fields as lists)
+        '''
+        ordered_keys = sorted(field_hash.keys(), 
+            key=lambda x: field_hash[x].get('ordinal',x))
+        list_fields = [ key for (key,field) in field_hash.items() 
+            if( field.get('json_field_type',None) == 'fields.ListField' 
+                or field.get('linked_field_type',None) == 'fields.ListField'
+                or field.get('data_type', None) == 'list' ) ]
+        value_templates = {key:field['value_template'] 
+            for key,field in field_hash.items() 
+                if field.get('value_template', None)}
+        for row in cursor_generator(
+                result,ordered_keys,list_fields=list_fields,
+                value_templates=value_templates):
+            yield to_simple(row)
+    
     def _get_list_response(self,request,**kwargs):
         '''
-        Return a deserialized list of dicts
+        Return a list of dicts:
+        - the resource statement is built as for get_list, and the rows are
+        read directly from the cursor, see InternalQueryResult
         '''
         includes = kwargs.pop('includes', '*')
         try:
@@ -688,12 +833,16 @@ class SqlAlchemyResource(IccblBaseResource):
                 'get internal list response %s, %s ', 
                 self._meta.resource_name, kwargs)
             kwargs.setdefault('limit', 0)
-            response = self.get_list(
-                request,
-                format='json',
-                includes=includes,
-                **kwargs)
+            with self._internal_query(request):
+                response = self.get_list(
+                    request,
+                    format='json',
+                    includes=includes,
+                    **kwargs)
+                if isinstance(response, InternalQueryResult):
+                    return list(response.rows)
             logger.debug('response: %r', response)
+            # resources that do not build the list from a statement
             _data = self._meta.serializer.deserialize(
                 LimsSerializer.get_content(response), response['Content-Type'])
             _data = _data[self._meta.collection_name]
@@ -712,11 +861,19 @@ class SqlAlchemyResource(IccblBaseResource):
         '''
         logger.info('_get_detail_response: %r, %r', self._meta.resource_name, kwargs)
         try:
-            response = self.get_detail(
-                request,
-                format='json',
-                includes='*',
-                **kwargs)
+            with self._internal_query(request):
+                response = self.get_detail(
+                    request,
+                    format='json',
+                    includes='*',
+                    **kwargs)
+                if isinstance(response, InternalQueryResult):
+                    rows = list(response.rows)
+                    if not rows:
+                        logger.info('no data found for %r, %r', 
+                            self._meta.resource_name, kwargs)
+                        return []
+                    return rows[0]
             _data = []
             if response.status_code == 200:
                 _data = self._meta.serializer.deserialize(
@@ -728,42 +885,101 @@ class SqlAlchemyResource(IccblBaseResource):
         except Http404:
             return []
         
-    #@un_cache
     def _get_detail_response_internal(self, **kwargs):
+        '''
+        Return the detail as a dict, for internal (system) callers
+        '''
         logger.info('kwargs: %r', kwargs)
-        request = HttpRequest()
-        class User:
-            is_superuser = True
-#             @staticmethod
-#             def is_superuser():
-#                 return true
-        request.user = User
-        result = self._get_detail_response(request, **kwargs)
-        return result
+        return self._get_detail_response(InternalQueryRequest(), **kwargs)
 
-    # @un_cache
     def _get_list_response_internal(self, **kwargs):
+        '''
+        Return the list of dicts, for internal (system) callers
+        '''
         logger.info('kwargs: %r', kwargs)
-        request = HttpRequest()
-        class User:
-            is_superuser = True
-#             @staticmethod
-#             def is_superuser():
-#                 return true
-        request.user = User
-        result = self._get_list_response(request, **kwargs)
-        return result
+        return self._get_list_response(InternalQueryRequest(), **kwargs)
+    
+    @staticmethod
+    def get_statement_fingerprint(stmt):
+        '''
+        Fingerprint the statement, without limit and offset, as the hash of 
+        the compiled (parameterized) SQL template combined with the hash of 
+        the bound parameter values.
+        '''
+        stmt = stmt.limit(None).offset(None)
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        template_hash = hashlib.md5(
+            unicode(compiled).encode('utf-8')).hexdigest()
+        params_hash = hashlib.md5(
+            repr(sorted(compiled.params.items()))).hexdigest()
+        return '%s:%s' % (template_hash, params_hash)
+
+    def get_statement_shape_key(self, request, field_hash, param_hash):
+        '''
+        Create a key for the request inputs that determine the statement built 
+        by the resource: resource, user, visible fields and request parameters 
+        (except for paging and formatting).
+        
+        @return None if the parameters contain values that cannot be reliably
+        represented in the key.
+        '''
+        shape_params = []
+        for key, val in param_hash.items():
+            if key in SHAPE_KEY_EXCLUDED_PARAMS:
+                continue
+            vals = val if isinstance(val, (list, tuple)) else [val]
+            for v in vals:
+                if v is not None and not isinstance(
+                        v, (basestring, int, long, float, bool)):
+                    logger.debug(
+                        'statement shape key not available for param: %r, %r', 
+                        key, val)
+                    return None
+            shape_params.append((key, val))
+        username = getattr(getattr(request, 'user', None), 'username', None)
+        key_digest = '%s_%s_%s_%s' % (
+            self._meta.resource_name, username, 
+            ','.join(sorted(field_hash.keys())), repr(sorted(shape_params)))
+        return 'stmt_fingerprint:%s' % hashlib.md5(
+            key_digest.encode('utf-8')).hexdigest()
     
-    def _cached_resultproxy(self, conn, stmt, count_stmt, param_hash, limit, offset):
+    def _get_cached_statement_fingerprint(self, stmt, shape_key=None):
+        '''
+        Get the statement fingerprint:
+        - compile the statement only once per statement shape (shape_key), the
+        fingerprint is then cached for the shape.
+        '''
+        if shape_key is None:
+            return self.get_statement_fingerprint(stmt)
+        fingerprint = get_cached(shape_key)
+        if fingerprint is None:
+            fingerprint = self.get_statement_fingerprint(stmt)
+            # Note: the fingerprint depends on the field definitions as well
+            set_cached(shape_key, fingerprint, 
+                get_statement_tables(stmt) | set(['reports_metahash']))
+        return fingerprint
+
+    @staticmethod
+    def _get_page_cache_key(fingerprint, limit, offset, count_mode):
+        # use a hexdigest because fingerprints can contain problematic chars 
+        # for the memcache
+        return hashlib.md5('%s_%s_%s_%s' % (
+            fingerprint, limit, offset, count_mode)).hexdigest()
+        
+    def _cached_resultproxy(self, conn, stmt, count_stmt, param_hash, limit, 
+            offset, count_mode=COUNT_MODE_EXACT, shape_key=None):
         ''' 
         Cache for resultsets:
         - Always returns the cache object with a resultset, either from the cache,
         or executed herein.
+        - the count is calculated using the count_mode; for COUNT_MODE_NONE, 
+        the count is None and "has_more" is set if more rows are available.
+        - cache keys are generated from the statement fingerprint, limit and
+        offset; if the shape_key is given, the fingerprint is only generated
+        (compiled) once per statement shape.
         
-        NOTE: limit and offset are included because this version of sqlalchemy
-        does not support printing of them with the select.compile() function.
-        
-        TODO: cache clearing on database writes
+        NOTE: cached results record the tables read by the statement, and are 
+        invalidated by writes to those tables; see reports.utils.table_cache
         '''
         DEBUG_CACHE = False or logger.isEnabledFor(logging.DEBUG)
         # Limit check removed with the use of "use_caching" flag
@@ -775,26 +991,15 @@ class SqlAlchemyResource(IccblBaseResource):
             prefetch_number = 1
         
         try:
-            # use a hexdigest because statements can contain problematic chars 
-            # for the memcache
-            m = hashlib.md5()
-            compiled_stmt = str(stmt.compile(
-                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
-            logger.debug('compiled_stmt %s',compiled_stmt)
-            if 'limit' in compiled_stmt.lower():
-                # remove limit and offset; will calculate
-                compiled_stmt = compiled_stmt[:compiled_stmt.lower().rfind('limit')]
-            logger.debug('compiled_stmt for hash key: %s', compiled_stmt)
-            key_digest = '%s_%s_%s' %(compiled_stmt, str(limit), str(offset))
-            logger.debug('key_digest: %r', key_digest)
-            m.update(key_digest)
-            key = m.hexdigest()
-            logger.debug('hash key: digest: %s, key: %s, limit: %s, offset: %s', 
-                key_digest, key, limit, offset)
-            cache_hit = cache.get(key)
+            fingerprint = self._get_cached_statement_fingerprint(
+                stmt, shape_key=shape_key)
+            key = self._get_page_cache_key(fingerprint, limit, offset, count_mode)
+            logger.debug('hash key: fingerprint: %s, key: %s, limit: %s, offset: %s', 
+                fingerprint, key, limit, offset)
+            cache_hit = get_cached(key)
             if cache_hit is not None:
                 if ('stmt' not in cache_hit or
-                        cache_hit['stmt'] != compiled_stmt):
+                        cache_hit['stmt'] != fingerprint):
                     cache_hit = None
                     logger.warn('cache collision for key: %r, %r', key, stmt)
             
@@ -809,16 +1014,21 @@ class SqlAlchemyResource(IccblBaseResource):
                         'new limit for caching: %s',
                         limit, new_limit)
                 if new_limit > 0:
+                    if count_mode == COUNT_MODE_NONE:
+                        # fetch one extra row to determine "has_more"
+                        new_limit += 1
                     stmt = stmt.limit(new_limit)
                 resultset = conn.execute(stmt)
                 prefetched_result = [dict(row) for row in resultset] if resultset else []
                 logger.info('executed stmt %d', len(prefetched_result))
                 
-                logger.info('no cache hit, execute count')
+                logger.info('no cache hit, execute count: %r', count_mode)
                 if limit == 1:
                     count = 1
+                elif count_mode == COUNT_MODE_NONE and limit == 0:
+                    count = len(prefetched_result)
                 else:
-                    count = conn.execute(count_stmt).scalar()
+                    count = self.get_count(conn, stmt, count_stmt, count_mode)
                 logger.info('count: %s', count)
                 
 #                 if count == 1 or count < limit:
@@ -828,13 +1038,17 @@ class SqlAlchemyResource(IccblBaseResource):
 #                         'count': count,
 #                     }
                 
-                if limit==0 and count > settings.MAX_ROWS_FOR_CACHE_RESULTPROXY:
+                if (limit==0 and count is not None 
+                        and count > settings.MAX_ROWS_FOR_CACHE_RESULTPROXY):
                     logger.warn('too many rows to cache: %r, limit: %r, '
                         'see setting"MAX_ROWS_FOR_CACHE_RESULTPROXY"',
                         count, settings.MAX_ROWS_FOR_CACHE_RESULTPROXY)
                     return None
                 
                 # now fill in the cache with the prefetched sets or rows
+                statement_tables = get_statement_tables(stmt)
+                if DEBUG_CACHE:
+                    logger.info('statement tables: %r', statement_tables)
                 for y in range(prefetch_number):
                     new_offset = offset + limit*y;
                     _start = limit*y
@@ -842,23 +1056,24 @@ class SqlAlchemyResource(IccblBaseResource):
                         logger.info('new_offset: %d, start: %d, len: %d', 
                             new_offset, _start, len(prefetched_result))
                     if _start < len(prefetched_result):
-                        key_digest = '%s_%s_%s' %(compiled_stmt, str(limit), str(new_offset))
-                        m = hashlib.md5()
-                        m.update(key_digest)
-                        key = m.hexdigest()
+                        key = self._get_page_cache_key(
+                            fingerprint, limit, new_offset, count_mode)
                         rows_to_fetch = limit
                         if limit==0:
-                            rows_to_fetch = count+1
+                            rows_to_fetch = len(prefetched_result)
                         _result = prefetched_result[_start:_start+rows_to_fetch]
                         _cache = {
-                            'stmt': compiled_stmt,
+                            'stmt': fingerprint,
                             'cached_result': _result,
                             'count': count,
+                            'count_mode': count_mode,
+                            'has_more': 
+                                len(prefetched_result) > _start+rows_to_fetch,
                             'key': key }
                         if DEBUG_CACHE:
                             logger.info('add to cache, key: %s, limit: %s, offset: %s',
                                 key, limit, new_offset)
-                        cache.set( key, _cache, None)
+                        set_cached(key, _cache, statement_tables)
                         if y == 0:
                             cache_hit = _cache
                     else:
@@ -886,6 +1101,8 @@ class SqlAlchemyResource(IccblBaseResource):
         - self.use_caching is True and use_caching is not False and limit > 0
         - limit == 0 and use_caching is True
         
+        Count (for json responses only): the "count_mode" request parameter 
+        determines how the "total_count" is calculated; see reports.COUNT_MODES
         '''
         
         
@@ -922,9 +1139,20 @@ class SqlAlchemyResource(IccblBaseResource):
         stmt = stmt.offset(offset)
         
         conn = get_engine().connect()
+        close_function = conn.close
         
         try:
             logger.debug('offset: %s, limit: %s', offset, limit)
+            
+            if getattr(request, 'is_internal_query', False):
+                # internal query: return the rows, without serialization
+                result = conn.execute(stmt)
+                if rowproxy_generator:
+                    result = rowproxy_generator(result)
+                result = closing_iterator_wrapper(result, conn.close)
+                return InternalQueryResult(
+                    self.get_internal_rows(result, field_hash), 
+                    is_for_detail=is_for_detail)
         
             if DEBUG_STREAMING:
                 logger.info('stmt: %s, param_hash: %s ', 
@@ -942,46 +1170,59 @@ class SqlAlchemyResource(IccblBaseResource):
             logger.debug('---- content_type: %r, hash: %r', content_type, temp_param_hash)
             result = None
             if content_type == JSON_MIMETYPE:
+                count_mode = COUNT_MODE_EXACT
+                if not is_for_detail:
+                    count_mode = self.get_count_mode(param_hash)
+                has_more = None
                 logger.info(
-                    'streaming json, use_caching: %r, self.use_cache: %r, limit: %d, %r', 
-                    use_caching, self.use_cache, limit, is_for_detail)
+                    'streaming json, use_caching: %r, self.use_cache: %r, '
+                    'limit: %d, %r, count_mode: %r', 
+                    use_caching, self.use_cache, limit, is_for_detail, count_mode)
                 if ((self.use_cache is True and use_caching is not False)
                         and ( use_caching is True or limit > 0)):
                     cache_hit = self._cached_resultproxy(
-                        conn, stmt, count_stmt, param_hash, limit, offset)
+                        conn, stmt, count_stmt, param_hash, limit, offset,
+                        count_mode=count_mode, 
+                        shape_key=self.get_statement_shape_key(
+                            request, field_hash, param_hash))
                     if cache_hit:
                         logger.info('cache hit: %r', output_filename)
                         result = cache_hit['cached_result']
                         count = cache_hit['count']
+                        has_more = cache_hit.get('has_more')
                     else:
                         # cache routine should always return a cache object
                         logger.error('error, cache not set: execute stmt')
-                        count = conn.execute(count_stmt).scalar()
+                        count = self.get_count(
+                            conn, stmt, count_stmt, count_mode)
                         result = conn.execute(stmt)
-                        logger.info('result: %r', [x for x in result])    
-                    logger.info('====count: %d====', count)
+                    logger.info('====count: %r====', count)
                     
                 else:
                     logger.info('not cached, execute count stmt...')
-                    count = conn.execute(count_stmt).scalar()
-                    logger.info('excuted count stmt: %d', count)
-                    result = conn.execute(stmt)
+                    count = self.get_count(conn, stmt, count_stmt, count_mode)
+                    logger.info('excuted count stmt: %r', count)
+                    if count_mode == COUNT_MODE_NONE and limit > 0:
+                        # fetch one extra row to determine "has_more"
+                        result = [
+                            row for row in conn.execute(stmt.limit(limit+1))]
+                        has_more = len(result) > limit
+                        result = result[:limit]
+                    else:
+                        result = conn.execute(stmt)
                     logger.info('excuted stmt')
 
-                if not meta:
-                    meta = {
-                        'limit': limit,
-                        'offset': offset,
-                        'total_count': count
-                        }
-                else:
-                    temp = {
-                        'limit': limit,
-                        'offset': offset,
-                        'total_count': count
-                        }
+                temp = {
+                    'limit': limit,
+                    'offset': offset,
+                    'total_count': count,
+                    'count_mode': count_mode
+                    }
+                if count_mode == COUNT_MODE_NONE:
+                    temp['has_more'] = bool(has_more)
+                if meta:
                     temp.update(meta)    
-                    meta = temp
+                meta = temp
                 
                 if rowproxy_generator:
                     result = rowproxy_generator(result)
@@ -998,14 +1239,19 @@ class SqlAlchemyResource(IccblBaseResource):
             else: # not json
             
                 logger.info('excute stmt')
-                result = conn.execute(stmt)
+                if streaming_engine.is_enabled():
+                    # use a server side cursor on a pooled connection
+                    conn.close()
+                    result, close_function = streaming_engine.execute(stmt)
+                else:
+                    result = conn.execute(stmt)
                 logger.info('excuted stmt')
                 
                 if rowproxy_generator:
                     result = rowproxy_generator(result)
                     # FIXME: test this for generators other than json generator        
             
-            result = closing_iterator_wrapper(result, conn.close)
+            result = closing_iterator_wrapper(result, close_function)
             return self.stream_response_from_cursor(request, result, output_filename, 
                 field_hash=field_hash, 
                 param_hash=param_hash, 
@@ -1049,11 +1295,20 @@ class SqlAlchemyResource(IccblBaseResource):
                 
             response = None
             if content_type == JSON_MIMETYPE:
-                response = StreamingHttpResponse(
-                    ChunkIterWrapper(
-                        json_generator(
+                if parse_val(
+                        param_hash.get(HTTP_PARAM_PRETTY_JSON, False),
+                        HTTP_PARAM_PRETTY_JSON, 'boolean'):
+                    response = StreamingHttpResponse(
+                        ChunkIterWrapper(
+                            json_generator(
+                                image_generator(data, image_keys, request), 
+                                meta, is_for_detail=is_for_detail)))
+                else:
+                    response = StreamingHttpResponse(
+                        compact_json_generator(
                             image_generator(data, image_keys, request), 
-                            meta, is_for_detail=is_for_detail)))
+                            meta, field_hash=field_hash,
+                            is_for_detail=is_for_detail))
                 response['Content-Type'] = content_type
             
             elif( content_type == XLS_MIMETYPE or
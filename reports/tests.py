@@ -49,7 +49,10 @@ $ ./manage.py test --settings=lims.test_settings
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 import cStringIO
+import datetime
+from decimal import Decimal
 import json
 import logging
 import os
@@ -63,23 +66,32 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db.utils import ProgrammingError
 from django.http.response import StreamingHttpResponse
 from django.test import TestCase
-from django.test.client import Client, FakePayload
+from django.test.client import Client, FakePayload, RequestFactory
 from django.test.runner import DiscoverRunner
 from django.test.testcases import SimpleTestCase
 from django.utils.encoding import force_text
+from django.utils import timezone
 from tastypie import fields
+from tastypie.exceptions import BadRequest
 
-from reports import dump_obj, HEADER_APILOG_COMMENT
-from reports.api import compare_dicts
+from reports import dump_obj, HEADER_APILOG_COMMENT, LIST_DELIMITER_SQL_ARRAY, \
+    HTTP_PARAM_COUNT_MODE, COUNT_MODE_NONE, COUNT_MODE_ESTIMATE
+from reports.api import compare_dicts, UserGroupAuthorization, \
+    VocabularyResource as VocabularyApiResource
 from reports.dump_obj import dumpObj
-from reports.models import API_ACTION_CREATE, MetaHash
+from reports.models import API_ACTION_CREATE, API_ACTION_DELETE, MetaHash, \
+    ApiLog, UserGroup
 from reports.serialize import parse_val
 import reports.serialize.csvutils as csvutils
+import reports.serialize.streaming_serializers as streaming_serializers
 from reports.serialize.sdfutils import MOLDATAKEY
 from reports.serializers import CSVSerializer, SDFSerializer, \
     LimsSerializer, XLSSerializer
-from reports.sqlalchemy_resource import SqlAlchemyResource
+from reports.sqlalchemy_resource import SqlAlchemyResource, \
+    InternalQueryRequest
 import reports.utils.log_utils
+import reports.utils.request_metrics as request_metrics
+import reports.utils.table_cache as table_cache
 
 
 logger = logging.getLogger(__name__)
@@ -533,6 +545,83 @@ class SerializerTest(TestCase):
         
         # TODO: delete the file
 
+    def test_csv_stream(self):
+        logger.debug('======== test_csv_stream =========')
+        serializer = CSVSerializer() 
+        
+        csv_data = serializer.to_csv([
+            { 'one': 'uno', 'two': '2', 'six': ['a','b','c'] },
+            { 'one': 'dos', 'two': '3', 'six': ['d'] }], root=None)
+        
+        final_data = serializer.from_csv(
+            cStringIO.StringIO(csv_data), root=None)
+        self.assertTrue(
+            isinstance(final_data, csvutils.StreamedRows), final_data)
+        self.assertEqual(len(final_data), 2)
+        self.assertEqual(final_data[1]['one'], 'dos')
+        # the input is read again for each iteration
+        for i in range(2):
+            objs = [obj for obj in final_data]
+            self.assertEqual([obj['one'] for obj in objs], ['uno','dos'])
+            self.assertEqual(objs[0]['six'], ['a','b','c'])
+            self.assertEqual(objs[1]['six'], ['d'])
+
+    def test_xlsx_stream(self):
+        logger.debug('======== test_xlsx_stream =========')
+        from openpyxl import Workbook
+        serializer = XLSSerializer()
+        
+        def write_xlsx(sheet_name, rows):
+            wb = Workbook()
+            ws = wb.active
+            ws.title = sheet_name
+            for row in rows:
+                ws.append(row)
+            output = cStringIO.StringIO()
+            wb.save(output)
+            output.seek(0)
+            return output
+        
+        xlsx_file = write_xlsx('objects', [
+            ['one', 'two', 'six'],
+            ['uno', 2, '[a;b;c]'],
+            ['dos', 3, 'd'],
+            ['tres', 4.5, None]])
+        final_data = serializer.from_xlsx(xlsx_file, root=None)
+        self.assertTrue(
+            isinstance(final_data, csvutils.StreamedRows), final_data)
+        # the first row is read without reading the rest of the input
+        self.assertEqual(final_data[0]['one'], 'uno')
+        self.assertEqual(repr(final_data), '<StreamedRows(count=None)>')
+        # other rows are not indexed before the input is counted
+        self.assertRaises(IndexError, lambda: final_data[-1])
+        
+        objs = [obj for obj in final_data]
+        self.assertEqual([obj['one'] for obj in objs], ['uno','dos','tres'])
+        self.assertEqual([obj['two'] for obj in objs], ['2','3','4.5'])
+        self.assertEqual(objs[0]['six'], ['a','b','c'])
+        self.assertEqual(objs[2].get('six'), None)
+        # the count, and the first and last rows, are kept from the first 
+        # complete iteration
+        self.assertEqual(repr(final_data), '<StreamedRows(count=3)>')
+        self.assertEqual(len(final_data), 3)
+        self.assertTrue(final_data[0] is objs[0])
+        self.assertTrue(final_data[-1] is objs[2])
+        self.assertRaises(IndexError, lambda: final_data[1])
+        self.assertRaises(IndexError, lambda: final_data[3])
+        # the input is read again for each iteration
+        self.assertEqual(
+            [obj['one'] for obj in final_data], ['uno','dos','tres'])
+        
+        errors_file = write_xlsx('errors', [
+            ['well_id', 'error'],
+            ['00001:A01', 'required']])
+        errors = serializer.from_xlsx(errors_file, root=None)
+        self.assertFalse(isinstance(errors, csvutils.StreamedRows), errors)
+        self.assertEqual(
+            list(errors), 
+            [['well_id', 'error'], ['00001:A01', 'required']])
+
 class SDFSerializerTest(SimpleTestCase):
     
     def test1_read(self):
@@ -939,7 +1028,322 @@ class LogCompareTest(TestCase):
 
         self.assertTrue('three' in diff_dict, diff_dict)
         self.assertTrue(diff_dict['two']==['value2a', 'value2b'])
+
+    def test_bulk_create(self):
+        
+        logs = []
+        for i in range(3):
+            log = ApiLog(
+                user_id=1, username='testuser', ref_resource_name='test',
+                key='key%d' % i, uri='test/key%d' % i, 
+                date_time=timezone.now(), api_action=API_ACTION_CREATE)
+            log.diffs = { 
+                'text': [None, 'tab\tnewline\nbackslash\\ %d' % i],
+                'number': [i, i+1] }
+            logs.append(log)
+        ApiLog.bulk_create(logs)
+        
+        ids = [log.id for log in logs]
+        self.assertEqual(len(set(ids)), 3, ids)
+        for log in logs:
+            saved_log = ApiLog.objects.get(id=log.id)
+            self.assertEqual(saved_log.key, log.key)
+            logdiffs = { 
+                x.field_key:x for x in saved_log.logdiff_set.all() }
+            self.assertEqual(
+                logdiffs['text'].after, log.diffs['text'][1])
+            self.assertEqual(logdiffs['text'].before, None)
+            self.assertEqual(
+                logdiffs['number'].after, str(log.diffs['number'][1]))
+
+    def test_log_patches(self):
+        
+        request = RequestFactory().patch('/reports/api/v1/vocabulary')
+        request.user = User(id=1, username='testuser')
+        schema = { 'id_attribute': ['scope', 'key'] }
+        original_data = [
+            { 'scope': 'test', 'key': 'a', 'title': 'A' },
+            { 'scope': 'test', 'key': 'b', 'title': 'B' },
+            # duplicate identity: only the first is matched
+            { 'scope': 'test', 'key': 'b', 'title': 'B duplicate' },
+            { 'scope': 'test', 'key': 'c', 'title': 'C' },
+            ]
+        new_data = [
+            { 'scope': 'test', 'key': 'b', 'title': 'B updated' },
+            { 'scope': 'test', 'key': 'a', 'title': 'A' },
+            { 'scope': 'test', 'key': 'd', 'title': 'D' },
+            ]
+        summary = VocabularyApiResource().log_patches(
+            request, original_data, new_data, schema=schema, batch_size=2)
+        
+        # updated: "b"; created: "d"; deleted: "c" and the duplicate "b"
+        self.assertEqual(summary.count, 4, summary)
+        self.assertEqual(len(summary), 4, summary)
+        self.assertEqual(summary.diff_count, 4, summary)
+        self.assertEqual(summary.create_count, 1, summary)
+        self.assertEqual(summary.delete_count, 2, summary)
         
+        logs = ApiLog.objects.filter(ref_resource_name='vocabulary')
+        self.assertEqual(
+            sorted([log.key for log in 
+                logs.filter(api_action=API_ACTION_DELETE)]), 
+            ['test/b', 'test/c'])
+        self.assertEqual(
+            [log.key for log in logs.filter(api_action=API_ACTION_CREATE)],
+            ['test/d'])
+        updated = logs.exclude(
+            api_action__in=[API_ACTION_CREATE, API_ACTION_DELETE])
+        self.assertEqual([log.key for log in updated], ['test/b'])
+        self.assertEqual(
+            updated[0].logdiff_set.get(field_key='title').after, 'B updated')
+
+
+class TableCacheTest(SimpleTestCase):
+
+    def test_table_scoped_invalidation(self):
+
+        table_cache.set_cached('test_entry1', 'value1', ['table_a','table_b'])
+        table_cache.set_cached('test_entry2', 'value2', ['table_c'])
+        self.assertEqual(table_cache.get_cached('test_entry1'), 'value1')
+        self.assertEqual(table_cache.get_cached('test_entry2'), 'value2')
+
+        table_cache.invalidate_tables(['table_b'])
+
+        self.assertEqual(table_cache.get_cached('test_entry1'), None)
+        self.assertEqual(table_cache.get_cached('test_entry2'), 'value2')
+
+    def test_statement_tables(self):
+
+        from sqlalchemy import select, table, column
+        t1 = table('table_1', column('id'), column('name'))
+        t2 = table('table_2', column('id'), column('t1_id'))
+        t2_alias = t2.alias('t2a')
+        stmt = select([
+            t1.c.name,
+            select([t2_alias.c.id]).where(t2_alias.c.t1_id==t1.c.id)
+                .as_scalar()])
+        self.assertEqual(
+            table_cache.get_statement_tables(stmt), set(['table_1','table_2']))
+
+
+class RequestMetricsTest(SimpleTestCase):
+
+    def test_streamed_response_metrics(self):
+
+        metrics = request_metrics.begin('test.dispatch_list')
+        try:
+            self.assertTrue(request_metrics.get_current() is metrics)
+            request_metrics.record_cache(True)
+            request_metrics.record_cache(False)
+            with request_metrics.sql_timer():
+                pass
+        finally:
+            request_metrics.end(metrics)
+        self.assertTrue(request_metrics.get_current() is None)
+
+        def content():
+            request_metrics.record_sql(0.001)
+            yield b'x'*10
+            yield b'y'*5
+        response = request_metrics.instrument_response(
+            metrics, StreamingHttpResponse(content()))
+        self.assertTrue(
+            'hits=1 misses=1' in response[request_metrics.SERVER_TIMING_HEADER])
+        self.assertEqual(b''.join(response.streaming_content), b'x'*10+b'y'*5)
+        self.assertEqual(metrics.bytes_streamed, 15)
+        self.assertEqual(metrics.sql_count, 2)
+        self.assertTrue(request_metrics.get_current() is None)
+
+
+class InternalQueryTest(SimpleTestCase):
+
+    def test_internal_rows(self):
+
+        field_hash = {
+            'name': { 'ordinal': 0, 'data_type': 'string' },
+            'date_created': { 'ordinal': 1, 'data_type': 'date' },
+            'tags': { 'ordinal': 2, 'data_type': 'list' },
+            'amount': { 'ordinal': 3, 'data_type': 'decimal' },
+            'uri': { 'ordinal': 4, 'value_template': '/test/{name}' },
+            }
+        cursor = [{
+            'name': 'n1', 'date_created': datetime.date(2016,1,2),
+            'tags': LIST_DELIMITER_SQL_ARRAY.join(['a','b']),
+            'amount': Decimal('1.50') }]
+        rows = list(SqlAlchemyResource.get_internal_rows(cursor, field_hash))
+        self.assertEqual(rows, [{
+            'name': 'n1', 'date_created': '2016-01-02', 'tags': ['a','b'],
+            'amount': '1.50', 'uri': '/test/n1' }])
+
+        request = InternalQueryRequest()
+        self.assertTrue(request.is_internal_query)
+        self.assertTrue(request.user.is_superuser)
+
+
+class StatementFingerprintTest(SimpleTestCase):
+
+    def test_fingerprint(self):
+
+        from sqlalchemy import select, table, column
+        t1 = table('table_1', column('id'), column('name'))
+
+        def build_stmt(name):
+            return select([t1.c.id]).where(t1.c.name==name)
+
+        fingerprint = SqlAlchemyResource.get_statement_fingerprint
+        self.assertEqual(
+            fingerprint(build_stmt('a')), fingerprint(build_stmt('a')))
+        self.assertNotEqual(
+            fingerprint(build_stmt('a')), fingerprint(build_stmt('b')))
+        # template hash is shared, parameter hash differs
+        self.assertEqual(
+            fingerprint(build_stmt('a')).split(':')[0],
+            fingerprint(build_stmt('b')).split(':')[0])
+        # limit and offset are not part of the fingerprint
+        self.assertEqual(
+            fingerprint(build_stmt('a')),
+            fingerprint(build_stmt('a').limit(25).offset(50)))
+
+
+class CountModeTest(SimpleTestCase):
+    
+    class FakeResult(object):
+        def __init__(self, value):
+            self.value = value
+        def scalar(self):
+            return self.value
+        def fetchone(self):
+            return (self.value,)
+    
+    class FakeConnection(object):
+        ''' Records statements; returns the reltuples, plan, or count '''
+        
+        def __init__(self, reltuples=None, plan=None, count=None):
+            from sqlalchemy.dialects import postgresql
+            self.dialect = postgresql.dialect()
+            self.reltuples = reltuples
+            self.plan = plan
+            self.count = count
+            self.statements = []
+        
+        def execute(self, stmt, *args, **kwargs):
+            sql = unicode(stmt)
+            self.statements.append(sql)
+            if 'reltuples' in sql:
+                return CountModeTest.FakeResult(self.reltuples)
+            elif sql.startswith('EXPLAIN'):
+                return CountModeTest.FakeResult(self.plan)
+            return CountModeTest.FakeResult(self.count)
+
+    def test_get_count_mode(self):
+        
+        get_count_mode = SqlAlchemyResource.get_count_mode
+        self.assertEqual(get_count_mode({}), 'exact')
+        self.assertEqual(
+            get_count_mode({ HTTP_PARAM_COUNT_MODE: 'NONE' }), COUNT_MODE_NONE)
+        self.assertEqual(
+            get_count_mode({ HTTP_PARAM_COUNT_MODE: [COUNT_MODE_ESTIMATE] }), 
+            COUNT_MODE_ESTIMATE)
+        with self.assertRaises(BadRequest):
+            get_count_mode({ HTTP_PARAM_COUNT_MODE: 'invalid' })
+    
+    def test_estimate_count(self):
+
+        from sqlalchemy import select, Table, MetaData, Column, Integer, Text
+        t1 = Table('table_1', MetaData(), 
+            Column('id', Integer), Column('name', Text))
+        plan = 'Seq Scan on table_1  (cost=0.00..22.70 rows=42 width=4)'
+        
+        # unfiltered single table: use pg_class.reltuples
+        conn = self.FakeConnection(reltuples=1000, plan=plan)
+        stmt = select([t1.c.id]).select_from(t1).limit(25)
+        self.assertEqual(SqlAlchemyResource.estimate_count(conn, stmt), 1000)
+        self.assertEqual(len(conn.statements), 1, conn.statements)
+        
+        # table not analyzed: fallback to EXPLAIN
+        conn = self.FakeConnection(reltuples=-1, plan=plan)
+        self.assertEqual(SqlAlchemyResource.estimate_count(conn, stmt), 42)
+        self.assertTrue(conn.statements[-1].startswith('EXPLAIN'))
+        
+        # filtered: EXPLAIN only
+        conn = self.FakeConnection(reltuples=1000, plan=plan)
+        stmt = select([t1.c.id]).where(t1.c.name=='a')
+        self.assertEqual(SqlAlchemyResource.estimate_count(conn, stmt), 42)
+        self.assertEqual(len(conn.statements), 1, conn.statements)
+        self.assertTrue(conn.statements[0].startswith('EXPLAIN'))
+        self.assertTrue('LIMIT' not in conn.statements[0], conn.statements)
+
+    def test_get_count(self):
+        
+        from sqlalchemy import select, func, Table, MetaData, Column, \
+            Integer, Text
+        t1 = Table('table_1', MetaData(), 
+            Column('id', Integer), Column('name', Text))
+        stmt = select([t1.c.id]).where(t1.c.name=='a')
+        count_stmt = select([func.count()]).select_from(stmt.alias())
+        resource = SqlAlchemyResource()
+        
+        conn = self.FakeConnection(count=7)
+        self.assertEqual(
+            resource.get_count(conn, stmt, count_stmt, COUNT_MODE_NONE), None)
+        self.assertEqual(conn.statements, [])
+        
+        # no plan estimate: fallback to the exact count
+        conn = self.FakeConnection(plan='no estimate', count=7)
+        self.assertEqual(
+            resource.get_count(conn, stmt, count_stmt, COUNT_MODE_ESTIMATE), 7)
+        self.assertEqual(len(conn.statements), 2, conn.statements)
+
+
+class CompactJsonGeneratorTest(SimpleTestCase):
+
+    def test_compact_json(self):
+
+        field_hash = {
+            'name': { 'data_type': 'string' },
+            'count': { 'data_type': 'integer' },
+            'value': { 'data_type': 'decimal' },
+            'is_active': { 'data_type': 'boolean' },
+            'date_created': { 'data_type': 'date' },
+            'tags': { 'data_type': 'list' },
+        }
+        rows = [
+            OrderedDict((
+                ('name', 'r\u00e9sum\u00e9 "1"\n'), ('count', 10),
+                ('value', Decimal('1.50')), ('is_active', True),
+                ('date_created', datetime.date(2016,1,2)),
+                ('tags', ['a','b']), ('unknown', 'x') )),
+            OrderedDict((
+                ('name', None), ('count', '11'), ('value', 2.5),
+                ('is_active', False), ('date_created', None),
+                ('tags', 'c'), ('unknown', 1) )),
+            ]
+        meta = { 'limit': 25, 'offset': 0, 'total_count': 2 }
+
+        expected = json.loads(''.join(
+            streaming_serializers.json_generator(rows, meta)))
+        compact_output = ''.join(
+            streaming_serializers.compact_json_generator(
+                rows, meta, field_hash=field_hash, chunk_size=10))
+        self.assertTrue('\n' not in compact_output, compact_output)
+        self.assertEqual(json.loads(compact_output), expected)
+
+        detail_output = ''.join(
+            streaming_serializers.compact_json_generator(
+                rows[:1], meta, field_hash=field_hash, is_for_detail=True))
+        self.assertEqual(json.loads(detail_output), expected['objects'][0])
+
+        # non-finite floats are serialized as with json.dumps
+        rows = [OrderedDict((('value', float('nan')),)), 
+            OrderedDict((('value', float('inf')),))]
+        compact_output = ''.join(
+            streaming_serializers.compact_json_generator(
+                rows, meta, field_hash=field_hash))
+        self.assertTrue('NaN' in compact_output, compact_output)
+        self.assertTrue('Infinity' in compact_output, compact_output)
+        self.assertEqual(
+            json.loads(compact_output)['objects'][1]['value'], float('inf'))
+
 
 class IResourceTestCase(SimpleTestCase):
    
@@ -1956,6 +2360,42 @@ class VocabularyResource(IResourceTestCase):
             self.assertTrue(
                 result, ('vocab item not found', item, new_obj['objects']))
 
+    def test2_count_modes(self):
+        
+        self.test1_create_read()
+        uri = BASE_URI + '/vocabulary'
+        data_for_get = { 'limit': 1, 'scope__eq': 'test.vocab' }
+        
+        # count_mode=none: no total, "has_more" is set
+        data_for_get[HTTP_PARAM_COUNT_MODE] = COUNT_MODE_NONE
+        resp = self.api_client.get(uri, format='json', 
+            authentication=self.get_credentials(), data=data_for_get)
+        self.assertTrue(
+            resp.status_code in [200], 
+            (resp.status_code, self.get_content(resp)))
+        new_obj = self.deserialize(resp)
+        self.assertEqual(len(new_obj['objects']), 1, new_obj)
+        self.assertTrue(new_obj['meta']['total_count'] is None, new_obj['meta'])
+        self.assertTrue(new_obj['meta']['has_more'] is True, new_obj['meta'])
+
+        # count_mode=estimate: a total is returned
+        data_for_get[HTTP_PARAM_COUNT_MODE] = COUNT_MODE_ESTIMATE
+        resp = self.api_client.get(uri, format='json', 
+            authentication=self.get_credentials(), data=data_for_get)
+        self.assertTrue(
+            resp.status_code in [200], 
+            (resp.status_code, self.get_content(resp)))
+        new_obj = self.deserialize(resp)
+        self.assertTrue(
+            isinstance(new_obj['meta']['total_count'], int), new_obj['meta'])
+        self.assertTrue('has_more' not in new_obj['meta'], new_obj['meta'])
+        
+        data_for_get[HTTP_PARAM_COUNT_MODE] = 'invalid'
+        resp = self.api_client.get(uri, format='json', 
+            authentication=self.get_credentials(), data=data_for_get)
+        self.assertEqual(
+            resp.status_code, 400, (resp.status_code, self.get_content(resp)))
+
 
 class UserUsergroupSharedTest(object):
             
@@ -2426,3 +2866,31 @@ class UserGroupResource(IResourceTestCase, UserUsergroupSharedTest):
         # TODO: could also test that testGroup2 now has super_group=testGroup5
         
         
+    def test7_cached_user_permissions(self):
+        '''
+        Test that the user permissions are cached, and recomputed when the 
+        usergroup membership changes
+        '''
+        logger.info('test7_cached_user_permissions...')
+        
+        self.test2_create_usergroup_with_permissions()
+        
+        user = User.objects.get(username='sde4')
+        permissions = UserGroupAuthorization.get_user_permissions(user)
+        self.assertTrue(('resource','user','read') in permissions, permissions)
+        self.assertTrue(('resource','field','read') in permissions, permissions)
+        
+        user = User.objects.get(username='sde4')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                UserGroupAuthorization.get_user_permissions(user), permissions)
+            self.assertTrue(UserGroupAuthorization()._is_resource_authorized(
+                'user', user, 'read'))
+        
+        UserGroup.objects.get(name='testGroup2').users.remove(user.userprofile)
+        
+        user = User.objects.get(username='sde4')
+        permissions = UserGroupAuthorization.get_user_permissions(user)
+        self.assertFalse(('resource','user','read') in permissions, permissions)
+        self.assertTrue(('resource','field','read') in permissions, permissions)
+        
@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+'''
+PostgreSQL bulk write utilities:
+- reserve_ids: reserve primary key values from a table sequence; ids are
+obtained with "nextval", so that they do not collide with concurrent writers.
+- copy_rows: write rows using "COPY FROM", in the PostgreSQL text format;
+rows are spooled to a temporary file, so that an iterator of any length may
+be written in bounded memory.
+'''
+import datetime
+import logging
+from tempfile import SpooledTemporaryFile
+
+
+logger = logging.getLogger(__name__)
+
+COPY_NULL = '\\N'
+COPY_SEP = '\t'
+MAX_SPOOLFILE_SIZE = 1024*1024
+
+_COPY_ESCAPES = (
+    ('\\', '\\\\'),
+    ('\t', '\\t'),
+    ('\n', '\\n'),
+    ('\r', '\\r'),
+)
+
+def copy_value(val):
+    '''
+    @return the value as a (utf-8 encoded) COPY text format column value
+    '''
+    if val is None:
+        return str(COPY_NULL)
+    if isinstance(val, bool):
+        return b't' if val else b'f'
+    if isinstance(val, (datetime.datetime, datetime.date, datetime.time)):
+        val = val.isoformat()
+    elif not isinstance(val, basestring):
+        val = unicode(val)
+    if isinstance(val, str):
+        val = val.decode('utf-8')
+    for char, escape in _COPY_ESCAPES:
+        if char in val:
+            val = val.replace(char, escape)
+    return val.encode('utf-8')
+
+def reserve_ids(cursor, table, count, id_column='id'):
+    '''
+    Reserve count ids from the sequence of the table id_column; ids are
+    unique, but not necessarily contiguous.
+    @param cursor a DB-API cursor
+    @return the list of reserved ids, in ascending order
+    '''
+    if not count:
+        return []
+    cursor.execute(
+        'select nextval(pg_get_serial_sequence(%s, %s)) '
+        'from generate_series(1, %s)',
+        [table, id_column, count])
+    return sorted([row[0] for row in cursor.fetchall()])
+
+def copy_rows(cursor, table, columns, rows, max_size=MAX_SPOOLFILE_SIZE):
+    '''
+    Write the rows to the table using "COPY FROM"
+    @param cursor a psycopg2 cursor (or a Django cursor wrapper)
+    @param columns the table columns, in row order
+    @param rows an iterable of row value sequences
+    @return the number of rows written
+    '''
+    count = 0
+    with SpooledTemporaryFile(max_size=max_size) as f:
+        for row in rows:
+            f.write(str(COPY_SEP).join([copy_value(val) for val in row]))
+            f.write(b'\n')
+            count += 1
+        if count:
+            f.seek(0)
+            cursor.copy_from(
+                f, table, sep=str(COPY_SEP), null=str(COPY_NULL),
+                columns=columns)
+    logger.debug('copied %d rows to %r', count, table)
+    return count
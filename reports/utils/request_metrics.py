@@ -0,0 +1,264 @@
+from __future__ import unicode_literals
+'''
+Per request instrumentation for the API resources (see
+IccblBaseResource.wrap_view):
+- wall time
+- SQL statement count and time, for both the Django ORM connection and the
+SQLAlchemy (aldjemy) engine
+- serialization time (for streamed responses, the time spent generating the
+streamed content, which includes fetching rows from the database cursor)
+- bytes streamed
+- cache hits and misses (see reports.utils.table_cache)
+
+Metrics are reported in the "Server-Timing" response header; for streamed
+responses the header is sent before the content is generated, so the totals
+are only available in the log line, written (if REQUEST_METRICS_LOG is set)
+when the response is complete.
+'''
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+_local = threading.local()
+_engine_listeners_installed = False
+
+
+class RequestMetrics(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.time()
+        self.end_time = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self.bytes_streamed = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.status_code = None
+
+    @property
+    def wall_time(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'status_code': self.status_code,
+            'wall_ms': round(self.wall_time*1000, 1),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_time*1000, 1),
+            'serialization_ms': round(self.serialization_time*1000, 1),
+            'bytes': self.bytes_streamed,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            }
+
+    def server_timing(self):
+        '''
+        @return the Server-Timing header value
+        '''
+        return ', '.join([
+            'total;dur=%.1f' % (self.wall_time*1000),
+            'sql;dur=%.1f;desc="%d queries"' % (
+                self.sql_time*1000, self.sql_count),
+            'serialize;dur=%.1f' % (self.serialization_time*1000),
+            'cache;desc="hits=%d misses=%d"' % (
+                self.cache_hits, self.cache_misses),
+            ])
+
+    def log(self):
+        if getattr(settings, 'REQUEST_METRICS_LOG', False):
+            logger.info('request metrics: %s', json.dumps(self.as_dict()))
+
+
+class _TimingCursorWrapper(object):
+    '''
+    Wrap a Django cursor to record the SQL statement count and time
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def execute(self, sql, params=None):
+        with sql_timer():
+            return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        with sql_timer():
+            return self.cursor.executemany(sql, param_list)
+
+    def callproc(self, procname, params=None):
+        with sql_timer():
+            return self.cursor.callproc(procname, params)
+
+
+def get_current():
+    '''
+    @return the RequestMetrics for the current thread, or None
+    '''
+    return getattr(_local, 'metrics', None)
+
+def record_sql(duration):
+    metrics = get_current()
+    if metrics is not None:
+        metrics.sql_count += 1
+        metrics.sql_time += duration
+
+def record_cache(hit):
+    metrics = get_current()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+@contextmanager
+def sql_timer():
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_sql(time.time()-start)
+
+@contextmanager
+def serialization_timer():
+    start = time.time()
+    try:
+        yield
+    finally:
+        metrics = get_current()
+        if metrics is not None:
+            metrics.serialization_time += time.time()-start
+
+def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('request_metrics_start', []).append(time.time())
+
+def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('request_metrics_start')
+    if start_times:
+        record_sql(time.time()-start_times.pop())
+
+def instrument_engine(engine):
+    '''
+    Record the SQL statements executed by the SQLAlchemy engine
+    '''
+    import sqlalchemy.event
+    sqlalchemy.event.listen(
+        engine, 'before_cursor_execute', _before_cursor_execute)
+    sqlalchemy.event.listen(
+        engine, 'after_cursor_execute', _after_cursor_execute)
+
+def _install_engine_listeners():
+    global _engine_listeners_installed
+    if _engine_listeners_installed:
+        return
+    from aldjemy.core import get_engine
+    instrument_engine(get_engine())
+    _engine_listeners_installed = True
+
+def _activate(metrics):
+    _local.metrics = metrics
+    connection = connections[DEFAULT_DB_ALIAS]
+    if 'make_cursor' not in connection.__dict__:
+        make_cursor = connection.make_cursor
+        make_debug_cursor = connection.make_debug_cursor
+        connection.make_cursor = \
+            lambda cursor: _TimingCursorWrapper(make_cursor(cursor))
+        connection.make_debug_cursor = \
+            lambda cursor: _TimingCursorWrapper(make_debug_cursor(cursor))
+
+def _deactivate():
+    _local.metrics = None
+    connection = connections[DEFAULT_DB_ALIAS]
+    connection.__dict__.pop('make_cursor', None)
+    connection.__dict__.pop('make_debug_cursor', None)
+
+def is_enabled():
+    return getattr(settings, 'REQUEST_METRICS_ENABLED', True)
+
+def begin(name):
+    '''
+    Start recording metrics for the current request
+    @return the RequestMetrics, or None if not enabled
+    '''
+    if not is_enabled() or get_current() is not None:
+        # nested (internal) requests are recorded in the outer request
+        return None
+    try:
+        _install_engine_listeners()
+    except Exception, e:
+        logger.warn('could not instrument the SQLAlchemy engine: %r', e)
+    metrics = RequestMetrics(name)
+    _activate(metrics)
+    return metrics
+
+def end(metrics):
+    '''
+    Stop recording metrics for the current thread
+    '''
+    if metrics is not None:
+        metrics.end_time = time.time()
+        _deactivate()
+
+def _instrumented_stream(metrics, streaming_content):
+    try:
+        iterator = iter(streaming_content)
+        while True:
+            _activate(metrics)
+            start = time.time()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                metrics.serialization_time += time.time()-start
+                _deactivate()
+            metrics.bytes_streamed += len(chunk)
+            yield chunk
+    finally:
+        metrics.end_time = time.time()
+        metrics.log()
+
+def instrument_response(metrics, response):
+    '''
+    Set the Server-Timing header, and log the metrics when the response is
+    complete; streamed content is wrapped to record the time spent
+    generating it.
+    '''
+    if metrics is None or response is None:
+        return response
+    metrics.status_code = response.status_code
+    response[SERVER_TIMING_HEADER] = metrics.server_timing()
+    if getattr(response, 'streaming', False):
+        metrics.end_time = None
+        response.streaming_content = _instrumented_stream(
+            metrics, response.streaming_content)
+    else:
+        metrics.bytes_streamed = len(response.content)
+        metrics.log()
+    return response
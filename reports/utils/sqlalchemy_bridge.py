@@ -4,18 +4,28 @@ Based on "django-sabridge" at https://github.com/johnpaulett/django-sabridge
 Copyright (c) 2011, John Paulett
 All rights reserved.
 '''
-from sqlalchemy import create_engine, MetaData, Table
-from django.db import connection
+import logging
+import threading
+
 from django.conf import settings
+from django.db import connection
+from sqlalchemy import create_engine, MetaData, Table
 import sqlalchemy.pool
-import logging
+
 
 logger = logging.getLogger(__name__)
 
 class Bridge(object):
+    '''
+    Map the Django database tables to SQLAlchemy Tables, using reflection:
+    - tables are reflected lazily, on first access
+    - reflection, and the creation of the MetaData and engine, are done under
+    a lock, so that the Bridge may be shared by threads
+    '''
     def __init__(self):
         self._meta = None
         self._tables = {}
+        self._lock = threading.RLock()
 
     def connection_url(self):
         """Build a URL for :py:func:`sqlalchemy.create_engine`
@@ -33,10 +43,14 @@ class Bridge(object):
         )
     
     def __getitem__(self, db_table):
-        # not thread-safe, but at worst, we re-autoload the table
-        if db_table not in self._tables:
-            self._tables[db_table] = self._map_model(db_table)
-        return self._tables[db_table]
+        table = self._tables.get(db_table)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(db_table)
+                if table is None:
+                    table = self._map_model(db_table)
+                    self._tables[db_table] = table
+        return table
 
     def _map_model(self, db_table):
         return Table(db_table, self.meta, autoload=True)
@@ -51,18 +65,23 @@ class Bridge(object):
         # Lazily connect to the database. By waiting until meta is
         # needed, we prevent capturing stale connection info from Django
         # (e.g. during a TestCase)
-        if self._meta is None:
-            self._meta = MetaData()
+        if self._meta is not None:
+            return self._meta
+        with self._lock:
+            if self._meta is not None:
+                return self._meta
+            meta = MetaData()
             # set SQLALCHEMY_POOL_CLASS == sqlalchemy.pool.NullPool for testing
             # environments, so that the test database can be destroyed
             if getattr(settings, 'SQLALCHEMY_POOL_CLASS', None):
                 logger.info(str(('using the SQLALCHEMY_POOL_CLASS',settings.SQLALCHEMY_POOL_CLASS)))
-                self._meta.bind = create_engine(self.connection_url(), 
+                meta.bind = create_engine(self.connection_url(), 
                     poolclass=settings.SQLALCHEMY_POOL_CLASS)
             else:
                 # TODO: Not reusing the Django connection:
                 # Consider using Sqlaldjemy which does reuse the Django connection
-                self._meta.bind = create_engine(self.connection_url())
+                meta.bind = create_engine(self.connection_url())
+            self._meta = meta
         return self._meta
 
 
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+'''
+Connections for streamed (non-JSON) responses, e.g. large CSV or XLSX
+exports:
+- a dedicated engine with a bounded connection pool (STREAMING_POOL_SIZE,
+STREAMING_POOL_MAX_OVERFLOW, STREAMING_POOL_TIMEOUT); the aldjemy engine uses
+the Django connection of the request thread, which is not pooled.
+- statements are executed with a server side (named) cursor, so that rows
+are fetched STREAMING_FETCH_SIZE at a time, rather than buffering the whole
+result client side before the first row is sent.
+- a "statement_timeout" (milliseconds) is set for each statement
+(STREAMING_STATEMENT_TIMEOUT, 0 for no timeout).
+- get_pool_status reports the pool metrics.
+'''
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from sqlalchemy import create_engine
+
+import reports.utils.request_metrics as request_metrics
+from reports.utils.sqlalchemy_bridge import urlbuild
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_POOL_MAX_OVERFLOW = 5
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_FETCH_SIZE = 2000
+DEFAULT_STATEMENT_TIMEOUT = 0
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def is_enabled():
+    '''
+    The streaming engine is not used within a transaction, because its
+    connection would not see the uncommitted data of the request.
+    '''
+    return (getattr(settings, 'STREAMING_ENGINE_ENABLED', False)
+        and not connection.in_atomic_block)
+
+def get_engine():
+    global _engine
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            url = urlbuild(
+                scheme=connection.vendor,
+                path=connection.settings_dict['NAME'],
+                username=connection.settings_dict['USER'],
+                password=connection.settings_dict['PASSWORD'],
+                hostname=connection.settings_dict['HOST'],
+                port=connection.settings_dict['PORT'])
+            poolclass = getattr(settings, 'SQLALCHEMY_POOL_CLASS', None)
+            if poolclass:
+                engine = create_engine(url, poolclass=poolclass)
+            else:
+                engine = create_engine(url,
+                    pool_size=getattr(
+                        settings, 'STREAMING_POOL_SIZE', DEFAULT_POOL_SIZE),
+                    max_overflow=getattr(
+                        settings, 'STREAMING_POOL_MAX_OVERFLOW',
+                        DEFAULT_POOL_MAX_OVERFLOW),
+                    pool_timeout=getattr(
+                        settings, 'STREAMING_POOL_TIMEOUT',
+                        DEFAULT_POOL_TIMEOUT))
+            request_metrics.instrument_engine(engine)
+            _engine = engine
+    return _engine
+
+def get_pool_status():
+    '''
+    @return a dict of the pool metrics, or None if the engine is not created,
+    or if the pool is not a QueuePool
+    '''
+    if _engine is None:
+        return None
+    pool = _engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return None
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        }
+
+def execute(stmt, statement_timeout=None):
+    '''
+    Execute the statement with a server side cursor
+    @param statement_timeout in milliseconds, default is the
+    STREAMING_STATEMENT_TIMEOUT setting
+    @return (result, close) where close is the function to call to release
+    the connection, when the result is consumed
+    '''
+    if statement_timeout is None:
+        statement_timeout = getattr(
+            settings, 'STREAMING_STATEMENT_TIMEOUT', DEFAULT_STATEMENT_TIMEOUT)
+    fetch_size = getattr(settings, 'STREAMING_FETCH_SIZE', DEFAULT_FETCH_SIZE)
+
+    conn = get_engine().connect()
+    logger.info('streaming connection, pool: %r', get_pool_status())
+    try:
+        # Note: named cursors must be used within a transaction
+        transaction = conn.begin()
+        conn.execute(
+            'set local statement_timeout = %d' % int(statement_timeout))
+        result = (conn
+            .execution_options(stream_results=True, max_row_buffer=fetch_size)
+            .execute(stmt))
+    except Exception:
+        conn.close()
+        raise
+
+    def close():
+        try:
+            result.close()
+            transaction.rollback()
+        finally:
+            conn.close()
+
+    return (result, close)
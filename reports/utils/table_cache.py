@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+'''
+Table scoped cache invalidation:
+
+Each cached entry records the database tables it was built from, along with
+the current "version" of each table. A write to a table increments the table
+version, so that only the cached entries that depend on that table become
+invalid; entries built from other tables remain available.
+
+- Django ORM writes (save, delete, m2m changes) are tracked automatically
+through model signals.
+- Writes made outside of the ORM (SQLAlchemy statements, bulk_create, COPY)
+must be signaled using invalidate_tables; see
+IccblBaseResource.clear_cache.
+'''
+import logging
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from sqlalchemy.sql.expression import TableClause
+from sqlalchemy.sql.util import find_tables
+
+import reports.utils.request_metrics as request_metrics
+
+
+logger = logging.getLogger(__name__)
+
+TABLE_VERSION_KEY_PREFIX = 'table_version:'
+
+def _version_key(table_name):
+    return TABLE_VERSION_KEY_PREFIX + table_name
+
+def _initial_version():
+    # Note: versions start at a time based value so that a version key that
+    # has been evicted from the cache will not be re-initialized to a value
+    # recorded by a stale entry
+    return int(time.time()*1000)
+
+def get_statement_tables(stmt):
+    '''
+    Find the names of the tables read by an SQLAlchemy statement, including
+    tables referenced in joins, subqueries, aliases and CTEs.
+    '''
+    return set([
+        t.name for t in find_tables(stmt, check_columns=True)
+            if isinstance(t, TableClause)])
+
+def get_table_versions(table_names):
+    '''
+    @return a dict of table_name: version for the table_names; versions are
+    initialized if not yet set.
+    '''
+    table_names = set(table_names)
+    keys = { _version_key(name): name for name in table_names }
+    versions = cache.get_many(keys.keys())
+    table_versions = {}
+    for key, name in keys.items():
+        version = versions.get(key)
+        if version is None:
+            cache.add(key, _initial_version(), None)
+            version = cache.get(key)
+        table_versions[name] = version
+    return table_versions
+
+def invalidate_tables(table_names):
+    '''
+    Invalidate all cached entries that depend on any of the table_names.
+    '''
+    for name in set(table_names):
+        key = _version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # version not yet set (or evicted)
+            cache.set(key, _initial_version(), None)
+    logger.debug('invalidated cache tables: %r', table_names)
+
+def set_cached(key, value, table_names, timeout=None, table_versions=None):
+    '''
+    Cache the value, recording the current versions of the table_names that
+    it depends on.
+    @param table_versions the versions (see get_table_versions) read before 
+    the value was built; if given, the entry is invalid if any of the tables 
+    were written to while the value was built
+    '''
+    if table_versions is None:
+        table_versions = get_table_versions(table_names)
+    cache.set(key, {
+        'table_versions': table_versions,
+        'value': value }, timeout)
+
+def get_cached(key):
+    '''
+    @return the cached value, or None if not cached or if any of the tables
+    that it depends on have been written to since it was cached.
+    '''
+    entry = cache.get(key)
+    if entry is None:
+        request_metrics.record_cache(False)
+        return None
+    if not isinstance(entry, dict) or 'table_versions' not in entry:
+        logger.warn('invalid table cache entry for key: %r', key)
+        request_metrics.record_cache(False)
+        return None
+    recorded_versions = entry['table_versions']
+    if get_table_versions(recorded_versions.keys()) != recorded_versions:
+        logger.debug('cache entry is stale: %r', key)
+        cache.delete(key)
+        request_metrics.record_cache(False)
+        return None
+    request_metrics.record_cache(True)
+    return entry['value']
+
+@receiver(post_save, dispatch_uid='table_cache_post_save')
+@receiver(post_delete, dispatch_uid='table_cache_post_delete')
+def _model_changed(sender, **kwargs):
+    invalidate_tables([sender._meta.db_table])
+
+@receiver(m2m_changed, dispatch_uid='table_cache_m2m_changed')
+def _m2m_changed(sender, action=None, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_tables([sender._meta.db_table])